@@ -0,0 +1,350 @@
+"""Benchmarks for song_index on synthetic libraries.
+
+Run from the repository root, e.g.
+
+    python3 benchmarks/bench_song_index.py bench-search --songs 100000
+    python3 benchmarks/bench_song_index.py bench-walk --songs 5000
+
+The harness (synthetic data, simulated latency, stand-in parsers) lives
+here so the module the server imports carries none of it.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import song_index  # noqa: E402
+
+
+def _time_call(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _synthetic_entries(count, seed=1):
+    rng = random.Random(seed)
+    consonants = 'bcdfghjklmnprstvwz'
+    vowels = 'aeiouy'
+    vocabulary = ['the', 'love', 'light', 'night', 'sunday', 'fire', 'heart', 'you', 'me', 'dance']
+    while len(vocabulary) < 20000:
+        vocabulary.append(''.join(rng.choice(consonants) + rng.choice(vowels) for _ in range(rng.randint(1, 4))))
+
+    def word():
+        # a few very common words plus a long tail, like real song titles
+        if rng.random() < 0.2:
+            return rng.choice(vocabulary[:10]).capitalize()
+        return rng.choice(vocabulary).capitalize()
+
+    entries = []
+    for i in range(count):
+        artist = ' '.join(word() for _ in range(rng.randint(1, 2)))
+        title = ' '.join(word() for _ in range(rng.randint(1, 4)))
+        txt = f'songs/{artist} - {title}/{artist} - {title}.txt'
+        entries.append({'id': i + 1, 'txt': txt, 'audio': txt[:-4] + '.m4a',
+                        'artist': artist, 'title': title, 'display': f'{artist} - {title}'})
+    return entries
+
+
+def bench_search(count, queries, repeat=5):
+    entries = _synthetic_entries(count)
+    t0 = time.perf_counter()
+    catalog = song_index.SongCatalog(entries)
+    print(f'catalog build ({count} songs): {time.perf_counter() - t0:.2f}s, '
+          f'{len(catalog.text_index.postings)} trigrams')
+    print(f'{"query":<16}{"hits":>8}{"linear ms":>12}{"trigram ms":>12}')
+    # full display labels, as picked from suggestions, must match as well
+    queries = list(queries) + [entries[0]['display'], entries[-1]['display']]
+    for q in queries:
+        ql = q.strip().lower()
+        linear_time, linear_hits = _time_call(
+            lambda: [it for it in entries if ql in it.get('display', '').lower()], repeat)
+        index_time, index_hits = _time_call(lambda: catalog.search(q), repeat)
+        print(f'{q[:15]:<16}{len(index_hits):>8}{linear_time * 1000:>12.2f}{index_time * 1000:>12.2f}')
+        missing = {it['id'] for it in linear_hits} - {e.id for e in index_hits}
+        assert not missing, f'trigram search for {q!r} misses {len(missing)} songs the linear scan finds'
+    print(f'{"suggest":<16}{"tier":>8}{"linear ms":>12}{"index ms":>12}')
+    texts = catalog.suggest_index.texts
+    for q in [q[:n] for q in queries for n in (1, 2)] + list(queries):
+        qn = song_index.normalize_text(q)
+        words = [w for w in song_index.TOKEN_SPLIT_REGEX.split(qn) if w]
+        prefix = max(words, key=len)
+
+        def linear():
+            # rank every song the way SuggestIndex does, without the word index
+            keys = []
+            for row, text in enumerate(texts):
+                matching = [len(w) for w in song_index.TOKEN_SPLIT_REGEX.split(text) if w.startswith(prefix)]
+                if not matching or any(w not in text for w in words):
+                    continue
+                tier = 0 if text.startswith(qn) else 1 if '\n' + qn in text else 2 if qn in text else 3
+                keys.append((tier, min(matching)))
+            return sorted(keys)[:8]
+
+        linear_time, expected = _time_call(linear, 1)
+        index_time, pairs = _time_call(lambda: catalog.suggest_index.suggest(qn, 8), repeat)
+        got = sorted(catalog.suggest_index.suggest(qn, 8) and
+                     [(0 if texts[row].startswith(qn) else 1 if '\n' + qn in texts[row] else 2 if qn in texts[row] else 3,
+                       min(len(w) for w in song_index.TOKEN_SPLIT_REGEX.split(texts[row]) if w.startswith(prefix)))
+                      for row, _ in pairs])
+        print(f'{q[:15]:<16}{got[0][0] if got else "-":>8}{linear_time * 1000:>12.2f}{index_time * 1000:>12.2f}')
+        assert got == expected, f'suggest for {q!r} ranks {got} instead of {expected}'
+
+
+def _traced_bytes(build):
+    import gc
+    import tracemalloc
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size, result
+
+
+def memory_report(count, root='/home/usdx/usdx'):
+    """Print bytes per song for the legacy dict index and for SongCatalog."""
+    def synthetic():
+        entries = _synthetic_entries(count)
+        for e in entries:
+            for key in ('txt', 'audio'):
+                e[key] = os.path.join(root, e[key])
+            e['cover'] = os.path.splitext(e['txt'])[0] + ' [CO].jpg'
+            e['language'] = 'English'
+            e['genre'] = 'Pop'
+            e['year'] = 1990 + e['id'] % 30
+        return entries
+
+    def legacy():
+        # SONGS_LIST + SONGS_BY_ID + SONGS_BY_AUDIO as the server used to keep them
+        items = json.loads(json.dumps(synthetic()))
+        by_id = {str(e['id']): e for e in items}
+        by_audio = {os.path.realpath(e['audio']): e for e in items}
+        for e in items:
+            e['_playlist_label'] = song_index.normalize_playlist_label(e['display'])
+        return items, by_id, by_audio
+
+    def records():
+        catalog = song_index.SongCatalog(json.loads(json.dumps(synthetic())))
+        # only the records and lookup maps; indexes are measured separately
+        catalog.text_index = catalog.suggest_index = None
+        return catalog
+
+    def indexes():
+        catalog = song_index.SongCatalog(json.loads(json.dumps(synthetic())))
+        records_only = catalog.entries, catalog._id_rows, catalog.by_audio
+        return records_only, catalog.text_index, catalog.suggest_index
+
+    legacy_bytes, _ = _traced_bytes(legacy)
+    record_bytes, _ = _traced_bytes(records)
+    full_bytes, _ = _traced_bytes(indexes)
+    print(f'{count} songs')
+    print(f'{"legacy dicts + maps":<28}{legacy_bytes / count:>10.0f} B/song {legacy_bytes / 2**20:>9.1f} MiB')
+    print(f'{"SongCatalog records + maps":<28}{record_bytes / count:>10.0f} B/song {record_bytes / 2**20:>9.1f} MiB')
+    index_bytes = full_bytes - record_bytes
+    print(f'{"search indexes":<28}{index_bytes / count:>10.0f} B/song {index_bytes / 2**20:>9.1f} MiB')
+
+
+def bench_load(counts, query='kaze'):
+    """Time cold start to first search result for the JSON and binary index."""
+    print(f'{"songs":>8}{"json MB":>9}{"bin MB":>9}{"json load+search ms":>21}{"bin open+search ms":>20}')
+    for count in counts:
+        with tempfile.TemporaryDirectory() as data_dir:
+            entries = _synthetic_entries(count)
+            json_path = os.path.join(data_dir, song_index.INDEX_FILENAME)
+            song_index._write_json_atomic(json_path, entries, indent=2)
+            song_index.publish_catalog(song_index.SongCatalog(entries, version=1), data_dir)
+            bin_path = os.path.join(data_dir, song_index.BINARY_INDEX_FILENAME)
+            json_time, json_hits = _time_call(lambda: song_index.SongCatalog.load(json_path).search(query), 1)
+            bin_time, bin_hits = _time_call(lambda: song_index.MappedSongCatalog.open(bin_path).search(query), 1)
+            assert [r.id for r in json_hits] == [r.id for r in bin_hits]
+            print(f'{count:>8}{os.path.getsize(json_path) / 2**20:>9.1f}{os.path.getsize(bin_path) / 2**20:>9.1f}'
+                  f'{json_time * 1000:>21.1f}{bin_time * 1000:>20.1f}')
+
+
+def bench_facets(count, query='love', repeat=5):
+    """Time facet filters and counts on a mapped catalog of `count` songs."""
+    rng = random.Random(2)
+    languages = ['English'] * 6 + ['German'] * 2 + ['French', 'Spanish', 'Italian', 'Japanese', 'Swedish']
+    genres = ['Pop', 'Rock', 'Schlager', 'Musical', 'Rap', 'Metal', 'Disco', 'Folk', 'Anime', 'Soundtrack']
+    entries = _synthetic_entries(count)
+    for entry in entries:
+        entry.update(language=rng.choice(languages), genre=rng.choice(genres), year=rng.randint(1955, 2025),
+                     duet=rng.random() < 0.1)
+        if rng.random() < 0.3:
+            entry['video'] = entry['txt'][:-4] + '.mp4'
+    with tempfile.TemporaryDirectory() as data_dir:
+        song_index.publish_catalog(song_index.SongCatalog(entries, version=1), data_dir)
+        catalog = song_index.MappedSongCatalog.open(os.path.join(data_dir, song_index.BINARY_INDEX_FILENAME))
+        load_time, facets = _time_call(lambda: catalog.facets, 1)
+        filters = {'language': ['English', 'German'], 'decade': ['1980s'], 'duet': ['no']}
+
+        def filtered(q, counts):
+            matched = facets.all_rows if not q else song_index.rows_to_mask(catalog.search_rows(q))
+            selected = facets.filter(filters, matched)
+            if counts:
+                facets.counts(matched, filters)
+            return song_index.popcount(selected), song_index.mask_rows(selected, 0, 50)
+
+        print(f'{count} songs, {sum(len(v) for v in facets.bitmaps.values())} facet values, '
+              f'bitmaps loaded in {load_time * 1000:.1f} ms')
+        print(f'{"query":<16}{"hits":>8}{"filter+page ms":>16}{"+counts ms":>12}')
+        for q in ('', query):
+            t_filter, (hits, _) = _time_call(lambda: filtered(q, False), repeat)
+            t_all, _ = _time_call(lambda: filtered(q, True), repeat)
+            print(f'{q or "(all)":<16}{hits:>8}{t_filter * 1000:>16.2f}{t_all * 1000:>12.2f}')
+
+
+def _synthetic_tree(root, count, per_artist=5):
+    """Create `count` song folders below root/library/songs plus symlinks and a loop."""
+    songs = os.path.join(root, 'library', 'songs')
+    for i in range(count):
+        folder = os.path.join(songs, f'Artist {i // per_artist}', f'Artist {i // per_artist} - Song {i}')
+        os.makedirs(folder)
+        with open(os.path.join(folder, f'Artist {i // per_artist} - Song {i}.txt'), 'w') as fh:
+            fh.write(f'#ARTIST:Artist {i // per_artist}\n#TITLE:Song {i}\n')
+    # a second path to some folders and a symlink loop, as found on NAS shares
+    os.symlink(os.path.join(songs, 'Artist 0'), os.path.join(songs, 'Favourites'))
+    os.symlink(songs, os.path.join(songs, 'Artist 0', 'All songs'))
+    return 'library'
+
+
+class _SimulatedLatency:
+    """Delay every os.stat/os.scandir call, standing in for a network mount."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __enter__(self):
+        self.stat, self.scandir = os.stat, os.scandir
+        if self.seconds:
+            def stat(*a, **kw):
+                time.sleep(self.seconds)
+                return self.stat(*a, **kw)
+
+            def scandir(*a, **kw):
+                time.sleep(self.seconds)
+                return self.scandir(*a, **kw)
+            os.stat, os.scandir = stat, scandir
+        return self
+
+    def __exit__(self, *exc):
+        os.stat, os.scandir = self.stat, self.scandir
+
+
+def bench_walk(count, latencies_ms, workers):
+    """Time a full directory walk, serially and with the thread pool."""
+    print(f'{"songs":>8}{"latency ms":>12}{"workers":>9}{"seconds":>10}{"files/s":>10}')
+    with tempfile.TemporaryDirectory() as root:
+        find_root = _synthetic_tree(root, count)
+        for latency in latencies_ms:
+            found = None
+            for n in (1, workers):
+                stats = song_index.ScanStats()
+                with _SimulatedLatency(latency / 1000.0):
+                    _, files = song_index._walk_songs_tree(find_root, root, {}, {}, True, stats, workers=n)
+                assert found is None or set(files) == found
+                found = set(files)
+                print(f'{count:>8}{latency:>12g}{n:>9}{stats.walk_seconds:>10.2f}{stats.files_per_second:>10.0f}')
+
+
+def bench_lyrics(count, words_per_song, queries, repeat=5):
+    """Time building the lyrics index and phrase queries on synthetic lyrics."""
+    rng = random.Random(1)
+    vocabulary = [''.join(rng.choice('aeioulmnrstkd') for _ in range(rng.randint(2, 8))) for _ in range(20000)]
+    vocabulary[:6] = ['i', 'love', 'you', 'the', 'night', 'tonight']
+    # word frequencies of song lyrics roughly follow Zipf's law
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    lyrics = {f'songs/{i}.txt': rng.choices(vocabulary, weights, k=words_per_song) for i in range(count)}
+    entries = [{'id': i, 'txt': f'songs/{i}.txt'} for i in range(count)]
+
+    def parse(fs_path):
+        # stands in for reading the .txt files
+        return lyrics[os.path.relpath(fs_path, '/')]
+
+    def build(path, changed=None):
+        return song_index.build_lyrics_index(entries, '/', path, changed=changed, parse=parse)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        path = os.path.join(data_dir, song_index.LYRICS_INDEX_FILENAME)
+        started = time.time()
+        build(path)
+        full_time = time.time() - started
+        lyrics['songs/0.txt'] = ['a', 'changed', 'song']
+        started = time.time()
+        build(path, changed={'songs/0.txt'})
+        update_time = time.time() - started
+        print(f'{count} songs, {count * words_per_song} words: index {os.path.getsize(path) / 2**20:.1f} MiB, '
+              f'full build {full_time:.1f}s, update of one song {update_time:.1f}s')
+        index = song_index.LyricsIndex.open(path)
+        # a phrase never runs from one duet part into the other
+        lyrics['songs/0.txt'] = ['first', 'part', 'ends', None, 'second', 'part']
+        build(path, changed={'songs/0.txt'})
+        duet = song_index.LyricsIndex.open(path)
+        assert 0 not in {song for song, _ in duet.search('ends second')}, 'phrase crosses a duet part'
+        hits = dict(duet.search('second part'))
+        assert duet.snippet(hits[0], 2) == 'second part', duet.snippet(hits[0], 2)
+        print(f'{"query":<24}{"songs":>8}{"ms":>10}')
+        for query in queries:
+            elapsed, hits = _time_call(lambda: index.search(query), repeat)
+            print(f'{query:<24}{len(hits):>8}{elapsed * 1000:>10.2f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='song_index benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_bench = sub.add_parser('bench-search', help='Compare trigram search against the linear display scan')
+    p_bench.add_argument('--songs', type=int, default=100000, help='Number of synthetic songs (default: 100000)')
+    p_bench.add_argument('--repeat', type=int, default=5, help='Runs per query; best time is reported')
+    p_bench.add_argument('queries', nargs='*', default=['a', 'lo', 'the', 'love', 'sunday', 'kaze', 'dance the', 'xq'])
+    p_mem = sub.add_parser('memory-report', help='Report catalog memory per song before and after the compact representation')
+    p_mem.add_argument('--songs', type=int, default=100000, help='Number of synthetic songs (default: 100000)')
+    p_load = sub.add_parser('bench-load', help='Compare cold start of the JSON and the binary index')
+    p_load.add_argument('--songs', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Library sizes to measure (default: 1000 10000 100000)')
+    # a selective query; broad ones cost time proportional to their hit count
+    p_load.add_argument('--query', default='kaze', help='Search run right after loading (default: kaze)')
+    p_facets = sub.add_parser('bench-facets', help='Time facet filters and counts')
+    p_facets.add_argument('--songs', type=int, default=100000, help='Number of synthetic songs (default: 100000)')
+    p_facets.add_argument('--query', default='love', help='Text query combined with the filters (default: love)')
+    p_walk = sub.add_parser('bench-walk', help='Compare the serial and the parallel directory walk')
+    p_walk.add_argument('--songs', type=int, default=5000, help='Number of synthetic song folders (default: 5000)')
+    p_walk.add_argument('--latency-ms', type=float, nargs='+', default=[0, 2],
+                        help='Delay added to every stat/listing; 0 is local disk (default: 0 2)')
+    p_walk.add_argument('--workers', type=int, default=song_index.WALK_WORKERS,
+                        help=f'Threads of the parallel walk (default: {song_index.WALK_WORKERS})')
+    p_lyrics = sub.add_parser('bench-lyrics', help='Time the lyrics index build and phrase queries')
+    p_lyrics.add_argument('--songs', type=int, default=50000, help='Number of synthetic songs (default: 50000)')
+    p_lyrics.add_argument('--words', type=int, default=250, help='Words of lyrics per song (default: 250)')
+    p_lyrics.add_argument('--repeat', type=int, default=5, help='Runs per query; best time is reported')
+    p_lyrics.add_argument('queries', nargs='*', default=['love', 'i love you', 'tonight', 'the night tonight',
+                                                          'xq'])
+    opts = parser.parse_args(argv)
+    if opts.command == 'bench-search':
+        bench_search(opts.songs, opts.queries, opts.repeat)
+    elif opts.command == 'memory-report':
+        memory_report(opts.songs)
+    elif opts.command == 'bench-load':
+        bench_load(opts.songs, opts.query)
+    elif opts.command == 'bench-facets':
+        bench_facets(opts.songs, opts.query)
+    elif opts.command == 'bench-lyrics':
+        bench_lyrics(opts.songs, opts.words, opts.queries, opts.repeat)
+    elif opts.command == 'bench-walk':
+        bench_walk(opts.songs, opts.latency_ms, opts.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,511 @@
+"""Filesystem change notification for SmartMicrophone.
+
+Inotify is a minimal ctypes binding of the Linux inotify API (no third-party
+dependency). TreeWatcher builds on it to report changed directories below a
+tree and falls back to polling directory mtimes where inotify is not
+available (other platforms, exhausted watch limits). LogTailer follows a
+growing log file the same way.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    """Thin wrapper around an inotify file descriptor.
+
+    Raises OSError if inotify is not available on this system.
+    """
+
+    def __init__(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+            init1 = libc.inotify_init1
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+        except (OSError, AttributeError) as e:
+            raise OSError(f'inotify is not available: {e}')
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        fd = init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f'inotify_init1 failed: {os.strerror(err)}')
+        self.fd = fd
+        self._poll = select.poll()
+        self._poll.register(fd, select.POLLIN)
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """Wait up to `timeout` seconds; return a list of (wd, mask, cookie, name)."""
+        if not self._poll.poll(None if timeout is None else max(0, int(timeout * 1000))):
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = data[pos:pos + length].split(b'\0', 1)[0]
+            pos += length
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class _InotifyTreeSource:
+    """Yields changed directories below `root` from inotify events."""
+
+    MASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_CLOSE_WRITE | IN_DELETE_SELF
+            | IN_MOVE_SELF | IN_ONLYDIR)
+
+    def __init__(self, root, name_filter):
+        self.root = root
+        self.name_filter = name_filter
+        self.inotify = Inotify()
+        self.paths = {}
+        try:
+            self._watch_tree(root)
+        except OSError:
+            self.inotify.close()
+            raise
+
+    def _watch_tree(self, top):
+        # follows symlinks like the song scanner; (dev, inode) guards loops
+        visited = set()
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = (st.st_dev, st.st_ino)
+            if key in visited:
+                continue
+            visited.add(key)
+            try:
+                wd = self.inotify.add_watch(path, self.MASK)
+            except FileNotFoundError:
+                continue
+            except NotADirectoryError:
+                continue
+            self.paths.setdefault(wd, path)
+            try:
+                with os.scandir(path) as it:
+                    for de in it:
+                        try:
+                            if de.is_dir():
+                                stack.append(de.path)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+    def wait(self, timeout):
+        """Return (changed directories, overflowed) seen within `timeout` seconds."""
+        changed = set()
+        overflow = False
+        for wd, mask, _cookie, name in self.inotify.read(timeout):
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+            path = self.paths.get(wd)
+            if path is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed.add(os.path.dirname(path))
+                continue
+            is_dir = bool(mask & IN_ISDIR)
+            if not is_dir and self.name_filter and not self.name_filter(name):
+                continue
+            changed.add(path)
+            if is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                # songs are usually copied as whole folders; watch them too
+                self._watch_tree(os.path.join(path, name))
+        if overflow:
+            # events were lost, including possibly new directories
+            self._watch_tree(self.root)
+        return changed, overflow
+
+    def close(self):
+        self.inotify.close()
+
+
+class _PollingTreeSource:
+    """Compares directory mtimes below `root` every `interval` seconds.
+
+    Only notices entries being added, removed or renamed (what changes a
+    directory's mtime), not files modified in place.
+    """
+
+    def __init__(self, root, interval, stop_event):
+        self.root = root
+        self.interval = interval
+        self.stop_event = stop_event
+        self.mtimes = self._snapshot()
+
+    def _snapshot(self):
+        mtimes = {}
+        visited = set()
+        stack = [self.root]
+        while stack:
+            path = stack.pop()
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = (st.st_dev, st.st_ino)
+            if key in visited:
+                continue
+            visited.add(key)
+            mtimes[path] = st.st_mtime_ns
+            try:
+                with os.scandir(path) as it:
+                    for de in it:
+                        try:
+                            if de.is_dir():
+                                stack.append(de.path)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return mtimes
+
+    def wait(self, timeout):
+        if self.stop_event.wait(max(timeout, self.interval)):
+            return set(), False
+        mtimes = self._snapshot()
+        changed = {path for path, mtime in mtimes.items() if self.mtimes.get(path) != mtime}
+        changed.update(os.path.dirname(path) for path in self.mtimes if path not in mtimes)
+        self.mtimes = mtimes
+        return changed, False
+
+    def close(self):
+        pass
+
+
+class TreeWatcher:
+    """Report changes below `root` to `callback` from a background thread.
+
+    `callback(paths)` receives the set of directories whose entries changed,
+    or None after an inotify queue overflow (everything must be rechecked).
+    Events are coalesced: the callback runs once no new change arrived for
+    `settle` seconds, or at the latest `max_delay` seconds after the first
+    pending change, so copying hundreds of songs causes a handful of calls.
+    `name_filter(name)` can restrict which file names count as a change;
+    directory events always do.
+    """
+
+    def __init__(self, root, callback, settle=2.0, max_delay=15.0, poll_interval=10.0, name_filter=None,
+                 use_inotify=True):
+        self.root = root
+        self.callback = callback
+        self.settle = settle
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.name_filter = name_filter
+        self.use_inotify = use_inotify
+        self.mode = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='tree-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _open_source(self):
+        if self.use_inotify:
+            try:
+                source = _InotifyTreeSource(self.root, self.name_filter)
+                self.mode = 'inotify'
+                logger.info('Watching %s with inotify (%d directories)', self.root, len(source.paths))
+                return source
+            except OSError as e:
+                logger.warning('inotify unavailable for %s (%s); polling every %.0fs instead',
+                               self.root, e, self.poll_interval)
+        self.mode = 'polling'
+        return _PollingTreeSource(self.root, self.poll_interval, self._stop)
+
+    def _run(self):
+        try:
+            source = self._open_source()
+        except Exception:
+            logger.exception('Failed to start watching %s', self.root)
+            return
+        pending = set()
+        overflow = False
+        first = last = None
+        try:
+            while not self._stop.is_set():
+                timeout = self.settle if (pending or overflow) else 1.0
+                try:
+                    changed, lost = source.wait(timeout)
+                except Exception:
+                    logger.exception('Error while watching %s', self.root)
+                    self._stop.wait(self.poll_interval)
+                    continue
+                now = time.monotonic()
+                if changed or lost:
+                    pending.update(changed)
+                    overflow = overflow or lost
+                    last = now
+                    if first is None:
+                        first = now
+                if first is None:
+                    continue
+                if now - last >= self.settle or now - first >= self.max_delay:
+                    paths = None if overflow else pending
+                    pending = set()
+                    overflow = False
+                    first = last = None
+                    try:
+                        self.callback(paths)
+                    except Exception:
+                        logger.exception('Change callback for %s failed', self.root)
+        finally:
+            source.close()
+
+
+class LogTailer:
+    """Pass every complete line appended to a log file to `callback(line)`.
+
+    The file stays open. New data is read as soon as inotify reports a write
+    in its directory, or every `poll_interval` seconds where inotify is not
+    available. `locate()` returns the path to follow; it is asked again on
+    every wakeup, so the caller can switch files. A file that already
+    exists when it is first looked at is read from its end; a file that
+    appears later under the followed name (creation after start, rotation or
+    recreation, told apart by its inode) is read from the start after the
+    rest of the old one. A file that was truncated or rewritten in place
+    (same inode, as USDX does with Error.log) is read again from the top:
+    it either shrank below the read position or the last bytes read before
+    that position changed, which never happens to a file that is only
+    appended to. An unterminated last line is held back until its newline
+    arrives.
+    """
+
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_ATTRIB
+    # bytes before the read position compared to notice an in-place rewrite
+    MARK_SIZE = 64
+
+    def __init__(self, locate, callback, poll_interval=1.0, idle_interval=10.0, use_inotify=True,
+                 encoding='utf-8'):
+        self.locate = locate
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.idle_interval = idle_interval
+        self.use_inotify = use_inotify
+        self.encoding = encoding
+        self.mode = None
+        self.path = None
+        self._last_path = None
+        self._fh = None
+        self._ident = None
+        self._pos = 0
+        self._mark = b''
+        self._partial = b''
+        self._inotify = None
+        self._wd = None
+        self._watch_dir = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-tailer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch(self, directory):
+        if self._inotify is None or directory == self._watch_dir:
+            return
+        if self._wd is not None:
+            self._inotify.rm_watch(self._wd)
+            self._wd = None
+        self._watch_dir = directory
+        try:
+            self._wd = self._inotify.add_watch(directory, self.MASK | IN_ONLYDIR)
+        except OSError as e:
+            # e.g. the directory does not exist yet; polled until it does
+            logger.debug('Cannot watch %s (%s); polling', directory, e)
+            self._watch_dir = None
+
+    def _open(self, seek_end):
+        try:
+            fh = open(self.path, 'rb')
+        except OSError:
+            return
+        st = os.fstat(fh.fileno())
+        self._fh = fh
+        self._ident = (st.st_dev, st.st_ino)
+        self._pos = st.st_size if seek_end else 0
+        self._partial = b''
+        fh.seek(max(0, self._pos - self.MARK_SIZE))
+        self._mark = fh.read(self._pos - fh.tell())
+
+    def _close(self):
+        if self._fh is not None:
+            if self._partial:
+                # nothing more will be written to this file
+                self._emit(self._partial)
+                self._partial = b''
+            self._fh.close()
+            self._fh = None
+            self._ident = None
+
+    def _emit(self, raw):
+        line = raw.decode(self.encoding, errors='ignore').rstrip('\r')
+        try:
+            self.callback(line)
+        except Exception:
+            logger.exception('Log line callback failed for %s', self.path)
+
+    def _read(self):
+        fh = self._fh
+        rewritten = os.fstat(fh.fileno()).st_size < self._pos
+        if not rewritten and self._mark:
+            # leaves the file at the read position
+            fh.seek(self._pos - len(self._mark))
+            rewritten = fh.read(len(self._mark)) != self._mark
+        if rewritten:
+            logger.info('%s was truncated or rewritten; reading it from the start', self.path)
+            fh.seek(0)
+            self._pos = 0
+            self._mark = b''
+            self._partial = b''
+        data = fh.read()
+        if not data:
+            return
+        self._pos += len(data)
+        self._mark = (self._mark + data[-self.MARK_SIZE:])[-self.MARK_SIZE:]
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        for raw in lines:
+            self._emit(raw)
+
+    def _sync(self):
+        path = self.locate()
+        if path != self.path:
+            self._close()
+            self.path = path
+            if path:
+                self._watch(os.path.dirname(path) or '.')
+        if not self.path:
+            return
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            st = None
+        if self._fh is not None:
+            # finish the open file first, even if it was just rotated away
+            self._read()
+            if st is None or (st.st_dev, st.st_ino) != self._ident:
+                logger.info('%s was replaced; following the new file', self.path)
+                self._close()
+        if self._fh is None:
+            if st is None:
+                # seen missing: whatever appears here later is new and read whole
+                self._last_path = self.path
+                return
+            self._open(seek_end=self.path != self._last_path)
+            self._last_path = self.path
+            if self._fh is not None:
+                self._read()
+
+    def _wait(self):
+        """Block until something may have happened to the followed file."""
+        if self._inotify is None or self._wd is None:
+            self._stop.wait(self.poll_interval)
+            return
+        deadline = time.monotonic() + (self.idle_interval if self._fh is not None else self.poll_interval)
+        name = os.path.basename(self.path or '')
+        while not self._stop.is_set():
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return
+            # other files in the directory are ignored
+            for wd, mask, _cookie, event_name in self._inotify.read(timeout):
+                if mask & IN_IGNORED and wd == self._wd:
+                    # the directory itself went away
+                    self._wd = None
+                    self._watch_dir = None
+                    return
+                if mask & IN_Q_OVERFLOW or event_name == name:
+                    return
+
+    def _run(self):
+        if self.use_inotify:
+            try:
+                self._inotify = Inotify()
+                self.mode = 'inotify'
+            except OSError as e:
+                logger.warning('inotify unavailable (%s); polling log files every %.1fs', e, self.poll_interval)
+        if self._inotify is None:
+            self.mode = 'polling'
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._sync()
+                    if self._inotify is not None and self.path and self._wd is None:
+                        self._watch(os.path.dirname(self.path) or '.')
+                except Exception:
+                    logger.exception('Error while following %s', self.path)
+                    self._stop.wait(self.poll_interval)
+                self._wait()
+        finally:
+            self._close()
+            if self._inotify is not None:
+                self._inotify.close()
+
@@ -0,0 +1,182 @@
+"""On-disk cache for media derived from song files (e.g. cover thumbnails).
+
+Every cached file is produced once, by a build function running in a small
+worker pool; concurrent requests for the same key wait for the same job. The
+cache directory is bounded in size and evicts the least recently used files.
+Keys should include everything the output depends on (source path, its
+mtime and size, output parameters), so a changed source never hits a stale
+file.
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import threading
+
+logger = logging.getLogger(__name__)
+
+_FFMPEG_PATH = None
+
+
+def find_ffmpeg():
+    """Return the path of the ffmpeg binary, or None if it is not installed."""
+    global _FFMPEG_PATH
+    if _FFMPEG_PATH is None:
+        _FFMPEG_PATH = shutil.which('ffmpeg') or ''
+    return _FFMPEG_PATH or None
+
+
+def run_ffmpeg(args, timeout=30):
+    """Run ffmpeg with `args`; returns True on success."""
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        return False
+    cmd = [ffmpeg, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y'] + list(args)
+    try:
+        proc = subprocess.run(cmd, capture_output=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.warning('ffmpeg timed out after %ss: %s', timeout, ' '.join(cmd))
+        return False
+    except OSError as e:
+        logger.warning('Failed to run ffmpeg: %s', e)
+        return False
+    if proc.returncode != 0:
+        logger.warning('ffmpeg failed (%s): %s', proc.returncode,
+                       proc.stderr.decode('utf-8', errors='replace').strip()[-500:])
+        return False
+    return True
+
+
+class MediaCache:
+    """Size-bounded directory of generated files, one per key."""
+
+    def __init__(self, directory, max_bytes, workers=2, suffix=''):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        # key -> size in bytes, least recently used first
+        self._files = collections.OrderedDict()
+        self._bytes = 0
+        self._jobs = {}
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers),
+                                                           thread_name_prefix='media-cache')
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(*parts):
+        raw = '\0'.join(str(p) for p in parts).encode('utf-8', 'surrogateescape')
+        return hashlib.sha1(raw).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _load(self):
+        existing = []
+        try:
+            with os.scandir(self.directory) as it:
+                for de in it:
+                    try:
+                        if '.tmp' in de.name:
+                            # left behind by an interrupted build
+                            os.remove(de.path)
+                        elif de.name.endswith(self.suffix) and de.is_file():
+                            st = de.stat()
+                            existing.append((st.st_atime, de.name[:len(de.name) - len(self.suffix)], st.st_size))
+                    except OSError:
+                        continue
+        except OSError:
+            logger.exception('Failed to list media cache %s', self.directory)
+        with self._lock:
+            for _, key, size in sorted(existing):
+                self._files[key] = size
+                self._bytes += size
+            self._evict_locked()
+
+    def lookup(self, key):
+        """Return the path of the cached file for `key`, or None."""
+        with self._lock:
+            if key not in self._files:
+                return None
+            self._files.move_to_end(key)
+        path = self.path(key)
+        if os.path.exists(path):
+            return path
+        with self._lock:
+            self._bytes -= self._files.pop(key, 0)
+        return None
+
+    def submit(self, key, build):
+        """Start building `key` unless it is cached or already being built.
+
+        `build(tmp_path)` must write the file to `tmp_path` and return True.
+        Returns a Future resolving to the cached path (or None on failure).
+        """
+        with self._lock:
+            future = self._jobs.get(key)
+            if future is None:
+                future = self._pool.submit(self._build, key, build)
+                self._jobs[key] = future
+        return future
+
+    def get(self, key, build, timeout=None):
+        """Return the cached path for `key`, building it first if needed.
+
+        Returns None if the build fails or takes longer than `timeout`
+        seconds (it keeps running and will be cached for the next request).
+        """
+        path = self.lookup(key)
+        if path is not None:
+            return path
+        try:
+            return self.submit(key, build).result(timeout)
+        except concurrent.futures.TimeoutError:
+            return None
+
+    def _build(self, key, build):
+        path = self.path(key)
+        tmp_path = os.path.join(self.directory, f'{key}.{threading.get_ident()}.tmp{self.suffix}')
+        try:
+            if self.lookup(key) is not None:
+                return path
+            try:
+                ok = build(tmp_path) and os.path.exists(tmp_path)
+            except Exception:
+                logger.exception('Failed to build cached media %s', key)
+                ok = False
+            if not ok:
+                return None
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+            with self._lock:
+                self._bytes += size - self._files.pop(key, 0)
+                self._files[key] = size
+                self._evict_locked()
+            return path
+        finally:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            with self._lock:
+                self._jobs.pop(key, None)
+
+    def _evict_locked(self):
+        # keep at least the newest file even if it alone exceeds the budget
+        while self._bytes > self.max_bytes and len(self._files) > 1:
+            key, size = self._files.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {'files': len(self._files), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'pending': len(self._jobs)}
@@ -0,0 +1,152 @@
+"""Persisted play history and popularity-weighted song sampling.
+
+PlayHistory counts how often each song (by playlist label, which survives
+rescans) was started and keeps the counts in a small JSON file under data/.
+It samples labels with a probability proportional to their play count
+through a WeightedSampler, which is built once from the counts and then
+updated in place per play.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+HISTORY_VERSION = 1
+
+
+class WeightedSampler:
+    """Weighted sampling over integer weights, kept in a Fenwick tree.
+
+    Building is O(n); changing a weight or adding an item touches O(log n)
+    tree nodes, and `sample()` draws one number below the total and walks
+    down the tree in O(log n). A play therefore never causes a rebuild.
+    """
+
+    def __init__(self, items=(), weights=()):
+        self.items = list(items)
+        self._pos = {item: i for i, item in enumerate(self.items)}
+        # tree[i] holds the sum of the weights of items (i - lowbit(i), i]
+        self._tree = [0] + [int(w) for w in weights]
+        n = len(self.items)
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                self._tree[parent] += self._tree[i]
+        self.total = sum(self._tree[i] for i in self._roots(n))
+
+    @staticmethod
+    def _roots(i):
+        while i > 0:
+            yield i
+            i -= i & -i
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item, delta=1):
+        """Add `delta` to the weight of `item`, appending it if it is new."""
+        pos = self._pos.get(item)
+        if pos is None:
+            self.items.append(item)
+            n = len(self.items)
+            self._pos[item] = n - 1
+            # the new node covers (n - lowbit(n), n]: itself plus earlier items
+            lower = n - (n & -n)
+            self._tree.append(delta + sum(self._tree[i] for i in self._roots(n - 1))
+                              - sum(self._tree[i] for i in self._roots(lower)))
+        else:
+            i = pos + 1
+            while i < len(self._tree):
+                self._tree[i] += delta
+                i += i & -i
+        self.total += delta
+
+    def sample(self, rng=random):
+        if self.total <= 0:
+            return None
+        target = rng.randrange(self.total)
+        tree = self._tree
+        n = len(self.items)
+        pos = 0
+        step = 1 << n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] <= target:
+                pos = nxt
+                target -= tree[nxt]
+            step >>= 1
+        return self.items[pos]
+
+
+class PlayHistory:
+    """Play counts per playlist label, persisted to `path` on every change."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._songs = {}
+        self._sampler = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fh:
+                payload = json.load(fh)
+        except FileNotFoundError:
+            return
+        except Exception:
+            logger.exception('Failed to read play history %s', self.path)
+            return
+        if not isinstance(payload, dict) or payload.get('version') != HISTORY_VERSION:
+            logger.warning('Ignoring play history %s with unknown format', self.path)
+            return
+        for label, info in (payload.get('songs') or {}).items():
+            try:
+                plays = int(info.get('plays', 0))
+            except (AttributeError, TypeError, ValueError):
+                continue
+            if label and plays > 0:
+                self._songs[label] = {'plays': plays, 'last': info.get('last')}
+
+    def _save_locked(self):
+        payload = {'version': HISTORY_VERSION, 'songs': self._songs}
+        tmp_path = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as fh:
+                json.dump(payload, fh, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            logger.exception('Failed to write play history %s', self.path)
+
+    def __len__(self):
+        return len(self._songs)
+
+    def plays(self, label):
+        info = self._songs.get(label)
+        return info['plays'] if info else 0
+
+    def record_play(self, label, when=None):
+        if not label:
+            return
+        with self._lock:
+            info = self._songs.setdefault(label, {'plays': 0, 'last': None})
+            info['plays'] += 1
+            info['last'] = when if when is not None else time.time()
+            if self._sampler is not None:
+                self._sampler.add(label, 1)
+            self._save_locked()
+
+    def sample(self, rng=random):
+        """Return a label drawn proportionally to its play count, or None."""
+        with self._lock:
+            # built on the first pick; record_play keeps it up to date
+            if self._sampler is None:
+                labels = list(self._songs)
+                self._sampler = WeightedSampler(labels, [self._songs[l]['plays'] for l in labels])
+            return self._sampler.sample(rng)
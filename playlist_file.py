@@ -0,0 +1,318 @@
+"""In-memory model of the USDX playlist (.upl) file.
+
+PlaylistFile keeps the playlist lines in memory as the authoritative copy.
+Changes are written back by a background thread: debounced, so a burst of
+edits causes one write, and atomically (temporary file plus rename), so
+USDX never reads a half-written playlist. The same thread notices edits made
+to the file by someone else through its (inode, mtime, size) and reloads it;
+readers of the model never touch the disk.
+
+The model also keeps an index from each line's key (see `key`) to its
+sorted positions, so finding or checking a song is a dictionary lookup plus
+a bisect instead of a scan. Changes only re-index the lines from the first
+changed position on: appending is O(1), removing a song that was queued
+recently only touches the lines after it.
+
+All `*_locked` methods expect the caller to hold `lock`, which lets a caller
+read, modify and replace the lines as one step.
+"""
+
+import bisect
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _file_key(st):
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class PlaylistFile:
+    """Playlist lines held in memory and flushed to `path` behind the scenes.
+
+    A flush happens `flush_delay` seconds after the last change, or at the
+    latest `max_delay` seconds after the first unwritten one. The file is
+    checked for external edits every `check_interval` seconds. Lines are
+    indexed and compared by `key(line)` (e.g. a normalized song label).
+    """
+
+    def __init__(self, path, lock=None, flush_delay=0.5, max_delay=2.0, check_interval=2.0, key=None,
+                 on_change=None):
+        self.path = path
+        self.lock = lock or threading.Lock()
+        self.key = key or (lambda line: line)
+        # called with `lock` held after every change; must be cheap
+        self.on_change = on_change
+        self.flush_delay = flush_delay
+        self.max_delay = max_delay
+        self.check_interval = check_interval
+        # bumped on every change, from this process or an external edit
+        self.version = 0
+        self._lines = []
+        # key -> sorted positions of the lines with that key
+        self._index = {}
+        self._file_key = None
+        self._dirty_since = None
+        self._changed_at = None
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # not shared yet; `lock` may already be held by whoever creates us
+        self._reload_locked()
+
+    # -- reading and changing the lines -------------------------------------
+
+    def lines(self):
+        with self.lock:
+            return list(self._lines)
+
+    def lines_locked(self):
+        return list(self._lines)
+
+    def __len__(self):
+        return len(self._lines)
+
+    def line_at_locked(self, position):
+        if 0 <= position < len(self._lines):
+            return self._lines[position]
+        return None
+
+    def line_at(self, position):
+        with self.lock:
+            return self.line_at_locked(position)
+
+    def find_locked(self, line, start=0):
+        """Position of `line` at or after `start`, else its first one; None if absent."""
+        positions = self._index.get(self.key(line))
+        if not positions:
+            return None
+        i = bisect.bisect_left(positions, max(0, start))
+        return positions[i] if i < len(positions) else positions[0]
+
+    def find(self, line, start=0):
+        with self.lock:
+            return self.find_locked(line, start)
+
+    def contains_locked(self, line, start=0):
+        """True if `line` is on the playlist at or after position `start`."""
+        positions = self._index.get(self.key(line))
+        return bool(positions) and positions[-1] >= start
+
+    def keys(self):
+        """Return the set of keys on the playlist."""
+        with self.lock:
+            return frozenset(self._index)
+
+    def _splice_locked(self, first, tail):
+        """Replace the lines from position `first` on by `tail`, re-indexing only those."""
+        index = self._index
+        for k in {self.key(l) for l in self._lines[first:]}:
+            positions = index[k]
+            del positions[bisect.bisect_left(positions, first):]
+            if not positions:
+                del index[k]
+        del self._lines[first:]
+        for line in tail:
+            index.setdefault(self.key(line), []).append(len(self._lines))
+            self._lines.append(line)
+
+    def _set_lines_locked(self, lines):
+        lines = [l.strip() for l in lines if l and l.strip()]
+        first = 0
+        common = min(len(lines), len(self._lines))
+        while first < common and lines[first] == self._lines[first]:
+            first += 1
+        if first == len(lines) == len(self._lines):
+            return False
+        self._splice_locked(first, lines[first:])
+        self._bump_locked()
+        return True
+
+    def _bump_locked(self):
+        self.version += 1
+        if self.on_change is not None:
+            self.on_change()
+
+    def _mark_dirty_locked(self):
+        now = time.monotonic()
+        if self._dirty_since is None:
+            self._dirty_since = now
+        self._changed_at = now
+        self._wake.set()
+
+    def replace_locked(self, lines):
+        """Set the playlist to `lines`; the file is written shortly after."""
+        if not self._set_lines_locked(lines):
+            return False
+        self._mark_dirty_locked()
+        return True
+
+    def replace(self, lines):
+        with self.lock:
+            return self.replace_locked(lines)
+
+    def append_locked(self, line):
+        line = (line or '').strip()
+        if not line:
+            return False
+        self._index.setdefault(self.key(line), []).append(len(self._lines))
+        self._lines.append(line)
+        self._bump_locked()
+        self._mark_dirty_locked()
+        return True
+
+    def insert_locked(self, position, line):
+        """Insert `line` before `position` (clamped to the playlist)."""
+        line = (line or '').strip()
+        if not line:
+            return False
+        position = max(0, min(position, len(self._lines)))
+        self._splice_locked(position, [line] + self._lines[position:])
+        self._bump_locked()
+        self._mark_dirty_locked()
+        return True
+
+    def remove_locked(self, line):
+        """Remove every occurrence of `line`; returns how many there were."""
+        key = self.key(line)
+        positions = self._index.get(key)
+        if not positions:
+            return 0
+        count = len(positions)
+        first = positions[0]
+        self._splice_locked(first, [l for l in self._lines[first:] if self.key(l) != key])
+        self._bump_locked()
+        self._mark_dirty_locked()
+        return count
+
+    def move_locked(self, source, target):
+        """Move the line at `source` to position `target`."""
+        if not 0 <= source < len(self._lines):
+            return False
+        target = max(0, min(target, len(self._lines) - 1))
+        if source == target:
+            return False
+        first = min(source, target)
+        tail = self._lines[first:]
+        tail.insert(target - first, tail.pop(source - first))
+        self._splice_locked(first, tail)
+        self._bump_locked()
+        self._mark_dirty_locked()
+        return True
+
+    @property
+    def dirty(self):
+        return self._dirty_since is not None
+
+    # -- file I/O -------------------------------------------------------------
+
+    def _reload_locked(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fh:
+                st = os.fstat(fh.fileno())
+                lines = fh.read().splitlines()
+        except FileNotFoundError:
+            st, lines = None, []
+        except Exception:
+            logger.exception('Failed to read playlist file %s', self.path)
+            return
+        self._file_key = _file_key(st) if st else None
+        self._set_lines_locked(lines)
+
+    def flush(self):
+        """Write pending changes now; returns False if writing failed."""
+        with self._write_lock:
+            with self.lock:
+                if self._dirty_since is None:
+                    return True
+                lines = list(self._lines)
+                version = self.version
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with open(tmp_path, 'w', encoding='utf-8') as fh:
+                    for line in lines:
+                        fh.write(line + '\n')
+                os.replace(tmp_path, self.path)
+                key = _file_key(os.stat(self.path))
+            except Exception:
+                logger.exception('Failed to write playlist file %s', self.path)
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                return False
+            with self.lock:
+                self._file_key = key
+                if self.version == version:
+                    self._dirty_since = self._changed_at = None
+        return True
+
+    def check_external(self):
+        """Reload the file if it was changed by someone else; returns True if so."""
+        try:
+            key = _file_key(os.stat(self.path))
+        except FileNotFoundError:
+            key = None
+        except OSError:
+            return False
+        with self.lock:
+            if key == self._file_key:
+                return False
+            if self._dirty_since is not None:
+                # our pending write wins; it is flushed over the external edit
+                logger.warning('Playlist file %s changed externally while changes were pending; '
+                               'keeping the in-memory playlist', self.path)
+                self._file_key = key
+                return False
+            previous = self.version
+            self._reload_locked()
+            if self.version != previous:
+                logger.info('Reloaded playlist file %s after an external edit', self.path)
+            return self.version != previous
+
+    # -- background writer ------------------------------------------------------
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='playlist-writer', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        next_check = time.monotonic() + self.check_interval
+        while not self._stop.is_set():
+            now = time.monotonic()
+            with self.lock:
+                first, last = self._dirty_since, self._changed_at
+            if first is not None:
+                due = min(last + self.flush_delay, first + self.max_delay)
+            else:
+                due = next_check
+            if due > now:
+                self._wake.wait(due - now)
+                self._wake.clear()
+                continue
+            try:
+                if first is not None:
+                    if not self.flush():
+                        # retried later, not in a tight loop
+                        self._stop.wait(self.check_interval)
+                else:
+                    self.check_external()
+                    next_check = time.monotonic() + self.check_interval
+            except Exception:
+                logger.exception('Playlist writer failed for %s', self.path)
+                self._stop.wait(self.check_interval)
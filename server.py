@@ -2,6 +2,7 @@
 
 from flask import Flask, render_template, request, jsonify, session, send_file, send_from_directory
 from flask import Response, stream_with_context
+from werkzeug.exceptions import HTTPException
 import os
 from markupsafe import escape
 import random
@@ -9,17 +10,28 @@ import time
 import logging
 import signal
 from webrtc_microphone import WebRTCMicrophone, WebRTCMicrophoneManager
+import song_index
+import file_watch
+import media_cache
+import play_history
+import playlist_file
 import subprocess
 import json
 import threading
 import queue
 import configparser
 import argparse
+import atexit
 import logging
 import sys
 import socket
 import time
 import re
+import base64
+import collections
+import gzip
+import inspect
+import zlib
 
 
 
@@ -157,10 +169,13 @@ MAX_NAME_LENGTH = 16
 
 PLAYLIST_FILE_LOCK = threading.Lock()
 PLAYLIST_STATE_LOCK = threading.Lock()
-SONGS_BY_AUDIO = {}
 PLAYLIST_THREAD = None
 PLAYLIST_THREAD_STOP = threading.Event()
-PLAYLIST_LOG_POSITION = 0
+# Wakes the automation loop early; it otherwise sleeps until the next deadline
+PLAYLIST_AUTOMATION_WAKE = threading.Event()
+# Serializes countdown handling with USDX log lines (tailer thread)
+PLAYLIST_AUTOMATION_LOCK = threading.RLock()
+USDX_LOG_TAILER = None
 PLAYLIST_COUNTDOWN_DEFAULT = 15
 USDX_LOG_FILE = None
 USDX_LOG_CANDIDATES = []
@@ -196,7 +211,37 @@ def _default_playlist_state():
     }
 
 
-PLAYLIST_STATE = _default_playlist_state()
+class _ObservedState(dict):
+    """dict that calls `on_change()` whenever an item is assigned."""
+
+    def __init__(self, initial, on_change):
+        super().__init__(initial)
+        self.on_change = on_change
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.on_change()
+
+
+# Playlist status stream (/playlist/stream): every write to PLAYLIST_STATE or
+# the playlist wakes one publisher thread, which compares the status snapshot
+# with the last one sent and pushes a versioned event to all listeners only
+# if it differs. Clients count down locally from countdown_deadline, so
+# nothing is sent while a countdown merely runs.
+PLAYLIST_EVENTS_WAKE = threading.Event()
+PLAYLIST_EVENTS = {'version': 0, 'snapshot': None}
+PLAYLIST_LISTENERS = []
+PLAYLIST_LISTENERS_LOCK = threading.Lock()
+PLAYLIST_EVENTS_THREAD = None
+PLAYLIST_STREAM_KEEPALIVE = 25
+
+
+def _on_playlist_state_change():
+    PLAYLIST_EVENTS_WAKE.set()
+    PLAYLIST_AUTOMATION_WAKE.set()
+
+
+PLAYLIST_STATE = _ObservedState(_default_playlist_state(), _on_playlist_state_change)
 
 
 def _playlist_audio_key():
@@ -211,15 +256,7 @@ def _playlist_audio_key():
 
 
 def _normalize_audio_path(path):
-    if not path:
-        return None
-    candidate = path
-    if not os.path.isabs(candidate):
-        candidate = os.path.join(BASE_DIR, candidate)
-    try:
-        return os.path.realpath(candidate)
-    except Exception:
-        return None
+    return song_index.normalize_path(path, BASE_DIR)
 
 
 def _normalize_log_candidate(path):
@@ -262,23 +299,11 @@ def _build_usdx_log_candidates(custom_path=None):
     return candidates
 
 
-def _set_usdx_log_file(path, seek_end=True):
-    global USDX_LOG_FILE, PLAYLIST_LOG_POSITION
-    if not path:
-        return
-    USDX_LOG_FILE = path
-    if not os.path.exists(path):
-        PLAYLIST_LOG_POSITION = 0
-        return
-    try:
-        with open(path, 'rb') as fh:
-            fh.seek(0, os.SEEK_END if seek_end else os.SEEK_SET)
-            if seek_end:
-                PLAYLIST_LOG_POSITION = fh.tell()
-            else:
-                PLAYLIST_LOG_POSITION = 0
-    except Exception:
-        PLAYLIST_LOG_POSITION = 0
+def _set_usdx_log_file(path):
+    # the tailer picks the new path up on its next wakeup
+    global USDX_LOG_FILE
+    if path:
+        USDX_LOG_FILE = path
 
 
 def _initialize_usdx_log_monitor(custom_path=None):
@@ -290,12 +315,12 @@ def _initialize_usdx_log_monitor(custom_path=None):
             selected = candidate
             break
     if selected:
-        _set_usdx_log_file(selected, seek_end=True)
+        _set_usdx_log_file(selected)
         logger.info('Monitoring USDX log file: %s', selected)
     else:
         if USDX_LOG_CANDIDATES:
             logger.warning('USDX log file not found yet; will monitor once available. Candidates: %s', ', '.join(USDX_LOG_CANDIDATES))
-            _set_usdx_log_file(USDX_LOG_CANDIDATES[0], seek_end=True)
+            _set_usdx_log_file(USDX_LOG_CANDIDATES[0])
         else:
             logger.warning('No USDX log file candidates could be determined')
 
@@ -308,33 +333,15 @@ def _ensure_usdx_log_file():
         if os.path.exists(candidate):
             if candidate != USDX_LOG_FILE:
                 logger.info('Switching USDX log monitor to %s', candidate)
-            _set_usdx_log_file(candidate, seek_end=True)
+            _set_usdx_log_file(candidate)
             return True
     return False
 
 
-def _register_song_entry(entry):
-    if not entry:
-        return
-    audio_key = _playlist_audio_key()
-    candidates = []
-    try:
-        if entry.get(audio_key):
-            candidates.append(entry.get(audio_key))
-    except Exception:
-        pass
-    for fallback in ('m4a', 'mp3', 'ogg', 'wav'):
-        if fallback == audio_key:
-            continue
-        candidate = entry.get(fallback)
-        if candidate:
-            candidates.append(candidate)
-    seen = set()
-    for candidate in candidates:
-        normalized = _normalize_audio_path(candidate)
-        if normalized and normalized not in seen:
-            SONGS_BY_AUDIO[normalized] = entry
-            seen.add(normalized)
+def _locate_usdx_log_file():
+    """Path for the log tailer: the monitored file, or an existing candidate once it is gone."""
+    _ensure_usdx_log_file()
+    return USDX_LOG_FILE
 
 
 def playlist_file_path():
@@ -350,113 +357,108 @@ def playlist_file_path():
     return os.path.realpath(os.path.join(base_dir, usdx_dir, 'playlists', playlist_name))
 
 
-def _read_playlist_lines_unlocked():
-    try:
-        with open(playlist_file_path(), 'r', encoding='utf-8') as fh:
-            return [l.strip() for l in fh if l.strip()]
-    except FileNotFoundError:
-        return []
-    except Exception:
-        logger.exception('Failed to read playlist file')
-        return []
+# The playlist lives in memory (playlist_file.PlaylistFile, guarded by
+# PLAYLIST_FILE_LOCK); the .upl file is written behind it and reloaded when
+# edited externally, so reading the playlist never touches the disk.
+PLAYLIST_MODEL = None
+PLAYLIST_MODEL_LOCK = threading.Lock()
 
 
-def _write_playlist_lines_unlocked(lines):
-    path = playlist_file_path()
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, 'w', encoding='utf-8') as fh:
-        for line in lines:
-            if line:
-                fh.write(line + '\n')
+def get_playlist_model():
+    global PLAYLIST_MODEL
+    with PLAYLIST_MODEL_LOCK:
+        if PLAYLIST_MODEL is None:
+            PLAYLIST_MODEL = playlist_file.PlaylistFile(playlist_file_path(), lock=PLAYLIST_FILE_LOCK,
+                                                        key=normalize_playlist_label,
+                                                        on_change=PLAYLIST_EVENTS_WAKE.set).start()
+            atexit.register(PLAYLIST_MODEL.stop)
+        return PLAYLIST_MODEL
 
 
-def get_playlist_lines():
-    with PLAYLIST_FILE_LOCK:
-        return list(_read_playlist_lines_unlocked())
+# Playlist membership overlay: the normalized labels currently in the .upl
+# file. A song's "upl" flag is derived from it instead of being stored in the
+# song index, so toggling a song only changes the (small) playlist.
+PLAYLIST_MEMBERSHIP = frozenset()
+PLAYLIST_MEMBERSHIP_VERSION = None
 
 
-def write_playlist_lines(lines):
-    with PLAYLIST_FILE_LOCK:
-        _write_playlist_lines_unlocked(lines)
+def playlist_membership():
+    """Return the labels on the playlist; recomputed only after it changed."""
+    global PLAYLIST_MEMBERSHIP, PLAYLIST_MEMBERSHIP_VERSION
+    model = get_playlist_model()
+    version = model.version
+    if PLAYLIST_MEMBERSHIP_VERSION != version:
+        PLAYLIST_MEMBERSHIP = model.keys()
+        PLAYLIST_MEMBERSHIP_VERSION = version
+    return PLAYLIST_MEMBERSHIP
+
+
+# Fields of /songs/search items that are not stored in the catalog
+SONG_COMPUTED_FIELDS = {
+    'upl': lambda entry, membership: derive_playlist_label(entry) in membership,
+    'cover_url': lambda entry, membership: cover_thumbnail_url(entry),
+}
+# Named field sets for ?fields=; "compact" is what the songs tab needs
+SONG_FIELD_PRESETS = {
+    'compact': ('id', 'artist', 'title', 'display', 'upl', 'cover_url'),
+}
+
 
+def parse_song_fields(raw):
+    """Parse a ?fields= value into a tuple of field names.
 
-def normalize_playlist_label(raw):
+    Returns None for the full entry, or raises ValueError naming unknown fields.
+    """
     if not raw:
         return None
-    label = str(raw).strip()
-    if not label:
-        return None
-    if ' : ' in label:
-        artist, title = label.split(':', 1)
-        return f"{artist.strip()} : {title.strip()}"
-    if ' - ' in label:
-        artist, title = label.split('-', 1)
-        artist = artist.strip()
-        title = title.strip()
-        if artist and title:
-            return f"{artist} : {title}"
-    return label
-
-
-def _parse_artist_title_from_txt(entry):
-    txt_rel = entry.get('txt') if entry else None
-    if not txt_rel:
-        return None
-    try:
-        candidate_txt = txt_rel
-        if not os.path.isabs(candidate_txt):
-            candidate_txt = os.path.realpath(os.path.join(BASE_DIR, candidate_txt))
-        allowed_root = os.path.realpath(os.path.join(BASE_DIR, args.usdx_dir)) if 'args' in globals() else None
-        if allowed_root and not candidate_txt.startswith(allowed_root):
-            return None
-        if not os.path.exists(candidate_txt):
-            return None
-        artist = None
-        title = None
-        with open(candidate_txt, 'r', encoding='utf-8', errors='ignore') as fh:
-            for ln in fh:
-                s = ln.strip()
-                if not s:
-                    continue
-                up = s.upper()
-                if up.startswith('#ARTIST'):
-                    parts = s.split(':', 1)
-                    artist = parts[1].strip() if len(parts) > 1 else s[len('#ARTIST'):].strip()
-                elif up.startswith('#TITLE'):
-                    parts = s.split(':', 1)
-                    title = parts[1].strip() if len(parts) > 1 else s[len('#TITLE'):].strip()
-                if artist and title:
-                    break
-        if artist and title:
-            return f"{artist} : {title}"
-        if artist:
-            return artist
-        if title:
-            return title
-    except Exception:
-        logger.exception('Failed to parse artist/title from txt: %s', txt_rel)
-    return None
+    fields = []
+    for name in raw.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        fields.extend(SONG_FIELD_PRESETS.get(name, (name,)))
+    unknown = [f for f in fields if f not in song_index.SongRecord.FIELDS and f not in SONG_COMPUTED_FIELDS]
+    if unknown:
+        raise ValueError('Unknown fields: ' + ', '.join(unknown))
+    return tuple(dict.fromkeys(fields)) or None
+
+
+def song_to_dict(entry, membership=None, fields=None):
+    """JSON form of a catalog entry including its playlist membership ('upl').
+
+    With `fields` only those keys are included (missing values are omitted).
+    """
+    if membership is None:
+        membership = playlist_membership()
+    if fields is None:
+        # the full entry only adds 'upl'; cover_url costs a stat per song
+        item = entry.to_dict()
+        item['upl'] = SONG_COMPUTED_FIELDS['upl'](entry, membership)
+        return item
+    item = {}
+    for name in fields:
+        compute = SONG_COMPUTED_FIELDS.get(name)
+        value = compute(entry, membership) if compute else entry.get(name)
+        if value is not None:
+            item[name] = value
+    return item
+
+
+def get_playlist_lines():
+    return get_playlist_model().lines()
+
+
+def write_playlist_lines(lines):
+    get_playlist_model().replace(lines)
+
+
+normalize_playlist_label = song_index.normalize_playlist_label
 
 
 def derive_playlist_label(entry):
     if not entry:
         return None
-    cached = entry.get('_playlist_label')
-    if cached:
-        return cached
-    label = _parse_artist_title_from_txt(entry)
-    if not label:
-        display = entry.get('display')
-        if display:
-            label = display
-        else:
-            txt_path = entry.get('txt')
-            if txt_path:
-                label = os.path.splitext(os.path.basename(txt_path))[0].replace('_', ' ')
-    label = normalize_playlist_label(label or '')
-    if label:
-        entry['_playlist_label'] = label
-    return label
+    return entry.playlist_label
 
 
 def _current_countdown_duration(custom_seconds=None):
@@ -524,40 +526,106 @@ def _set_playlist_error(message):
     logger.error('Playlist automation error: %s', message)
 
 
-def _append_random_song_locked(lines):
-    pool = SONGS_LIST or load_songs_index()
-    if not pool:
+# Auto-fill draws from a shuffled deck of catalog rows: each pick is O(1) and
+# no song is offered twice before the whole library has been offered once.
+# The deck is rebuilt when the catalog changes and reshuffled when exhausted.
+# 'played' holds the playlist labels of songs started since the last reshuffle;
+# it is written by the automation thread and read by request handlers, so it
+# is only touched under SHUFFLE_DECK_LOCK.
+SHUFFLE_DECK = {'version': None, 'rows': None, 'pos': 0, 'played': set()}
+SHUFFLE_DECK_LOCK = threading.Lock()
+
+# Share of auto-fill picks weighted by how often songs were sung before
+# (--autofill-popular-share); the rest come from the shuffle deck.
+AUTOFILL_POPULAR_SHARE = 0.5
+PLAY_HISTORY = None
+PLAY_HISTORY_LOCK = threading.Lock()
+
+
+def get_play_history():
+    global PLAY_HISTORY
+    with PLAY_HISTORY_LOCK:
+        if PLAY_HISTORY is None:
+            PLAY_HISTORY = play_history.PlayHistory(os.path.join(DATA_DIR, 'play_history.json'))
+        return PLAY_HISTORY
+
+
+def _draw_popular_song(catalog):
+    """Return an entry picked by play count, or None (no history, song gone)."""
+    if AUTOFILL_POPULAR_SHARE <= 0 or random.random() >= AUTOFILL_POPULAR_SHARE:
         return None
-    attempts = min(64, len(pool))
-    seen = set()
-    while attempts > 0:
-        entry = random.choice(pool)
-        if not entry or entry.get('id') in seen:
-            attempts -= 1
-            continue
-        seen.add(entry.get('id'))
+    label = get_play_history().sample()
+    # the catalog remembers each label's row, so repeated picks skip the search
+    row = catalog.row_of_label(label) if label else None
+    return None if row is None else catalog.entries[row]
+
+
+def _draw_shuffled_song(catalog):
+    """Return the next song of the shuffle deck, or None."""
+    with SHUFFLE_DECK_LOCK:
+        deck = SHUFFLE_DECK
+        if deck['version'] != catalog.version or deck['rows'] is None or deck['pos'] >= len(deck['rows']):
+            if deck['version'] == catalog.version and deck['rows'] is not None:
+                # the whole library has been offered; sung songs may come back
+                deck['played'].clear()
+            rows = list(range(len(catalog)))
+            random.shuffle(rows)
+            deck['version'] = catalog.version
+            deck['rows'] = rows
+            deck['pos'] = 0
+        if not deck['rows']:
+            return None
+        row = deck['rows'][deck['pos']]
+        deck['pos'] += 1
+    return catalog.entries[row]
+
+
+def _mark_song_played(label):
+    with SHUFFLE_DECK_LOCK:
+        SHUFFLE_DECK['played'].add(label)
+
+
+def _song_played(label):
+    with SHUFFLE_DECK_LOCK:
+        return label in SHUFFLE_DECK['played']
+
+
+def _append_random_song_locked(model):
+    catalog = get_song_catalog()
+    total = len(catalog)
+    if not total:
+        return None
+    # Songs still queued (at or after the current playlist position) and songs
+    # already sung are skipped. Read without PLAYLIST_STATE_LOCK: callers hold
+    # PLAYLIST_FILE_LOCK, which is otherwise taken after the state lock.
+    try:
+        upcoming = max(0, int(PLAYLIST_STATE.get('current_index', 0) or 0))
+    except (TypeError, ValueError):
+        upcoming = 0
+
+    def excluded(label):
+        return not label or _song_played(label) or model.contains_locked(label, upcoming)
+
+    # At most the rest of the deck plus one reshuffled deck: never loops forever
+    for _ in range(2 * total):
+        entry = _draw_popular_song(catalog)
         label = derive_playlist_label(entry)
-        if not label or label in lines:
-            attempts -= 1
+        if excluded(label):
+            entry = _draw_shuffled_song(catalog)
+            if entry is None:
+                break
+            label = derive_playlist_label(entry)
+        if excluded(label):
             continue
-        lines.append(label)
-        _write_playlist_lines_unlocked(lines)
-        entry['upl'] = True
-        try:
-            SONGS_BY_ID[str(entry.get('id'))] = entry
-        except Exception:
-            pass
-        _register_song_entry(entry)
+        model.append_locked(label)
         return label
-        attempts -= 1
     return None
 
 
 def append_random_song_to_playlist():
+    model = get_playlist_model()
     with PLAYLIST_FILE_LOCK:
-        lines = _read_playlist_lines_unlocked()
-        added = _append_random_song_locked(lines)
-        return added
+        return _append_random_song_locked(model)
 
 
 def ensure_playlist_has_entries(min_entries=1):
@@ -568,24 +636,22 @@ def ensure_playlist_has_entries(min_entries=1):
         min_required = 1
 
     added_labels = []
+    model = get_playlist_model()
     with PLAYLIST_FILE_LOCK:
-        lines = _read_playlist_lines_unlocked()
-        while len(lines) < min_required:
-            added = _append_random_song_locked(lines)
+        while len(model) < min_required:
+            added = _append_random_song_locked(model)
             if not added:
                 break
             added_labels.append(added)
-            lines = _read_playlist_lines_unlocked()
-        result_lines = list(lines)
+        result_lines = model.lines_locked()
     return result_lines, added_labels
 
 
-def refresh_playlist_state_cache(lines=None):
-    if lines is None:
-        lines = get_playlist_lines()
+def refresh_playlist_state_cache():
+    model = get_playlist_model()
     with PLAYLIST_STATE_LOCK:
         idx = PLAYLIST_STATE.get('current_index', 0)
-        PLAYLIST_STATE['next_song'] = lines[idx] if idx < len(lines) else None
+        PLAYLIST_STATE['next_song'] = model.line_at(idx)
         return PLAYLIST_STATE['next_song']
 
 
@@ -594,22 +660,19 @@ def _prepare_pending_playlist_entry():
     appended_next_label = None
     with PLAYLIST_STATE_LOCK:
         target_index = max(0, int(PLAYLIST_STATE.get('current_index', 0) or 0))
+    model = get_playlist_model()
     with PLAYLIST_FILE_LOCK:
-        lines = _read_playlist_lines_unlocked()
-        if target_index >= len(lines):
-            added_label = _append_random_song_locked(lines)
+        if target_index >= len(model):
+            added_label = _append_random_song_locked(model)
             if added_label:
                 auto_added = True
-                lines = _read_playlist_lines_unlocked()
-        if not lines:
+        if not len(model):
             return False, 'Playlist is empty'
-        if target_index >= len(lines):
-            target_index = len(lines) - 1
-        line_to_start = lines[target_index]
-        if target_index + 1 >= len(lines):
-            appended_next_label = _append_random_song_locked(lines)
-            if appended_next_label:
-                lines = _read_playlist_lines_unlocked()
+        if target_index >= len(model):
+            target_index = len(model) - 1
+        line_to_start = model.line_at_locked(target_index)
+        if target_index + 1 >= len(model):
+            appended_next_label = _append_random_song_locked(model)
     with PLAYLIST_STATE_LOCK:
         state = PLAYLIST_STATE
         state['pending_index'] = target_index
@@ -621,10 +684,10 @@ def _prepare_pending_playlist_entry():
         elif appended_next_label:
             state['auto_added'] = state.get('auto_added', 0) + 1
     logger.info('Prepared pending playlist entry index=%s label=%s (auto_added=%s appended=%s)', target_index, line_to_start, auto_added, bool(appended_next_label))
-    return True, {'lines': lines, 'target_index': target_index, 'label': line_to_start}
+    return True, {'target_index': target_index, 'label': line_to_start}
 
 
-def _handle_song_started(label=None, index=None, lines=None):
+def _handle_song_started(label=None, index=None):
     with PLAYLIST_STATE_LOCK:
         state = PLAYLIST_STATE
         if state.get('automation_phase') != PHASE_AWAITING_SONG_START:
@@ -633,8 +696,6 @@ def _handle_song_started(label=None, index=None, lines=None):
             label = state.get('pending_song') or state.get('current_song')
         if index is None:
             index = state.get('pending_index')
-        if lines is None:
-            lines = get_playlist_lines()
         state['automation_phase'] = PHASE_SINGING
         state['status'] = PHASE_STATUS_MAP.get(PHASE_SINGING, 'singing')
         state['countdown_deadline'] = None
@@ -648,41 +709,59 @@ def _handle_song_started(label=None, index=None, lines=None):
         if index is None:
             index = state.get('current_index', 0)
         state['current_index'] = int(index) + 1 if index is not None else state.get('current_index', 0)
-        next_idx = state['current_index']
-        if next_idx is not None and next_idx < len(lines):
-            state['next_song'] = lines[next_idx]
-        else:
-            state['next_song'] = None
+        state['next_song'] = get_playlist_model().line_at(state['current_index'])
         state['pending_song'] = None
         state['pending_index'] = None
         state['last_error'] = None
         state['last_status_change'] = time.time()
+    if label:
+        normalized = normalize_playlist_label(label)
+        _mark_song_played(normalized)
+        get_play_history().record_play(normalized)
     logger.info('Song playback detected; automation phase set to SINGING for "%s"', label or 'unknown')
 
 
-def _find_playlist_index_for_label(label, lines, start_at=0):
-    if not label or not lines:
+def _find_playlist_index_for_label(label, start_at=0):
+    """First position of `label` at or after `start_at`, else its first one."""
+    if not label:
         return None
-    start_idx = max(0, int(start_at or 0))
-    for idx in range(start_idx, len(lines)):
-        if lines[idx] == label:
-            return idx
-    for idx in range(0, start_idx):
-        if lines[idx] == label:
-            return idx
-    return None
+    return get_playlist_model().find(label, int(start_at or 0))
+
+
+# Decoded files that are not in the song catalog, with the catalog version
+# they were missing from (least recently seen first). A path is only checked
+# against a reloaded index again once the catalog has changed.
+UNKNOWN_AUDIO_PATHS = collections.OrderedDict()
+UNKNOWN_AUDIO_PATHS_MAX = 256
+UNKNOWN_AUDIO_PATHS_LOCK = threading.Lock()
+
+
+def _lookup_decoded_audio(normalized):
+    catalog = get_song_catalog()
+    entry = catalog.lookup_audio(normalized)
+    if entry:
+        return entry
+    with UNKNOWN_AUDIO_PATHS_LOCK:
+        if UNKNOWN_AUDIO_PATHS.get(normalized) == catalog.version:
+            UNKNOWN_AUDIO_PATHS.move_to_end(normalized)
+            return None
+    catalog = get_song_catalog(force_check=True)
+    entry = catalog.lookup_audio(normalized)
+    if not entry:
+        with UNKNOWN_AUDIO_PATHS_LOCK:
+            UNKNOWN_AUDIO_PATHS[normalized] = catalog.version
+            UNKNOWN_AUDIO_PATHS.move_to_end(normalized)
+            while len(UNKNOWN_AUDIO_PATHS) > UNKNOWN_AUDIO_PATHS_MAX:
+                UNKNOWN_AUDIO_PATHS.popitem(last=False)
+    return entry
 
 
 def _process_decoder_path(audio_path):
     normalized = _normalize_audio_path(audio_path)
     if not normalized:
         return
-    entry = SONGS_BY_AUDIO.get(normalized)
-    if not entry:
-        load_songs_index()
-        entry = SONGS_BY_AUDIO.get(normalized)
+    entry = _lookup_decoded_audio(normalized)
     label = derive_playlist_label(entry) if entry else None
-    lines = get_playlist_lines()
     with PLAYLIST_STATE_LOCK:
         start_hint = max(0, PLAYLIST_STATE.get('current_index', 0) - 3)
         PLAYLIST_STATE['last_decoder_path'] = normalized
@@ -691,12 +770,12 @@ def _process_decoder_path(audio_path):
         pending_song = PLAYLIST_STATE.get('pending_song')
         pending_index = PLAYLIST_STATE.get('pending_index')
     active_label = label or (pending_song if automation_phase == PHASE_AWAITING_SONG_START else current_song)
-    idx = _find_playlist_index_for_label(active_label, lines, start_hint) if active_label else None
+    idx = _find_playlist_index_for_label(active_label, start_hint) if active_label else None
     if idx is None:
         idx = pending_index if automation_phase == PHASE_AWAITING_SONG_START else start_hint
     now = time.time()
     if automation_phase == PHASE_AWAITING_SONG_START:
-        _handle_song_started(active_label, idx, lines)
+        _handle_song_started(active_label, idx)
         with PLAYLIST_STATE_LOCK:
             state = PLAYLIST_STATE
             state['decoder_event_count'] = 1
@@ -719,8 +798,9 @@ def _process_decoder_path(audio_path):
             label_matches_current = active_label == prev_song if active_label else True
             if not label_matches_current and active_label:
                 state['current_song'] = active_label
-                if state.get('current_index', 0) < len(lines):
-                    state['next_song'] = lines[state['current_index']]
+                next_song = get_playlist_model().line_at(state.get('current_index', 0))
+                if next_song is not None:
+                    state['next_song'] = next_song
                 state['decoder_event_count'] = 1
                 state['decoder_last_timestamp'] = now
                 state['decoder_last_label'] = active_label
@@ -749,16 +829,13 @@ def _process_decoder_path(audio_path):
         return
 
 
-def playlist_status_payload(lines=None):
-    if lines is None:
-        lines = get_playlist_lines()
+def playlist_state_snapshot(playlist_length=None):
+    """Playlist status without the fields that change with the clock."""
+    model = get_playlist_model()
+    if playlist_length is None:
+        playlist_length = len(model)
     with PLAYLIST_STATE_LOCK:
         state = dict(PLAYLIST_STATE)
-    now = time.time()
-    countdown_remaining = 0
-    if state.get('countdown_deadline'):
-        countdown_remaining = max(0, int(state['countdown_deadline'] - now))
-    countdown_active = state.get('countdown_deadline') is not None and countdown_remaining > 0
     status_text = {
         'disabled': 'Playlist mode disabled',
         'idle': 'Idle — ready for next song',
@@ -784,10 +861,10 @@ def playlist_status_payload(lines=None):
         'current_index': state.get('current_index', 0),
         'current_song': state.get('current_song'),
         'next_song': state.get('next_song'),
-        'playlist_length': len(lines),
+        'playlist_length': playlist_length,
+        'playlist_version': model.version,
         'countdown_seconds': state.get('countdown_seconds', PLAYLIST_COUNTDOWN_DEFAULT),
-        'countdown_remaining': countdown_remaining,
-        'countdown_active': countdown_active,
+        'countdown_deadline': state.get('countdown_deadline'),
         'last_decoder_path': state.get('last_decoder_path'),
         'auto_added': state.get('auto_added', 0),
         'lock_controls': state.get('enabled', False),
@@ -795,6 +872,59 @@ def playlist_status_payload(lines=None):
     }
 
 
+def playlist_status_payload(lines=None):
+    payload = playlist_state_snapshot(len(lines) if lines is not None else None)
+    now = time.time()
+    deadline = payload['countdown_deadline']
+    countdown_remaining = max(0, int(deadline - now)) if deadline else 0
+    payload['countdown_remaining'] = countdown_remaining
+    payload['countdown_active'] = deadline is not None and countdown_remaining > 0
+    payload['server_time'] = now
+    return payload
+
+
+def _playlist_event_message(snapshot, version):
+    # server_time is taken when the event is sent, never cached: clients
+    # derive their clock offset from it
+    return json.dumps({**snapshot, 'version': version, 'server_time': time.time()})
+
+
+def publish_playlist_event():
+    """Send the playlist status to stream listeners if it changed; returns the event."""
+    snapshot = playlist_state_snapshot()
+    with PLAYLIST_LISTENERS_LOCK:
+        if snapshot == PLAYLIST_EVENTS['snapshot']:
+            return _playlist_event_message(snapshot, PLAYLIST_EVENTS['version'])
+        PLAYLIST_EVENTS['version'] += 1
+        PLAYLIST_EVENTS['snapshot'] = snapshot
+        message = _playlist_event_message(snapshot, PLAYLIST_EVENTS['version'])
+        for q in PLAYLIST_LISTENERS:
+            try:
+                q.put((PLAYLIST_EVENTS['version'], message), block=False)
+            except Exception:
+                pass
+    return message
+
+
+def _playlist_events_loop():
+    while True:
+        PLAYLIST_EVENTS_WAKE.wait()
+        PLAYLIST_EVENTS_WAKE.clear()
+        try:
+            publish_playlist_event()
+        except Exception:
+            logger.exception('Failed to publish playlist status')
+
+
+def ensure_playlist_events_thread():
+    global PLAYLIST_EVENTS_THREAD
+    with PLAYLIST_LISTENERS_LOCK:
+        if PLAYLIST_EVENTS_THREAD is None:
+            PLAYLIST_EVENTS_THREAD = threading.Thread(target=_playlist_events_loop, name='playlist-events',
+                                                      daemon=True)
+            PLAYLIST_EVENTS_THREAD.start()
+
+
 def set_playlist_enabled(enabled, countdown_seconds=None):
     logger.info(f'set_playlist_enabled: enabled={enabled}, countdown_seconds={countdown_seconds}')
     if enabled:
@@ -921,6 +1051,8 @@ def _select_next_song_with_countdown(duration):
 
 
 def _run_playlist_command_sequence(commands):
+    # USDX reads the .upl file itself; write pending changes before it does
+    get_playlist_model().flush()
     for cmd in commands:
         if cmd[0] == 'delay':
             try:
@@ -1118,64 +1250,61 @@ def _handle_video_playing_detected():
         logger.info('Detected post-song video playback; starting score confirmation countdown')
 
 
-def _process_usdx_log_lines():
-    global PLAYLIST_LOG_POSITION, USDX_LOG_FILE
-    if not _ensure_usdx_log_file():
-        logger.debug('USDX log file not yet available; skipping log processing')
+def _process_usdx_log_line(line):
+    """Handle one line of the USDX log as soon as the tailer reads it."""
+    stripped = line.strip()
+    if not stripped:
         return
-    try:
-        with open(USDX_LOG_FILE, 'r', encoding='utf-8', errors='ignore') as fh:
-            file_size = fh.seek(0, os.SEEK_END)
-            if PLAYLIST_LOG_POSITION > file_size:
-                PLAYLIST_LOG_POSITION = 0
-            fh.seek(PLAYLIST_LOG_POSITION)
-            new_lines = fh.readlines()
-            PLAYLIST_LOG_POSITION = fh.tell()
-    except FileNotFoundError:
-        logger.debug('USDX log file %s disappeared; will retry', USDX_LOG_FILE)
-        USDX_LOG_FILE = None
-        PLAYLIST_LOG_POSITION = 0
-        return
-    except Exception:
-        logger.exception('Failed to read USDX log file %s', USDX_LOG_FILE)
-        return
-    if new_lines:
-        logger.debug('Read %d new lines from USDX log %s', len(new_lines), USDX_LOG_FILE)
-    for line in new_lines:
-        stripped = line.strip()
-        if not stripped:
-            continue
+    with PLAYLIST_AUTOMATION_LOCK:
         if STATUS_END_ONSHOW_REGEX.search(stripped):
             logger.debug('Detected STATUS End [OnShow] log line: %s', stripped)
             _handle_song_started()
-            continue
+            return
         match = DECODER_REGEX.search(stripped)
         if match:
             logger.info('Detected decoder log entry: %s', match.group('path'))
             _process_decoder_path(match.group('path'))
-            continue
+            return
         if VIDEO_PLAYING_REGEX.search(stripped):
             logger.debug('Detected video playback log line: %s', stripped)
             _handle_video_playing_detected()
 
 
+def _seconds_until_playlist_deadline():
+    """Time until the countdown or phase timeout expires, or None if there is none."""
+    with PLAYLIST_STATE_LOCK:
+        if not PLAYLIST_STATE.get('enabled'):
+            return None
+        due = PLAYLIST_STATE.get('countdown_deadline') or PLAYLIST_STATE.get('phase_timeout')
+    if not due:
+        return None
+    return max(0.0, due - time.time())
+
+
 def playlist_automation_loop():
+    # Sleeps until the next countdown deadline or phase timeout; every write
+    # to PLAYLIST_STATE wakes it to look again. Log lines arrive through the
+    # tailer thread, not this loop.
     while not PLAYLIST_THREAD_STOP.is_set():
+        PLAYLIST_AUTOMATION_WAKE.clear()
         try:
-            _process_playlist_countdown()
-            _process_usdx_log_lines()
+            with PLAYLIST_AUTOMATION_LOCK:
+                _process_playlist_countdown()
         except Exception:
             logger.exception('Playlist automation loop error')
-        time.sleep(0.25)
+        PLAYLIST_AUTOMATION_WAKE.wait(_seconds_until_playlist_deadline())
 
 
 def start_playlist_thread():
-    global PLAYLIST_THREAD, PLAYLIST_LOG_POSITION
+    global PLAYLIST_THREAD, USDX_LOG_TAILER
     if PLAYLIST_THREAD and PLAYLIST_THREAD.is_alive():
         return
     _ensure_usdx_log_file()
     PLAYLIST_THREAD = threading.Thread(target=playlist_automation_loop, daemon=True)
     PLAYLIST_THREAD.start()
+    if USDX_LOG_TAILER is None:
+        USDX_LOG_TAILER = file_watch.LogTailer(_locate_usdx_log_file, _process_usdx_log_line).start()
+
 
 def _normalize_capacity_value(value, fallback=6):
     try:
@@ -1235,11 +1364,24 @@ SESSION_ROOMS = {}
 # SSE listeners will be set up after the Flask app is created to avoid
 # referencing `app` before initialization.
 
-# In-memory songs index (populated at startup or on demand)
-SONGS_LIST = None   # list of song entries
-SONGS_BY_ID = {}    # map id (str) -> entry
-
-app = Flask(__name__)
+# Resident songs catalog (populated at startup or on demand). Readers take a
+# reference via get_song_catalog(); rescans swap in a new catalog object.
+SONG_CATALOG = song_index.SongCatalog([])
+SONG_CATALOG_LOCK = threading.Lock()
+SONG_CATALOG_CHECK_INTERVAL = 2.0
+SONG_CATALOG_LAST_CHECK = 0.0
+# Serializes scans (startup scan and --watch-songs rescans)
+SONG_SCAN_LOCK = threading.Lock()
+SONG_WATCHER = None
+# Progress of the running (or last) song scan, reported by /status
+# Mapped data/lyrics_index.bin; rebuilt after every scan that changed songs
+LYRICS_INDEX = None
+SONG_SCAN_STATUS = {'running': False, 'full': False, 'started': None, 'finished': None, 'error': None,
+                    'stats': None}
+
+# /static is served by static_files() below, not by Flask's built-in route
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+app = Flask(__name__, static_folder=None)
 app.secret_key = os.environ.get('SECRET_KEY', 'eeWeidai3oSui8aike9vahyoh6kif2Uu')
 
 # SSE listeners for real-time room updates (list of queue.Queue)
@@ -1291,6 +1433,55 @@ def rooms_stream():
 
     return Response(stream_with_context(gen()), mimetype='text/event-stream')
 
+
+# SSE listeners for song catalog version bumps (list of queue.Queue)
+SONGS_LISTENERS = []
+SONGS_LISTENERS_LOCK = threading.Lock()
+
+
+def _songs_update_payload(catalog):
+    return json.dumps({'version': catalog.version, 'count': len(catalog)})
+
+
+def notify_songs_update(catalog):
+    """Tell all SSE listeners that a new song catalog version is live."""
+    payload = _songs_update_payload(catalog)
+    with SONGS_LISTENERS_LOCK:
+        for q in list(SONGS_LISTENERS):
+            try:
+                q.put(payload, block=False)
+            except Exception:
+                pass
+
+
+@app.route('/songs/stream')
+def songs_stream():
+    """Server-Sent Events stream of song catalog versions.
+
+    Emits {"version", "count"} on connect and whenever the library changes
+    (rescan or --watch-songs), so clients can refresh their song lists.
+    """
+    q = queue.Queue()
+    with SONGS_LISTENERS_LOCK:
+        SONGS_LISTENERS.append(q)
+
+    def gen():
+        try:
+            yield f"data: {_songs_update_payload(get_song_catalog())}\n\n"
+            while True:
+                data = q.get()
+                yield f"data: {data}\n\n"
+        except GeneratorExit:
+            return
+        finally:
+            with SONGS_LISTENERS_LOCK:
+                try:
+                    SONGS_LISTENERS.remove(q)
+                except ValueError:
+                    pass
+
+    return Response(stream_with_context(gen()), mimetype='text/event-stream')
+
 # Endpoint that merges rooms and control status and records a heartbeat
 @app.route('/status', methods=['GET'])
 def status():
@@ -1336,6 +1527,7 @@ def status():
                 'password_required': control_password_required(),
                 'password_ok': control_password_ok_for_session()
             },
+            'song_scan': song_scan_status(),
             'you': user_payload
         }
         return jsonify(payload)
@@ -1350,11 +1542,35 @@ def log_incoming_request():
         sid = session.get('session_id')
         if sid:
             LAST_SEEN[sid] = time.time()
-        if not request.path in ['/rooms', '/status', '/control/status', '/playlist/status'] and not request.path.startswith('/static/'):
+        if not request.path in ['/rooms', '/status', '/control/status', '/playlist/status', '/playlist/stream', '/songs/suggest', '/songs/stream', '/songs/cover'] and not request.path.startswith('/static/'):
             logger.info('Incoming request: %s %s args=%s', request.method, request.path, dict(request.args))
     except Exception:
         pass
 
+# JSON bodies below this size are sent uncompressed
+GZIP_MIN_SIZE = 1024
+
+
+@app.after_request
+def gzip_json_response(response):
+    """Gzip larger JSON responses for clients that accept it."""
+    try:
+        if (response.mimetype != 'application/json' or response.direct_passthrough
+                or not 200 <= response.status_code < 300 or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        if 'gzip' not in request.headers.get('Accept-Encoding', '').lower():
+            return response
+        data = response.get_data()
+        if len(data) < GZIP_MIN_SIZE:
+            return response
+        response.set_data(gzip.compress(data, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    except Exception:
+        logger.exception('Failed to compress response')
+    return response
+
+
 @app.route('/', methods=['GET']) # index route
 def index():
     global automatically_reconnect
@@ -1480,9 +1696,35 @@ def schedule_sink_repair(player_id, sink_index, attempts=10):
     t.start()
 
 
+# Parameter names of send_file differ between Flask 1.x and 2.x
+_SEND_FILE_PARAMS = inspect.signature(send_file).parameters
+# Lock-screen clips and song previews are revalidated after this many seconds
+MEDIA_MAX_AGE = 3600
+
+
+def send_media_file(path, mimetype=None, max_age=MEDIA_MAX_AGE, conditional=True, etag=True):
+    """send_file with byte ranges (206) and ETag/Last-Modified revalidation.
+
+    Passed explicitly because older Flask versions default to neither. With
+    --x-sendfile the body is left to the front-end web server.
+    """
+    kwargs = {'mimetype': mimetype, 'conditional': conditional}
+    kwargs['etag' if 'etag' in _SEND_FILE_PARAMS else 'add_etags'] = etag
+    if max_age is not None:
+        kwargs['max_age' if 'max_age' in _SEND_FILE_PARAMS else 'cache_timeout'] = max_age
+    return send_file(path, **kwargs)
+
+
 @app.route('/static/<path:path>')   # serve static files
 def static_files(path):
-    return app.send_static_file(path)
+    if path.endswith('.mp4'):
+        # lock-screen videos: phones seek with Range requests
+        static_root = os.path.realpath(STATIC_DIR)
+        candidate = os.path.realpath(os.path.join(static_root, path))
+        if not candidate.startswith(static_root + os.sep) or not os.path.isfile(candidate):
+            return jsonify({'success': False, 'error': 'Not found'}), 404
+        return send_media_file(candidate, mimetype='video/mp4')
+    return send_from_directory(STATIC_DIR, path)
 
 
 @app.context_processor
@@ -1794,91 +2036,198 @@ def get_mic_assignments():
     return result
 
 
-def scan_songs_and_build_index(find_root=None):
+def scan_songs_and_build_index(find_root=None, full=False, changed_dirs=None):
     """Scan the given root for songs under any 'songs' directory and build a JSON index.
 
     The index will be written to website/data/songs_index.json (next to this server file).
-    Each entry contains: txt (path), m4a (path), display (display name).
+    Each entry contains: txt (path), audio (path), display (display name) and the
+    song's header tags (artist, title, cover, video, language, genre, year,
+    previewstart, duet), parsed once at scan time.
+    A manifest (data/songs_manifest.json) lets later scans skip unchanged
+    directories and keep song ids stable; pass full=True to ignore it.
+    The catalog is also written to data/songs_index.bin, which is what the
+    server maps and queries.
+    `changed_dirs` (directories reported by the song watcher) are relisted
+    even if their mtime is unchanged and the manifest is trusted for all
+    other directories; without it every known song file is stat'ed. The catalog is only republished if a
+    song was actually added, changed or removed; otherwise, also at startup,
+    the loaded catalog and its version stay as they are.
     """
     base_dir = os.path.dirname(__file__)
-    data_dir = os.path.join(base_dir, 'data')
-    os.makedirs(data_dir, exist_ok=True)
-    paths_file = os.path.join(data_dir, 'song_txt_paths.txt')
-    index_file = os.path.join(data_dir, 'songs_index.json')
+    data_dir = DATA_DIR
 
     if find_root is None:
         find_root = args.usdx_dir
-    cmd = ['find', '-L', find_root, '-path', '*/songs/*', '-type', 'f', '-name', '*.txt']
-    logger.info('Scanning songs with: %s', ' '.join(cmd))
-    try:
-        proc = subprocess.run(cmd, cwd=base_dir, capture_output=True, text=True, check=False)
-        lines = [l.strip() for l in proc.stdout.splitlines() if l.strip()]
-    except Exception as e:
-        logger.exception('Song scan failed: %s', e)
-        lines = []
-
-    # write paths list
-    try:
-        with open(paths_file, 'w', encoding='utf-8') as fh:
-            for p in lines:
-                fh.write(p + '\n')
-    except Exception:
-        logger.exception('Failed to write %s', paths_file)
-
-    entries = []
-    for i, txtpath in enumerate(lines):
-        audio_ext = args.audio_format if 'args' in globals() else 'm4a'
-        audio_path = os.path.splitext(txtpath)[0] + f'.{audio_ext}'
-        display = os.path.splitext(os.path.basename(txtpath))[0].replace('_', ' ')
-        entry = {'id': i+1, 'txt': txtpath, audio_ext: audio_path, 'display': display, 'upl': False}
-        entries.append(entry)
+    audio_ext = args.audio_format if 'args' in globals() else 'm4a'
+    logger.info('Scanning songs below %s (%s scan)', find_root, 'full' if full else 'incremental')
+    stats = song_index.ScanStats()
+    with SONG_SCAN_LOCK:
+        SONG_SCAN_STATUS.update(running=True, full=bool(full), started=time.time(), finished=None, error=None,
+                                stats=stats)
         try:
-            _register_song_entry(entry)
-        except Exception:
-            logger.exception('Failed to register song entry for audio map: %s', entry.get('id'))
+            try:
+                entries = song_index.scan_library(find_root, base_dir, data_dir, audio_format=audio_ext,
+                                                  full=full, changed_dirs=changed_dirs, stats=stats)
+            except Exception as e:
+                logger.exception('Song scan failed: %s', e)
+                SONG_SCAN_STATUS['error'] = str(e)
+                return
+            if not stats.modified and SONG_CATALOG.source_path is not None:
+                logger.info('Song library unchanged; keeping catalog version %s', SONG_CATALOG.version)
+                if get_lyrics_index() is None:
+                    # only when there is none yet; an existing one is up to date
+                    _publish_lyrics(entries, None)
+                return
+            stats.phase = 'publishing'
+            _publish_scanned_songs(entries, audio_ext)
+            stats.phase = 'lyrics'
+            _publish_lyrics(entries, stats.parsed)
+        finally:
+            stats.phase = 'done'
+            SONG_SCAN_STATUS.update(running=False, finished=time.time())
 
+
+def song_scan_status():
+    """JSON-friendly progress of the running or last song scan."""
+    status = dict(SONG_SCAN_STATUS)
+    stats = status.pop('stats')
+    if stats is not None:
+        status.update(stats.to_dict())
+    status['songs'] = len(SONG_CATALOG)
+    status['catalog_version'] = SONG_CATALOG.version
+    return status
+
+
+def start_background_song_tasks():
+    """Scan the library, then start the watcher and cover prewarming.
+
+    Runs in a thread so the server answers requests right away, using the
+    index persisted by the previous run until the scan swaps in the result.
+    """
+    def run():
+        if not args.skip_scan_songs:
+            try:
+                scan_songs_and_build_index(find_root=args.usdx_dir, full=args.full_scan_songs)
+            except Exception:
+                logger.exception('Error scanning songs at startup')
+        else:
+            logger.info('Skipping songs scan at startup (--skip-scan-songs)')
+        if args.watch_songs:
+            try:
+                start_song_watcher()
+            except Exception:
+                logger.exception('Failed to start song watcher')
+        if args.prewarm_covers:
+            warm_cover_thumbnails(get_song_catalog())
+
+    thread = threading.Thread(target=run, name='song-startup', daemon=True)
+    thread.start()
+    return thread
+
+
+def _publish_scanned_songs(entries, audio_ext):
+    """Build the catalog for freshly scanned `entries` and make it live."""
     try:
-        with open(index_file, 'w', encoding='utf-8') as fh:
-            json.dump(entries, fh, indent=2, ensure_ascii=False)
-        logger.info('Wrote song index %s (%d entries)', index_file, len(entries))
-    except Exception:
-        logger.exception('Failed to write song index %s', index_file)
-    # populate in-memory index
-    try:
-        global SONGS_LIST, SONGS_BY_ID
-        SONGS_LIST = entries
-        SONGS_BY_ID = {str(e['id']): e for e in entries if 'id' in e}
-        logger.info('Populated in-memory songs index (%d entries)', len(SONGS_LIST))
+        try:
+            mtime_ns = os.stat(songs_index_file()).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        catalog = song_index.SongCatalog(entries, version=mtime_ns or time.time_ns(), source_mtime_ns=mtime_ns,
+                                         audio_format=audio_ext, base_dir=BASE_DIR, source_path=songs_index_file())
+        set_song_catalog(song_index.publish_catalog(catalog, DATA_DIR))
     except Exception:
         logger.exception('Failed to populate in-memory songs index')
 
 
-def load_songs_index():
-    base_dir = os.path.dirname(__file__)
-    index_file = os.path.join(base_dir, 'data', 'songs_index.json')
+def _publish_lyrics(entries, changed):
+    """Update data/lyrics_index.bin for `entries` and make it live."""
+    global LYRICS_INDEX
+    path = os.path.join(DATA_DIR, song_index.LYRICS_INDEX_FILENAME)
     try:
-        with open(index_file, 'r', encoding='utf-8') as fh:
-            items = json.load(fh)
-            # populate in-memory index if not present
-            global SONGS_LIST, SONGS_BY_ID
-            SONGS_LIST = items
-            SONGS_BY_ID = {str(e.get('id')): e for e in items if 'id' in e}
-            try:
-                global SONGS_BY_AUDIO
-                SONGS_BY_AUDIO = {}
-                for entry in items:
-                    _register_song_entry(entry)
-            except Exception:
-                logger.exception('Failed to rebuild song audio map')
-            return items
+        if song_index.build_lyrics_index(entries, BASE_DIR, path, changed=changed) or LYRICS_INDEX is None:
+            LYRICS_INDEX = song_index.LyricsIndex.open(path)
     except Exception:
-        logger.exception('Failed to load song index %s', index_file)
-        return []
+        logger.exception('Failed to build lyrics index %s', path)
+
+
+def get_lyrics_index():
+    """Return the lyrics index, opening the persisted one on first use."""
+    global LYRICS_INDEX
+    if LYRICS_INDEX is None:
+        LYRICS_INDEX = song_index.LyricsIndex.open(os.path.join(DATA_DIR, song_index.LYRICS_INDEX_FILENAME))
+    return LYRICS_INDEX
+
+
+def songs_index_file():
+    return os.path.join(DATA_DIR, 'songs_index.json')
+
+
+def set_song_catalog(catalog):
+    """Atomically replace the resident song catalog."""
+    global SONG_CATALOG, SONG_CATALOG_LAST_CHECK
+    with SONG_CATALOG_LOCK:
+        SONG_CATALOG = catalog
+        SONG_CATALOG_LAST_CHECK = time.time()
+    logger.info('Populated in-memory songs index (%d entries, version %s)', len(catalog), catalog.version)
+    notify_songs_update(catalog)
+
+
+def get_song_catalog(force_check=False):
+    """Return the resident song catalog.
+
+    The index (songs_index.bin, or songs_index.json if there is no binary
+    index) is only reopened when its mtime differs from the one the catalog
+    was built from; the stat itself is rate-limited to one per
+    SONG_CATALOG_CHECK_INTERVAL unless `force_check` is set.
+    """
+    global SONG_CATALOG, SONG_CATALOG_LAST_CHECK
+    catalog = SONG_CATALOG
+    now = time.time()
+    if not force_check and now - SONG_CATALOG_LAST_CHECK < SONG_CATALOG_CHECK_INTERVAL:
+        return catalog
+    with SONG_CATALOG_LOCK:
+        SONG_CATALOG_LAST_CHECK = now
+        index_file = song_index.catalog_source_path(DATA_DIR)
+        try:
+            mtime_ns = os.stat(index_file).st_mtime_ns
+        except OSError:
+            return SONG_CATALOG
+        if SONG_CATALOG.source_path == index_file and SONG_CATALOG.source_mtime_ns == mtime_ns:
+            return SONG_CATALOG
+        loaded = song_index.load_catalog(DATA_DIR, audio_format=_playlist_audio_key(), base_dir=BASE_DIR)
+        if loaded is None:
+            return SONG_CATALOG
+        SONG_CATALOG = loaded
+        catalog = loaded
+    logger.info('Loaded songs index from %s (%d entries, version %s)', index_file, len(catalog), catalog.version)
+    notify_songs_update(catalog)
+    return catalog
+
+
+def start_song_watcher():
+    """Keep the song index current while the server runs (--watch-songs)."""
+    global SONG_WATCHER
+    root = os.path.join(BASE_DIR, args.usdx_dir)
+
+    def on_change(paths):
+        logger.info('Song library changed (%s); rescanning',
+                    'queue overflow' if paths is None else f'{len(paths)} directories')
+        # after an overflow the changes are unknown: no hint, so every song file is stat'ed
+        scan_songs_and_build_index(find_root=args.usdx_dir, changed_dirs=paths)
+
+    SONG_WATCHER = file_watch.TreeWatcher(root, on_change, name_filter=lambda name: name.endswith('.txt'))
+    SONG_WATCHER.start()
+
+
+def load_songs_index():
+    return get_song_catalog().entries
 
 
 @app.route('/songs/index', methods=['GET'])
 def songs_index():
-    return jsonify({'success': True, 'count': len(load_songs_index()), 'items': load_songs_index()})
+    items = load_songs_index()
+    membership = playlist_membership()
+    return jsonify({'success': True, 'count': len(items), 'items': [song_to_dict(e, membership) for e in items]})
 
 
 @app.route('/rooms', methods=['GET'])
@@ -2277,19 +2626,244 @@ def update_config_players():
             pass
         return False
 
+def _encode_song_cursor(version, q, offset):
+    raw = f'{version}:{zlib.crc32(q.encode("utf-8"))}:{offset}'
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def _decode_song_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        version, q_hash, offset = (int(part) for part in raw.split(':'))
+    except Exception:
+        return None
+    if offset < 0:
+        return None
+    return version, q_hash, offset
+
+
 @app.route('/songs/search', methods=['GET'])
 def songs_search():
+    """Search the song catalog.
+
+    Pages are addressed either with page/per_page or with the opaque
+    `next_cursor` of the previous response (?cursor=...&limit=...). A cursor
+    belongs to one catalog version and query; once the library changed it is
+    rejected with 409 and the client starts over. `fields` selects the keys
+    of each item (e.g. fields=compact or fields=id,title,upl).
+    scope=lyrics finds songs whose lyrics contain the words of `q` in that
+    order instead; each item then has a 'lyrics' snippet around the match.
+    Facet filters (language, genre, decade such as 1980s, duet and video as
+    yes/no) narrow the result; repeat a parameter to accept several values.
+    facets=1 adds the number of results per facet value.
+    id=<song id> returns just that song (e.g. a picked suggestion); `q` is
+    then only echoed back.
+    """
     q = request.args.get('q', '').strip().lower()
-    page = int(request.args.get('page', '1'))
-    per_page = int(request.args.get('per_page', '50'))
-    items = load_songs_index()
-    if q:
-        items = [it for it in items if q in it.get('display','').lower()]
-    total = len(items)
-    start = (page-1)*per_page
+    song_id = request.args.get('id', '').strip()
+    scope = request.args.get('scope', 'title')
+    if scope not in ('title', 'lyrics'):
+        return jsonify({'success': False, 'error': 'scope must be title or lyrics'}), 400
+    filters = {}
+    for facet in song_index.FACETS:
+        values = [v.strip() for v in request.args.getlist(facet) if v.strip()]
+        if values:
+            filters[facet] = values
+    want_facets = request.args.get('facets', '').lower() in ('1', 'true', 'yes')
+    cursor_key = json.dumps([scope, q, song_id, sorted(filters.items())])
+    try:
+        page = max(1, int(request.args.get('page', '1')))
+        per_page = max(1, min(500, int(request.args.get('limit') or request.args.get('per_page', '50'))))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid page or per_page'}), 400
+    try:
+        fields = parse_song_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    catalog = get_song_catalog()
+    start = (page - 1) * per_page
+    cursor = request.args.get('cursor')
+    if cursor:
+        decoded = _decode_song_cursor(cursor)
+        if decoded is None or decoded[1] != zlib.crc32(cursor_key.encode('utf-8')):
+            return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+        if decoded[0] != catalog.version:
+            return jsonify({'success': False, 'error': 'Song library changed; restart the search',
+                            'version': catalog.version}), 409
+        start = decoded[2]
     end = start + per_page
-    page_items = items[start:end]
-    return jsonify({'success': True, 'q': q, 'page': page, 'per_page': per_page, 'total': total, 'items': page_items})
+    # rows of the matching songs, in catalog order (None: every song)
+    positions = None
+    if song_id:
+        row = catalog.row_of(song_id)
+        rows = [] if row is None else [row]
+    elif scope == 'lyrics':
+        lyrics = get_lyrics_index()
+        positions = {}
+        for song_id, position in (lyrics.search(q) if lyrics is not None and q else []):
+            row = catalog.row_of(song_id)
+            if row is not None:
+                positions.setdefault(row, position)
+        rows = sorted(positions)
+    else:
+        rows = catalog.search_rows(q) if q else None
+    facet_counts = None
+    if filters or want_facets:
+        facets = catalog.facets
+        matched = facets.all_rows if rows is None else song_index.rows_to_mask(rows)
+        selected = facets.filter(filters, matched)
+        total = song_index.popcount(selected)
+        page_rows = song_index.mask_rows(selected, start, end)
+        if want_facets:
+            facet_counts = facets.counts(matched, filters)
+    else:
+        total = len(catalog) if rows is None else len(rows)
+        page_rows = range(start, min(end, total)) if rows is None else rows[start:end]
+    membership = playlist_membership()
+    entries = catalog.entries
+    page_items = [song_to_dict(entries[row], membership, fields) for row in page_rows]
+    if positions is not None:
+        length = len(song_index.lyric_words(q))
+        for item, row in zip(page_items, page_rows):
+            item['lyrics'] = lyrics.snippet(positions[row], length)
+    next_cursor = _encode_song_cursor(catalog.version, cursor_key, end) if end < total else None
+    payload = {'success': True, 'q': q, 'page': page, 'per_page': per_page, 'total': total,
+               'version': catalog.version, 'next_cursor': next_cursor, 'items': page_items}
+    if facet_counts is not None:
+        payload['facets'] = facet_counts
+    return jsonify(payload)
+
+
+@app.route('/songs/suggest', methods=['GET'])
+def songs_suggest():
+    """As-you-type completions: {items: [[id, "Artist - Title"], ...]} ranked by match quality."""
+    q = request.args.get('q', '').strip()
+    try:
+        limit = max(1, min(20, int(request.args.get('limit', '8'))))
+    except Exception:
+        limit = 8
+    if not q:
+        return jsonify({'success': True, 'q': q, 'items': []})
+    pairs = get_song_catalog().suggest(q, limit)
+    return jsonify({'success': True, 'q': q, 'items': [[song_id, label] for song_id, label in pairs]})
+
+
+def _playlist_line_for_entry(entry):
+    line = derive_playlist_label(entry)
+    if not line:
+        fallback = entry.get('display') or os.path.splitext(os.path.basename(entry.get('txt', '')))[0].replace('_', ' ')
+        line = normalize_playlist_label(fallback or '')
+    return line
+
+
+PLAYLIST_BATCH_MAX_OPS = 500
+
+
+def parse_playlist_batch(ops, catalog):
+    """Validate /playlist/batch operations into (op, line, from, to) tuples.
+
+    Raises ValueError naming the first invalid operation.
+    """
+    if not isinstance(ops, list) or not ops:
+        raise ValueError('Expected a non-empty list of operations')
+    if len(ops) > PLAYLIST_BATCH_MAX_OPS:
+        raise ValueError(f'At most {PLAYLIST_BATCH_MAX_OPS} operations per batch')
+    parsed = []
+    for n, op in enumerate(ops):
+        kind = op.get('op') if isinstance(op, dict) else None
+        if kind not in ('add', 'remove', 'move'):
+            raise ValueError(f'Operation {n}: unknown op {kind!r}')
+        line = None
+        if op.get('id') is not None:
+            entry = catalog.get(op['id'])
+            if not entry:
+                raise ValueError(f'Operation {n}: song {op["id"]} not found')
+            line = _playlist_line_for_entry(entry)
+            if not line:
+                raise ValueError(f'Operation {n}: unable to derive playlist label')
+        elif kind != 'move' or op.get('from') is None:
+            raise ValueError(f'Operation {n}: missing id')
+        source = target = None
+        if kind == 'move':
+            try:
+                target = int(op['to'])
+                source = int(op['from']) if op.get('from') is not None else None
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f'Operation {n}: move needs integer "to" (and optional "from") positions')
+        parsed.append((kind, line, source, target))
+    return parsed
+
+
+def apply_playlist_batch(parsed, expected_version=None):
+    """Apply parsed batch operations in one critical section.
+
+    The playlist writer cannot snapshot the lines in between, so the whole
+    batch reaches the .upl file in a single write. Returns None if
+    `expected_version` is given and the playlist has changed since, else
+    (version, length, per-operation "changed anything" flags).
+    """
+    model = get_playlist_model()
+    applied = []
+    with PLAYLIST_FILE_LOCK:
+        if expected_version is not None and expected_version != model.version:
+            return None
+        for kind, line, source, target in parsed:
+            if kind == 'add':
+                changed = not model.contains_locked(line) and model.append_locked(line)
+            elif kind == 'remove':
+                changed = model.remove_locked(line) > 0
+            else:
+                if line is not None:
+                    # "from" only picks among duplicates of the song
+                    source = model.find_locked(line, source or 0)
+                changed = source is not None and model.move_locked(source, target)
+            applied.append(bool(changed))
+        version = model.version
+        length = len(model)
+    refresh_playlist_state_cache()
+    return version, length, applied
+
+
+@app.route('/playlist/items', methods=['GET'])
+def playlist_items():
+    model = get_playlist_model()
+    with PLAYLIST_FILE_LOCK:
+        lines = model.lines_locked()
+        version = model.version
+    with PLAYLIST_STATE_LOCK:
+        current_index = PLAYLIST_STATE.get('current_index', 0)
+    return jsonify({'success': True, 'version': version, 'current_index': current_index, 'items': lines})
+
+
+@app.route('/playlist/batch', methods=['POST'])
+def playlist_batch():
+    """Apply several playlist edits with one lock and one file write.
+
+    JSON body: {"ops": [...], "version": optional}. Operations run in order:
+    {"op": "add"|"remove", "id": song id} and {"op": "move", "to": position}
+    with the song's "id" and/or its current position "from". With "version"
+    the batch is refused (409) if the playlist changed in the meantime.
+    Returns the new playlist version and length and, per operation, whether
+    it changed anything (adding a song already queued does not).
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    expected_version = data.get('version')
+    if expected_version is not None and not isinstance(expected_version, int):
+        return jsonify({'success': False, 'error': 'version must be an integer'}), 400
+    try:
+        parsed = parse_playlist_batch(data.get('ops'), get_song_catalog())
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    try:
+        result = apply_playlist_batch(parsed, expected_version)
+    except Exception as e:
+        logger.exception('Failed to apply playlist batch')
+        return jsonify({'success': False, 'error': str(e)}), 500
+    if result is None:
+        return jsonify({'success': False, 'error': 'Playlist changed; reload and retry',
+                        'error_code': 'version_conflict', 'version': get_playlist_model().version}), 409
+    version, length, applied = result
+    return jsonify({'success': True, 'version': version, 'length': length, 'applied': applied})
 
 
 @app.route('/songs/add_to_upl', methods=['POST'])
@@ -2302,65 +2876,69 @@ def songs_add_to_upl():
         return jsonify({'success': False, 'error': 'Missing id'}), 400
 
     try:
-        global SONGS_LIST, SONGS_BY_ID
-        if not SONGS_BY_ID:
-            load_songs_index()
-
-        entry = SONGS_BY_ID.get(str(id_param))
+        catalog = get_song_catalog()
+        entry = catalog.get(id_param)
         if not entry:
             return jsonify({'success': False, 'error': 'Not found', 'id': id_param}), 404
 
-        line = derive_playlist_label(entry)
-        if not line:
-            fallback = entry.get('display') or os.path.splitext(os.path.basename(entry.get('txt', '')))[0].replace('_', ' ')
-            line = normalize_playlist_label(fallback or '')
+        line = _playlist_line_for_entry(entry)
         if not line:
             return jsonify({'success': False, 'error': 'Unable to derive playlist label'}), 500
 
-        updated_lines = []
+        model = get_playlist_model()
         with PLAYLIST_FILE_LOCK:
-            lines = _read_playlist_lines_unlocked()
-            os.makedirs(os.path.dirname(playlist_file_path()), exist_ok=True)
             if action == 'add':
-                if line not in lines:
-                    lines.append(line)
-                    _write_playlist_lines_unlocked(lines)
-                entry['upl'] = True
-                updated_lines = list(lines)
+                if not model.contains_locked(line):
+                    model.append_locked(line)
             elif action == 'remove':
-                newlines = [l for l in lines if l.strip() != line]
-                if len(newlines) != len(lines):
-                    _write_playlist_lines_unlocked(newlines)
-                entry['upl'] = False
-                updated_lines = list(newlines)
+                model.remove_locked(line)
             else:
                 return jsonify({'success': False, 'error': 'Unknown action'}), 400
 
-        # persist updated index to disk
-        try:
-            base_dir = os.path.dirname(__file__)
-            index_file = os.path.join(base_dir, 'data', 'songs_index.json')
-            with open(index_file, 'w', encoding='utf-8') as fh:
-                json.dump(SONGS_LIST, fh, indent=2, ensure_ascii=False)
-        except Exception:
-            logger.exception('Failed to persist song index after upl change')
-
-        # update in-memory map
-        SONGS_BY_ID[str(entry.get('id'))] = entry
-        try:
-            _register_song_entry(entry)
-        except Exception:
-            logger.exception('Failed to refresh song audio mapping for entry %s', entry.get('id'))
+        # membership lives in the playlist file; the song index is not rewritten
+        refresh_playlist_state_cache()
 
-        refresh_playlist_state_cache(updated_lines)
-
-        return jsonify({'success': True, 'id': entry.get('id'), 'upl': entry.get('upl', False), 'line': line})
+        return jsonify({'success': True, 'id': entry.get('id'), 'upl': action == 'add', 'line': line})
 
     except Exception as e:
         logger.exception('Failed to modify upl file')
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# Preview clips: a short mono AAC cut starting at the song's #PREVIEWSTART.
+# If a clip is not ready within PREVIEW_BUILD_WAIT seconds the full track is
+# sent instead; the clip keeps being built for the next request.
+PREVIEW_CLIP_SECONDS = 30
+PREVIEW_CLIP_BITRATE = '48k'
+PREVIEW_BUILD_WAIT = 5.0
+
+
+def preview_cache():
+    return _media_cache('previews', args.preview_cache_mb if 'args' in globals() else 300, '.m4a')
+
+
+def _preview_clip_builder(source, start):
+    def build(tmp_path):
+        return media_cache.run_ffmpeg(['-ss', f'{start:.3f}', '-t', str(PREVIEW_CLIP_SECONDS), '-i', source,
+                                       '-vn', '-ac', '1', '-c:a', 'aac', '-b:a', PREVIEW_CLIP_BITRATE,
+                                       '-movflags', '+faststart', tmp_path], timeout=60)
+    return build
+
+
+def preview_clip_path(entry, source):
+    """Return the cached preview clip of `source`, or None if unavailable."""
+    if not media_cache.find_ffmpeg():
+        return None
+    try:
+        st = os.stat(source)
+    except OSError:
+        return None
+    start = max(0.0, float(entry.get('previewstart') or 0))
+    key = media_cache.MediaCache.make_key(source, st.st_mtime_ns, st.st_size, start, PREVIEW_CLIP_SECONDS,
+                                          PREVIEW_CLIP_BITRATE)
+    return preview_cache().get(key, _preview_clip_builder(source, start), timeout=PREVIEW_BUILD_WAIT)
+
+
 @app.route('/songs/preview')
 def songs_preview():
     # preview m4a path passed as query param 'path' (the path as stored in index)
@@ -2375,30 +2953,14 @@ def songs_preview():
             return jsonify({'success': False, 'error': 'Missing id'}), 400
 
         try:
-            global SONGS_BY_ID
-            found = None
-            if SONGS_BY_ID and str(id_param) in SONGS_BY_ID:
-                found = SONGS_BY_ID.get(str(id_param))
-            else:
-                # fallback: load index and rebuild mapping
-                items = load_songs_index()
-                found = None
-                for it in items:
-                    if 'id' in it and str(it.get('id')) == str(id_param):
-                        found = it
-                        break
-                # repopulate in-memory map
-                try:
-                    SONGS_BY_ID = {str(e.get('id')): e for e in items if 'id' in e}
-                except Exception:
-                    pass
+            found = get_song_catalog().get(id_param)
 
             if not found:
                 logger.warning('Preview id not found: %s', id_param)
                 return jsonify({'success': False, 'error': 'Not found', 'id': id_param}), 404
 
             audio_ext = args.audio_format if 'args' in globals() else 'm4a'
-            m4apath = found.get(audio_ext)
+            m4apath = found.get('audio') or found.get(audio_ext)
             candidate = os.path.realpath(os.path.join(base_dir, m4apath))
             logger.info('Preview by id=%s resolved to %s', id_param, candidate)
         except Exception as e:
@@ -2407,7 +2969,7 @@ def songs_preview():
 
         logger.info('Preview request candidate=%s allowed_root=%s', candidate, allowed_root)
 
-        if not candidate.startswith(allowed_root):
+        if not candidate.startswith(allowed_root + os.sep):
             logger.warning('Preview request outside allowed root: %s', candidate)
             return jsonify({'success': False, 'error': 'Forbidden'}), 403
 
@@ -2415,12 +2977,127 @@ def songs_preview():
             logger.warning('Preview candidate not found: %s', candidate)
             return jsonify({'success': False, 'error': 'Not found', 'path': candidate}), 404
 
-        return send_file(candidate)
+        # ?full=1 asks for the whole track instead of the preview clip
+        if request.args.get('full') != '1':
+            clip = preview_clip_path(found, candidate)
+            if clip is not None:
+                return send_media_file(clip, mimetype='audio/mp4')
+        return send_media_file(candidate)
+    except HTTPException:
+        # e.g. 416 for a range beyond the end of the file
+        raise
     except Exception as e:
         logger.exception('Error handling preview request: %s', e)
         return jsonify({'success': False, 'error': 'Server error', 'detail': str(e)}), 500
 
 
+# Media derived from song files with ffmpeg, cached below data/<name>
+# (size-bounded, least recently used files are evicted); created on first use
+MEDIA_CACHES = {}
+MEDIA_CACHES_LOCK = threading.Lock()
+
+
+def _media_cache(name, max_mb, suffix):
+    with MEDIA_CACHES_LOCK:
+        cache = MEDIA_CACHES.get(name)
+        if cache is None:
+            cache = media_cache.MediaCache(os.path.join(DATA_DIR, name), max_mb * 2**20, workers=2, suffix=suffix)
+            MEDIA_CACHES[name] = cache
+            if not media_cache.find_ffmpeg():
+                logger.warning('ffmpeg not found; serving original files instead of data/%s', name)
+        return cache
+
+
+# Cover thumbnails: resized once and served with strong ETags.
+COVER_THUMB_SIZE = 200
+COVER_BUILD_TIMEOUT = 10.0
+
+
+def cover_cache():
+    return _media_cache('covers', args.cover_cache_mb if 'args' in globals() else 200, '.jpg')
+
+
+def _cover_source(entry):
+    """Return (path, cache key) of the song's cover image, or (None, None)."""
+    cover = entry.get('cover') if entry else None
+    if not cover:
+        return None, None
+    path = cover if os.path.isabs(cover) else os.path.join(BASE_DIR, cover)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, None
+    return path, media_cache.MediaCache.make_key(path, st.st_mtime_ns, st.st_size, COVER_THUMB_SIZE)
+
+
+def cover_thumbnail_url(entry):
+    _, key = _cover_source(entry)
+    if not key:
+        return None
+    # the key changes with the cover file, so the URL can be cached forever
+    return f'/songs/cover?id={entry.id}&v={key}'
+
+
+def _cover_thumbnail_builder(source):
+    def build(tmp_path):
+        scale = f'scale=w={COVER_THUMB_SIZE}:h={COVER_THUMB_SIZE}:force_original_aspect_ratio=decrease'
+        return media_cache.run_ffmpeg(['-i', source, '-vf', scale, '-frames:v', '1', '-q:v', '4', tmp_path])
+    return build
+
+
+def warm_cover_thumbnails(catalog):
+    """Create missing thumbnails for `catalog` one at a time (--prewarm-covers)."""
+    if not media_cache.find_ffmpeg():
+        return
+    cache = cover_cache()
+    started = time.time()
+    built = 0
+    for entry in catalog.entries:
+        source, key = _cover_source(entry)
+        if key and cache.lookup(key) is None:
+            if cache.get(key, _cover_thumbnail_builder(source)):
+                built += 1
+    logger.info('Prewarmed %d cover thumbnails in %.1fs', built, time.time() - started)
+
+
+@app.route('/songs/cover')
+def songs_cover():
+    """Cover thumbnail of ?id=; ?v= is the version from the item's cover_url."""
+    try:
+        entry = get_song_catalog().get(request.args.get('id'))
+        source, key = _cover_source(entry)
+        if not key:
+            return jsonify({'success': False, 'error': 'Not found'}), 404
+        allowed_root = os.path.realpath(os.path.join(BASE_DIR, args.usdx_dir, 'songs'))
+        if not os.path.realpath(source).startswith(allowed_root + os.sep):
+            logger.warning('Cover outside allowed root: %s', source)
+            return jsonify({'success': False, 'error': 'Forbidden'}), 403
+
+        immutable = request.args.get('v') == key
+        if key in request.if_none_match or (key + '-orig') in request.if_none_match:
+            response = Response(status=304)
+        else:
+            path = cover_cache().get(key, _cover_thumbnail_builder(source), timeout=COVER_BUILD_TIMEOUT)
+            if path is not None:
+                response = send_media_file(path, mimetype='image/jpeg', max_age=None, conditional=False, etag=False)
+            else:
+                # no ffmpeg, or the cover could not be converted
+                response = send_media_file(source, max_age=None, conditional=False, etag=False)
+                key = key + '-orig'
+        response.set_etag(key)
+        if immutable:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = 365 * 24 * 3600
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
+    except Exception as e:
+        logger.exception('Error serving cover: %s', e)
+        return jsonify({'success': False, 'error': 'Server error'}), 500
+
+
 @app.route('/playlist/status', methods=['GET'])
 def playlist_status():
     try:
@@ -2431,6 +3108,48 @@ def playlist_status():
         return jsonify({'success': False, 'error': str(exc)}), 500
 
 
+@app.route('/playlist/stream')
+def playlist_stream():
+    """Server-Sent Events stream of playlist status changes.
+
+    Sends the current status on connect and a new event (with an increasing
+    "version", also the SSE id) whenever phase, songs, countdown deadline,
+    errors or the playlist change. Countdowns are not ticked by the server:
+    clients compute the remaining time from "countdown_deadline" and
+    "server_time".
+    """
+    ensure_playlist_events_thread()
+    if PLAYLIST_EVENTS['snapshot'] is None:
+        publish_playlist_event()
+    q = queue.Queue()
+    with PLAYLIST_LISTENERS_LOCK:
+        PLAYLIST_LISTENERS.append(q)
+        version = PLAYLIST_EVENTS['version']
+        message = _playlist_event_message(PLAYLIST_EVENTS['snapshot'], version)
+
+    def gen():
+        try:
+            yield f"id: {version}\ndata: {message}\n\n"
+            while True:
+                try:
+                    event_version, data = q.get(timeout=PLAYLIST_STREAM_KEEPALIVE)
+                except queue.Empty:
+                    # lets dead connections fail instead of queueing forever
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"id: {event_version}\ndata: {data}\n\n"
+        except GeneratorExit:
+            return
+        finally:
+            with PLAYLIST_LISTENERS_LOCK:
+                try:
+                    PLAYLIST_LISTENERS.remove(q)
+                except ValueError:
+                    pass
+
+    return Response(stream_with_context(gen()), mimetype='text/event-stream')
+
+
 @app.route('/playlist/toggle', methods=['POST'])
 def playlist_toggle():
     data = request.get_json(force=True, silent=True) or {}
@@ -2755,14 +3474,24 @@ if __name__ == '__main__':
     server_group = parser.add_argument_group('Server Options')
     server_group.add_argument('--debug', action='store_true', help='Enable debug mode')
     server_group.add_argument('--skip-scan-songs', action='store_true', help='Skip scanning songs and building songs_index.json at startup')
+    server_group.add_argument('--full-scan-songs', action='store_true', help='Ignore the song manifest and rescan every song directory at startup')
+    server_group.add_argument('--watch-songs', action='store_true', help='Watch the song folders (inotify, or polling) and update the song index while running')
+    server_group.add_argument('--x-sendfile', action='store_true', help='Let a front-end web server (Apache mod_xsendfile, lighttpd) send media files via X-Sendfile')
+    server_group.add_argument('--cover-cache-mb', type=int, default=200, help='Disk budget for cover thumbnails in data/covers (default: 200)')
+    server_group.add_argument('--preview-cache-mb', type=int, default=300, help='Disk budget for song preview clips in data/previews (default: 300)')
+    server_group.add_argument('--prewarm-covers', action='store_true', help='Create cover thumbnails for all songs in the background after the song scan')
+    server_group.add_argument('--autofill-popular-share', type=float, default=0.5, help='Share of songs auto-added to an empty playlist that are picked by how often they were sung before (0-1, default: 0.5)')
     server_group.add_argument('--control-password', type=str, default=None, help='Require this password before accessing the Control tab')
     server_group.add_argument('--control-only', action='store_true', help='Disable microphone/WebRTC features and expose control-only web UI')
     server_group.add_argument('--max-name-length', type=int, default=16, help='Maximum characters allowed for player display names (default: 16)')
 
     args = parser.parse_args()
 
+    if args.x_sendfile:
+        app.config['USE_X_SENDFILE'] = True
     CONTROL_PASSWORD = args.control_password
     CONTROL_ONLY_MODE = bool(args.control_only)
+    AUTOFILL_POPULAR_SHARE = min(1.0, max(0.0, args.autofill_popular_share))
     try:
         MAX_NAME_LENGTH = max(1, int(args.max_name_length))
     except Exception:
@@ -2890,15 +3619,12 @@ if __name__ == '__main__':
         except Exception:
             logger.exception('Failed to start stale cleanup thread')
 
-    # Build/update song index at startup (can be skipped with --skip-scan-songs)
-    if not getattr(args, 'skip_scan_songs', False):
-        try:
-            print("Scanning songs and building index...")
-            scan_songs_and_build_index(find_root=args.usdx_dir)
-        except Exception:
-            logger.exception('Error scanning songs at startup')
-    else:
-        logger.info('Skipping songs scan at startup (--skip-scan-songs)')
+    # Serve the index of the previous run right away; the song scan (skipped
+    # with --skip-scan-songs) runs in the background and swaps in its result.
+    catalog = get_song_catalog(force_check=True)
+    print(f"Loaded {len(catalog)} songs from the last index"
+          + ("" if args.skip_scan_songs else "; scanning songs in the background..."))
+    start_background_song_tasks()
 
     # Ensure playlist file exists and is truncated at startup
     try:
@@ -0,0 +1,1866 @@
+"""Song library scanning and index persistence for SmartMicrophone.
+
+The scanner walks the UltraStar Deluxe directory for song ``.txt`` files
+below any ``songs`` folder (the same selection as
+``find -L <usdx_dir> -path '*/songs/*' -name '*.txt'``) and keeps a manifest
+of every directory and song file it has seen next to ``songs_index.json``.
+On the next start only directories whose mtime changed are listed again,
+known song files are only stat'ed, and only new or modified ones are
+rebuilt; song ids stay stable across rescans.
+
+The resulting SongCatalog is also written to ``songs_index.bin``, a
+memory-mappable binary format (see MappedSongCatalog) that the server opens
+instead of decoding songs_index.json; the JSON file is kept for
+compatibility.
+"""
+
+import bisect
+import concurrent.futures
+import contextlib
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import math
+import mmap
+import operator
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+from array import array
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+INDEX_FILENAME = 'songs_index.json'
+MANIFEST_FILENAME = 'songs_manifest.json'
+PATHS_FILENAME = 'song_txt_paths.txt'
+
+
+@contextlib.contextmanager
+def _atomic_output(path, mode='wb'):
+    """Open a new file that replaces `path` once the block completes.
+
+    The temporary file gets a unique name next to `path`, so a scan and a
+    request converting the index at the same time never write into the same
+    file; whichever finishes last wins with a complete index.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                    prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with open(fd, mode, **({} if 'b' in mode else {'encoding': 'utf-8'})) as fh:
+            yield fh
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _write_json_atomic(path, payload, indent=None):
+    with _atomic_output(path, 'w') as fh:
+        json.dump(payload, fh, indent=indent, ensure_ascii=False)
+
+
+def _load_json(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return default
+    except Exception:
+        logger.exception('Failed to read %s', path)
+        return default
+
+
+def _is_song_txt(label_path):
+    # Mirrors find's `-path '*/songs/*' -name '*.txt'`
+    return label_path.endswith('.txt') and '/songs/' in label_path
+
+
+def load_manifest(data_dir):
+    manifest = _load_json(os.path.join(data_dir, MANIFEST_FILENAME), None)
+    if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+        return None
+    if not isinstance(manifest.get('dirs'), dict) or not isinstance(manifest.get('files'), dict):
+        return None
+    return manifest
+
+
+# Header tags copied into the index; file references are resolved relative
+# to the song's .txt file.
+HEADER_TEXT_TAGS = {'ARTIST': 'artist', 'TITLE': 'title', 'LANGUAGE': 'language', 'GENRE': 'genre'}
+HEADER_FILE_TAGS = {'MP3': 'audio', 'AUDIO': 'audio', 'COVER': 'cover', 'VIDEO': 'video'}
+SCAN_WORKERS = min(16, (os.cpu_count() or 1) * 4)
+# Directory listing is latency bound (NAS mounts), not CPU bound
+WALK_WORKERS = 32
+
+
+def _decode_song_text(raw):
+    if raw.startswith(b'\xef\xbb\xbf'):
+        raw = raw[3:]
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        # UltraStar files without #ENCODING are traditionally CP1252
+        return raw.decode('cp1252', errors='replace')
+
+
+def parse_song_header(fs_path):
+    """Parse the #TAG:value header of an UltraStar .txt file.
+
+    Returns a dict with the raw tag values (upper-case keys) plus 'DUET'
+    when the file has P1/P2 sections. Returns None if the file is unreadable.
+    """
+    try:
+        with open(fs_path, 'rb') as fh:
+            text = _decode_song_text(fh.read())
+    except OSError:
+        return None
+    tags = {}
+    in_header = True
+    for line in text.splitlines():
+        s = line.strip()
+        if not s:
+            continue
+        if in_header and s.startswith('#'):
+            key, sep, value = s[1:].partition(':')
+            if sep:
+                tags.setdefault(key.strip().upper(), value.strip())
+            continue
+        in_header = False
+        if s[0] == 'P' and s[1:2].strip().isdigit():
+            tags['DUET'] = True
+            break
+    if tags.get('P1') or tags.get('DUETSINGERP1'):
+        tags['DUET'] = True
+    return tags
+
+
+def _parse_number(value, kind):
+    if value is None:
+        return None
+    try:
+        return kind(str(value).strip().replace(',', '.'))
+    except (TypeError, ValueError):
+        return None
+
+
+def build_entry(song_id, txt_path, audio_format, header=None):
+    header = header or {}
+    song_dir = os.path.dirname(txt_path)
+    entry = {'id': song_id, 'txt': txt_path}
+    for tag, field in HEADER_TEXT_TAGS.items():
+        if header.get(tag):
+            entry[field] = header[tag]
+    for tag, field in HEADER_FILE_TAGS.items():
+        if header.get(tag) and field not in entry:
+            entry[field] = os.path.join(song_dir, header[tag])
+    if 'audio' not in entry:
+        entry['audio'] = os.path.splitext(txt_path)[0] + f'.{audio_format}'
+    year = _parse_number(header.get('YEAR'), int)
+    if year:
+        entry['year'] = year
+    preview = _parse_number(header.get('PREVIEWSTART'), float)
+    if preview is not None:
+        entry['previewstart'] = preview
+    entry['duet'] = bool(header.get('DUET'))
+    if entry.get('artist') and entry.get('title'):
+        entry['display'] = f"{entry['artist']} - {entry['title']}"
+    else:
+        entry['display'] = os.path.splitext(os.path.basename(txt_path))[0].replace('_', ' ')
+    return entry
+
+
+class HeaderParser:
+    """Parses song headers in a thread pool while files are still being found.
+
+    `submit()` may be called from any thread; `results()` waits for every
+    submitted file and returns {txt: header}. `stats.headers_total` and
+    `stats.headers_parsed` follow the progress.
+    """
+
+    def __init__(self, base_dir, workers=SCAN_WORKERS, stats=None):
+        self.base_dir = base_dir
+        self.stats = stats
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers),
+                                                           thread_name_prefix='song-headers')
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def submit(self, txt_path):
+        with self._lock:
+            if txt_path in self._futures:
+                return
+            future = self._pool.submit(parse_song_header, os.path.join(self.base_dir, txt_path))
+            self._futures[txt_path] = future
+            if self.stats is not None:
+                self.stats.headers_total += 1
+        if self.stats is not None:
+            future.add_done_callback(self._count)
+
+    def _count(self, _future):
+        with self._lock:
+            self.stats.headers_parsed += 1
+
+    def results(self):
+        results = {}
+        with self._lock:
+            futures = dict(self._futures)
+        for txt_path, future in futures.items():
+            try:
+                results[txt_path] = future.result()
+            except Exception:
+                logger.exception('Failed to parse song header %s', txt_path)
+        self._pool.shutdown()
+        return results
+
+
+def parse_headers(base_dir, txt_paths, workers=SCAN_WORKERS, stats=None):
+    """Parse the headers of `txt_paths` in a thread pool; returns {txt: header}."""
+    if not txt_paths:
+        return {}
+    parser = HeaderParser(base_dir, workers, stats)
+    for txt_path in txt_paths:
+        parser.submit(txt_path)
+    return parser.results()
+
+
+class ScanStats:
+    """Counters of one scan; readable from other threads while it runs.
+
+    scan_library moves `phase` through 'walking', 'parsing' and 'indexing';
+    callers set the phases that follow (e.g. publishing the catalog).
+    """
+
+    def __init__(self):
+        self.phase = 'walking'
+        self.headers_total = 0
+        self.headers_parsed = 0
+        self.dirs = 0
+        self.dirs_listed = 0
+        self.files = 0
+        self.walk_seconds = None
+        # .txt paths whose header was (re)parsed
+        self.parsed = set()
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+
+    @property
+    def modified(self):
+        """True if the scan added, changed or removed any song."""
+        return bool(self.added or self.changed or self.removed)
+
+    @property
+    def files_per_second(self):
+        """Song files found per second of directory walking."""
+        if not self.walk_seconds:
+            return None
+        return self.files / self.walk_seconds
+
+    def to_dict(self):
+        return {'phase': self.phase, 'dirs': self.dirs, 'dirs_listed': self.dirs_listed, 'files': self.files,
+                'files_per_second': self.files_per_second,
+                'headers_total': self.headers_total, 'headers_parsed': self.headers_parsed,
+                'added': self.added, 'changed': self.changed, 'removed': self.removed}
+
+
+def _walk_songs_tree(find_root, base_dir, old_dirs, old_files, full, stats, changed_dirs=None, on_changed=None,
+                     workers=WALK_WORKERS):
+    """Walk `find_root` and return (dirs, files) manifest sections.
+
+    Directories whose mtime matches the previous manifest are not listed
+    again; their children are taken from the manifest. Editing a song file
+    in place does not change its directory's mtime, so the known ``.txt``
+    files of unchanged directories are still stat'ed and compared with their
+    (inode, mtime, size) signature; that costs one stat per song, far less
+    than parsing. When `changed_dirs` is given (filesystem paths from a
+    watcher, which saw every change) only those directories are relisted and
+    stat'ed and the manifest is trusted for the rest.
+
+    Every directory is a task for a pool of `workers` threads, which hides
+    the round trip of network mounts. Symlinked directories are followed
+    (like ``find -L``) only after the tree without them has been walked, one
+    link at a time in sorted order: when a folder can be reached several
+    ways, the path indexed does not depend on thread timing, and (dev, inode)
+    pairs guard against loops. `on_changed(txt_label)` is called from the
+    worker threads for every new or changed song file as soon as it is found.
+    """
+    new_dirs = {}
+    new_files = {}
+    visited = set()
+    links = []
+    lock = threading.Lock()
+
+    def visit(label):
+        fs_path = os.path.join(base_dir, label)
+        try:
+            st = os.stat(fs_path)
+        except OSError:
+            return []
+        key = (st.st_dev, st.st_ino)
+        with lock:
+            if key in visited:
+                logger.debug('Skipping already visited directory %s', label)
+                return []
+            visited.add(key)
+            stats.dirs += 1
+
+        prev = old_dirs.get(label)
+        unchanged = (not full) and prev and prev.get('mtime') == st.st_mtime_ns
+        if unchanged and changed_dirs and fs_path in changed_dirs:
+            unchanged = False
+        if unchanged:
+            subdirs = list(prev.get('subdirs', []))
+            txts = list(prev.get('txts', []))
+            linked = prev.get('links')
+            if linked is None:
+                # manifests written before links were recorded
+                linked = [name for name in subdirs if os.path.islink(os.path.join(fs_path, name))]
+        else:
+            with lock:
+                stats.dirs_listed += 1
+            subdirs = []
+            txts = []
+            linked = []
+            try:
+                with os.scandir(fs_path) as it:
+                    for de in it:
+                        try:
+                            if de.is_dir():
+                                subdirs.append(de.name)
+                                if de.is_symlink():
+                                    linked.append(de.name)
+                            elif de.name.endswith('.txt') and de.is_file():
+                                txts.append(de.name)
+                        except OSError:
+                            continue
+            except OSError:
+                logger.warning('Cannot list directory %s', label)
+                return []
+            subdirs.sort()
+            txts.sort()
+            linked.sort()
+
+        new_dirs[label] = {'mtime': st.st_mtime_ns, 'subdirs': subdirs, 'txts': txts, 'links': linked}
+        songs = 0
+        for name in txts:
+            txt_label = os.path.join(label, name)
+            if not _is_song_txt(txt_label):
+                continue
+            prev_file = old_files.get(txt_label)
+            if unchanged and prev_file and changed_dirs is not None:
+                new_files[txt_label] = dict(prev_file)
+                songs += 1
+                continue
+            try:
+                fst = os.stat(os.path.join(base_dir, txt_label))
+            except OSError:
+                continue
+            songs += 1
+            sig = {'ino': fst.st_ino, 'mtime': fst.st_mtime_ns, 'size': fst.st_size}
+            if prev_file and all(prev_file.get(k) == v for k, v in sig.items()):
+                new_files[txt_label] = dict(prev_file)
+            else:
+                sig['changed'] = True
+                new_files[txt_label] = sig
+                if on_changed is not None:
+                    on_changed(txt_label)
+        linked_names = set(linked)
+        with lock:
+            stats.files += songs
+            links.extend(os.path.join(label, name) for name in linked)
+        return [os.path.join(label, name) for name in subdirs if name not in linked_names]
+
+    def walk(pool, root):
+        pending = {pool.submit(visit, root)}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                for child in future.result():
+                    pending.add(pool.submit(visit, child))
+
+    started = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='song-walk') as pool:
+        walk(pool, find_root)
+        while links:
+            batch = sorted(links)
+            links.clear()
+            for label in batch:
+                walk(pool, label)
+    stats.walk_seconds = time.time() - started
+    logger.info('Walked %d directories (%d listed) in %.2fs: %d song files (%.0f files/s)', stats.dirs,
+                stats.dirs_listed, stats.walk_seconds, stats.files, stats.files_per_second)
+    return new_dirs, new_files
+
+
+def scan_library(find_root, base_dir, data_dir, audio_format='m4a', full=False, changed_dirs=None, stats=None):
+    """Incrementally scan `find_root` and write the song index and manifest.
+
+    Returns the list of index entries. Entries for unchanged song files are
+    reused from the previous index; new files get fresh, never reused ids.
+    If no song was added, changed or removed, nothing is written.
+    `changed_dirs` is passed on to the directory walk; pass a ScanStats as
+    `stats` to learn what the scan found.
+    """
+    started = time.time()
+    os.makedirs(data_dir, exist_ok=True)
+    index_file = os.path.join(data_dir, INDEX_FILENAME)
+    manifest_file = os.path.join(data_dir, MANIFEST_FILENAME)
+
+    manifest = None if full else load_manifest(data_dir)
+    if manifest and manifest.get('root') != find_root:
+        logger.info('Song root changed (%s -> %s); running full scan', manifest.get('root'), find_root)
+        manifest = None
+    old_items = _load_json(index_file, [])
+    if not isinstance(old_items, list):
+        old_items = []
+    old_by_txt = {e.get('txt'): e for e in old_items if isinstance(e, dict) and e.get('txt')}
+
+    old_dirs = manifest['dirs'] if manifest else {}
+    old_files = manifest['files'] if manifest else {}
+    # Without a manifest, still keep the ids of an existing index stable
+    known_ids = {path: info.get('id') for path, info in old_files.items()}
+    if not known_ids:
+        known_ids = {txt: e.get('id') for txt, e in old_by_txt.items() if e.get('id') is not None}
+    next_id = 1
+    if manifest:
+        next_id = int(manifest.get('next_id', 1))
+    if known_ids:
+        next_id = max(next_id, max(int(i) for i in known_ids.values() if i is not None) + 1)
+
+    stats = stats if stats is not None else ScanStats()
+    # headers of new and changed files are parsed while the walk goes on
+    parser = HeaderParser(base_dir, stats=stats)
+    parse_started = time.time()
+    new_dirs, new_files = _walk_songs_tree(find_root, base_dir, old_dirs, old_files, full or not manifest, stats,
+                                           changed_dirs, on_changed=parser.submit)
+
+    # Entries written before headers were indexed lack 'audio'; re-parse those too
+    for txt_path in new_files:
+        if not (old_by_txt.get(txt_path) or {}).get('audio'):
+            parser.submit(txt_path)
+    stats.phase = 'parsing'
+    headers = parser.results()
+    stats.parsed = set(headers)
+    if headers:
+        logger.info('Parsed %d song headers in %.2fs', len(headers), time.time() - parse_started)
+
+    stats.phase = 'indexing'
+    entries = []
+    for txt_path in sorted(new_files):
+        info = new_files[txt_path]
+        changed = info.pop('changed', False)
+        song_id = known_ids.get(txt_path)
+        counted = True
+        if song_id is None:
+            song_id = next_id
+            next_id += 1
+            stats.added += 1
+        elif changed and txt_path in old_files:
+            stats.changed += 1
+        else:
+            counted = False
+        info['id'] = song_id
+        old_entry = old_by_txt.get(txt_path)
+        if txt_path not in headers and old_entry and old_entry.get('id') == song_id:
+            entry = dict(old_entry)
+            # playlist membership used to be stored in the index
+            entry.pop('upl', None)
+        else:
+            entry = build_entry(song_id, txt_path, audio_format, headers.get(txt_path))
+        if not counted and entry != old_entry:
+            # e.g. re-parsed for a missing 'audio' or migrated; the index changes
+            stats.changed += 1
+        entries.append(entry)
+    stats.files = len(entries)
+    stats.removed = len(set(old_files) - set(new_files))
+
+    paths_file = os.path.join(data_dir, PATHS_FILENAME)
+    if (manifest is not None and not stats.modified
+            and all(os.path.exists(p) for p in (index_file, manifest_file, paths_file))):
+        # Nothing to write. Directories whose mtime moved without a song
+        # change keep their old mtime in the manifest and are listed again
+        # by the next scan, which is cheaper than rewriting every file.
+        logger.info('Song scan finished in %.2fs: %d dirs (%d listed), %d songs, no changes',
+                    time.time() - started, stats.dirs, stats.dirs_listed, stats.files)
+        return entries
+
+    try:
+        with open(paths_file, 'w', encoding='utf-8') as fh:
+            for entry in entries:
+                fh.write(entry['txt'] + '\n')
+    except Exception:
+        logger.exception('Failed to write %s', PATHS_FILENAME)
+
+    try:
+        _write_json_atomic(index_file, entries, indent=2)
+        logger.info('Wrote song index %s (%d entries)', index_file, len(entries))
+    except Exception:
+        logger.exception('Failed to write song index %s', index_file)
+    try:
+        _write_json_atomic(manifest_file, {
+            'version': MANIFEST_VERSION,
+            'root': find_root,
+            'next_id': next_id,
+            'dirs': new_dirs,
+            'files': new_files,
+        })
+    except Exception:
+        logger.exception('Failed to write song manifest %s', manifest_file)
+
+    logger.info('Song scan finished in %.2fs: %d dirs (%d listed), %d songs (%d new, %d changed, %d removed)',
+                time.time() - started, stats.dirs, stats.dirs_listed, stats.files, stats.added, stats.changed, stats.removed)
+    return entries
+
+
+def normalize_path(path, base_dir):
+    if not path:
+        return None
+    candidate = path
+    if not os.path.isabs(candidate):
+        candidate = os.path.join(base_dir, candidate)
+    try:
+        return os.path.realpath(candidate)
+    except Exception:
+        return None
+
+
+def resolve_audio_paths(records, base_dir):
+    """Return the normalized path of every record's audio file, in order.
+
+    Equivalent to normalize_path() per record, but each song folder is
+    resolved once and realpath only runs on a file that is itself a symlink.
+    """
+    resolved_dirs = {}
+    result = []
+    for record in records:
+        audio = record.audio
+        if not audio:
+            result.append(None)
+            continue
+        candidate = audio if os.path.isabs(audio) else os.path.join(base_dir, audio)
+        head, tail = os.path.split(candidate)
+        if tail in ('', '.', '..') or os.path.islink(candidate):
+            result.append(normalize_path(candidate, base_dir))
+            continue
+        resolved = resolved_dirs.get(head)
+        if resolved is None:
+            resolved = resolved_dirs[head] = normalize_path(head, base_dir)
+        result.append(os.path.join(resolved, tail) if resolved else None)
+    return result
+
+
+def _path_hash(normalized_path):
+    # stable across processes (unlike hash()), so it can be persisted
+    digest = hashlib.blake2b(normalized_path.encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+AUDIO_FALLBACK_FORMATS = ('m4a', 'mp3', 'ogg', 'wav')
+
+
+def normalize_text(value):
+    """Casefold, strip accents and collapse whitespace for search matching."""
+    if not value:
+        return ''
+    text = str(value)
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.casefold().split())
+
+
+def entry_search_text(entry):
+    # The display name ("Artist - Title", the label the UI shows) always
+    # comes first, so everything the old `q in display` scan found still
+    # matches. Artist and title are only added when the display name does
+    # not contain them. Parts are joined with a newline, which normalized
+    # queries never contain, so a match cannot straddle two of them.
+    display = entry.get('display')
+    if not display and (entry.get('artist') or entry.get('title')):
+        display = f"{entry.get('artist') or ''} - {entry.get('title') or ''}"
+    parts = []
+    for value in (display, entry.get('artist'), entry.get('title')):
+        value = normalize_text(value)
+        if value and not any(value in part for part in parts):
+            parts.append(value)
+    return '\n'.join(parts)
+
+
+class TrigramIndex:
+    """Substring index over a list of normalized strings.
+
+    Every distinct trigram maps to a sorted posting list of row numbers.
+    A query intersects the posting lists of its trigrams (shortest first)
+    and verifies the surviving rows with a plain substring check, so results
+    are exactly those of ``q in text``. Queries shorter than three
+    characters fall back to scanning the pre-normalized strings.
+    """
+
+    VERIFY_THRESHOLD = 64
+
+    def __init__(self, texts):
+        self.texts = texts
+        postings = {}
+        for row, text in enumerate(texts):
+            for gram in {text[i:i + 3] for i in range(len(text) - 2)}:
+                try:
+                    postings[gram].append(row)
+                except KeyError:
+                    postings[gram] = [row]
+        self.postings = {gram: array('I', rows) for gram, rows in postings.items()}
+
+    @classmethod
+    def from_postings(cls, texts, postings):
+        """Wrap already built posting lists (anything with ``get(gram)``)."""
+        index = cls.__new__(cls)
+        index.texts = texts
+        index.postings = postings
+        return index
+
+    def __len__(self):
+        return len(self.texts)
+
+    def search(self, query):
+        """Return the sorted rows whose text contains normalized `query`."""
+        texts = self.texts
+        if not query:
+            return list(range(len(texts)))
+        if len(query) < 3:
+            return [row for row, text in enumerate(texts) if query in text]
+        lists = []
+        for gram in {query[i:i + 3] for i in range(len(query) - 2)}:
+            bucket = self.postings.get(gram)
+            if bucket is None:
+                return []
+            lists.append(bucket)
+        if len(lists) == 1 and len(query) == 3:
+            # the posting list of the query itself is the exact answer
+            return list(lists[0])
+        lists.sort(key=len)
+        candidates = set(lists[0])
+        for bucket in lists[1:]:
+            if len(candidates) <= self.VERIFY_THRESHOLD:
+                break
+            candidates.intersection_update(bucket)
+        return sorted(row for row in candidates if query in texts[row])
+
+
+TOKEN_SPLIT_REGEX = re.compile(r'[^\w]+')
+
+
+def entry_label(entry):
+    artist = entry.get('artist')
+    title = entry.get('title')
+    if artist and title:
+        return f'{artist} - {title}'
+    return entry.get('display') or title or artist or ''
+
+
+class SuggestIndex:
+    """Prefix lookup over the words of every song's artist and title.
+
+    All (word, row) pairs are kept in one sorted list so a prefix maps to a
+    contiguous range found with two bisections. Candidates are ranked by
+    whether the whole query is a prefix of the artist/label, of any field,
+    or only of individual words, then by word and label length. Every song
+    in the prefix range is ranked, so a short prefix still finds the best
+    match even when it sorts late; labels are only built for the winners.
+    """
+
+    def __init__(self, texts, label_of):
+        self.texts = texts
+        self.label_of = label_of
+        pairs = []
+        for row, text in enumerate(texts):
+            for word in {w for w in TOKEN_SPLIT_REGEX.split(text) if w}:
+                pairs.append((sys.intern(word), row))
+        pairs.sort()
+        self.words = [w for w, _ in pairs]
+        self.rows = array('I', (row for _, row in pairs))
+
+    @classmethod
+    def from_sorted(cls, texts, words, rows, label_of):
+        """Wrap an already sorted word list and its parallel row list."""
+        index = cls.__new__(cls)
+        index.texts = texts
+        index.label_of = label_of
+        index.words = words
+        index.rows = rows
+        return index
+
+    def suggest(self, query, limit=8):
+        """Return up to `limit` (row, label) pairs for normalized `query`."""
+        words = [w for w in TOKEN_SPLIT_REGEX.split(query) if w]
+        if not words:
+            return []
+        # The longest word narrows the range the most; the others only have
+        # to occur somewhere in the song's text.
+        prefix = max(words, key=len)
+        others = [w for w in words if w is not prefix]
+        lo = bisect.bisect_left(self.words, prefix)
+        hi = bisect.bisect_left(self.words, prefix + '\U0010ffff', lo)
+        texts = self.texts
+        # row -> length of its shortest matching word: pairs are fed longest
+        # first so the shortest one is stored last
+        lengths = dict(sorted(zip(self.rows[lo:hi], map(len, self.words[lo:hi])),
+                              key=operator.itemgetter(1), reverse=True))
+        rows = list(lengths)
+        row_texts = list(map(texts.__getitem__, rows))
+        for word in others:
+            keep = list(map(operator.contains, row_texts, itertools.repeat(word)))
+            rows = list(itertools.compress(rows, keep))
+            row_texts = list(itertools.compress(row_texts, keep))
+
+        def rank(row):
+            # the display name heads the search text and stands in for the label
+            head = texts[row].split('\n', 1)[0]
+            return (lengths[row], len(head), head, row)
+
+        # Tier by tier, best first; the tests run through map/compress because
+        # a one-letter prefix can cover much of the library. Later tiers are
+        # only looked at while the earlier ones leave room.
+        limit = max(1, limit)
+        best = []
+        tests = ((str.startswith, query), (operator.contains, '\n' + query), (operator.contains, query))
+        for test, needle in tests + ((None, None),):
+            if test is None:
+                hits = rows
+            else:
+                mask = list(map(test, row_texts, itertools.repeat(needle)))
+                hits = list(itertools.compress(rows, mask))
+                rest = list(map(operator.not_, mask))
+                rows = list(itertools.compress(rows, rest))
+                row_texts = list(itertools.compress(row_texts, rest))
+            room = limit - len(best)
+            if len(hits) > room:
+                # only the shortest words can make it; cut before building keys
+                cutoff = sorted(map(lengths.__getitem__, hits))[room - 1]
+                hits = list(itertools.compress(
+                    hits, map(operator.ge, itertools.repeat(cutoff), map(lengths.__getitem__, hits))))
+            best.extend(heapq.nsmallest(room, hits, key=rank))
+            if len(best) >= limit or not rows:
+                break
+        return [(row, self.label_of(row)) for row in best]
+
+
+def normalize_playlist_label(raw):
+    if not raw:
+        return None
+    label = str(raw).strip()
+    if not label:
+        return None
+    if ' : ' in label:
+        artist, title = label.split(':', 1)
+        return f"{artist.strip()} : {title.strip()}"
+    if ' - ' in label:
+        artist, title = label.split('-', 1)
+        artist = artist.strip()
+        title = title.strip()
+        if artist and title:
+            return f"{artist} : {title}"
+    return label
+
+
+def _split_under(path, song_dir):
+    """Return `path` relative to `song_dir` when it lies inside it."""
+    if not path:
+        return None
+    prefix = song_dir + os.sep if song_dir else ''
+    if prefix and path.startswith(prefix):
+        return path[len(prefix):]
+    if not prefix and not os.path.isabs(path):
+        return path
+    return path if os.path.isabs(path) else os.path.relpath(path, song_dir or '.')
+
+
+# NUL cannot occur in file names; a stored name starting with it means
+# "<txt stem><suffix>", so e.g. ".mp3" or " [CO].jpg" is shared by all songs.
+_STEM_MARK = '\0'
+
+
+def _compact_name(name, stem):
+    if name and stem and name.startswith(stem) and os.sep not in name:
+        return sys.intern(_STEM_MARK + name[len(stem):])
+    return name
+
+
+class SongRecord:
+    """One song of a SongCatalog.
+
+    Replaces the per-song index dict: attributes live in ``__slots__``, the
+    folder holding the songs is an interned string shared by all records,
+    the song's own folder and its audio/cover/video names are only stored
+    when they differ from the .txt file's stem, and repeated values such as
+    language and genre are interned. ``get()`` and ``to_dict()`` keep the
+    dict-style access used by the server and the JSON API.
+    """
+
+    __slots__ = ('id', 'parent', 'folder', 'stem', 'audio_name', 'cover_name', 'video_name', 'artist',
+                 'title', 'display_name', 'language', 'genre', 'year', 'previewstart', 'duet')
+
+    FIELDS = ('id', 'txt', 'audio', 'cover', 'video', 'artist', 'title', 'display', 'language', 'genre',
+              'year', 'previewstart', 'duet')
+
+    def __init__(self, entry, audio_format='m4a'):
+        txt = entry.get('txt') or ''
+        song_dir = os.path.dirname(txt)
+        parent, folder = os.path.split(song_dir)
+        stem = os.path.basename(txt)
+        if stem.endswith('.txt'):
+            stem = stem[:-4]
+        audio = entry.get('audio') or entry.get(audio_format)
+        if not audio:
+            audio = next((entry.get(f) for f in AUDIO_FALLBACK_FORMATS if entry.get(f)), None)
+        self.id = entry.get('id')
+        self.parent = sys.intern(parent)
+        self.folder = None if folder == stem else folder
+        self.stem = stem
+        self.audio_name = _compact_name(_split_under(audio, song_dir), stem)
+        self.cover_name = _compact_name(_split_under(entry.get('cover'), song_dir), stem)
+        self.video_name = _compact_name(_split_under(entry.get('video'), song_dir), stem)
+        self.artist = entry.get('artist')
+        self.title = entry.get('title')
+        display = entry.get('display')
+        # the common "Artist - Title" display name is derived, not stored
+        self.display_name = None if display == self._default_display() else display
+        self.language = sys.intern(entry['language']) if entry.get('language') else None
+        self.genre = sys.intern(entry['genre']) if entry.get('genre') else None
+        self.year = entry.get('year')
+        self.previewstart = entry.get('previewstart')
+        self.duet = bool(entry.get('duet'))
+
+    def _default_display(self):
+        if self.artist and self.title:
+            return f'{self.artist} - {self.title}'
+        return None
+
+    @property
+    def dir(self):
+        folder = self.stem if self.folder is None else self.folder
+        return os.path.join(self.parent, folder) if (self.parent or folder) else ''
+
+    def _path(self, name):
+        if not name:
+            return None
+        if name[0] == _STEM_MARK:
+            name = self.stem + name[1:]
+        song_dir = self.dir
+        return os.path.join(song_dir, name) if song_dir else name
+
+    @property
+    def txt(self):
+        return self._path(self.stem + '.txt')
+
+    @property
+    def audio(self):
+        return self._path(self.audio_name)
+
+    @property
+    def cover(self):
+        return self._path(self.cover_name)
+
+    @property
+    def video(self):
+        return self._path(self.video_name)
+
+    @property
+    def display(self):
+        if self.display_name:
+            return self.display_name
+        return self._default_display() or self.stem.replace('_', ' ')
+
+    @property
+    def playlist_label(self):
+        """Label as written to the .upl playlist ("Artist : Title")."""
+        artist = (self.artist or '').strip()
+        title = (self.title or '').strip()
+        if artist and title:
+            label = f'{artist} : {title}'
+        else:
+            label = artist or title or self.display
+        return normalize_playlist_label(label)
+
+    def get(self, key, default=None):
+        if key not in self.FIELDS:
+            return default
+        value = getattr(self, key)
+        return default if value is None else value
+
+    def to_dict(self):
+        result = {}
+        for key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                result[key] = value
+        return result
+
+
+# Fields the song list can be filtered by; 'decade' comes from #YEAR,
+# 'duet' and 'video' are 'yes' or 'no'
+FACETS = ('language', 'genre', 'decade', 'duet', 'video')
+_NONZERO_BYTE = re.compile(rb'[^\x00]')
+_BYTE_BITS = bytes(bin(i).count('1') for i in range(256))
+try:
+    popcount = int.bit_count
+except AttributeError:
+    # Python < 3.10
+    def popcount(value):
+        return bin(value).count('1')
+
+
+def record_facets(record):
+    """Return the (facet, value) pairs of a SongRecord."""
+    pairs = []
+    if record.language:
+        pairs.append(('language', record.language.strip()))
+    if record.genre:
+        pairs.append(('genre', record.genre.strip()))
+    if isinstance(record.year, int) and record.year > 0:
+        pairs.append(('decade', f'{record.year // 10 * 10}s'))
+    pairs.append(('duet', 'yes' if record.duet else 'no'))
+    pairs.append(('video', 'yes' if record.video_name else 'no'))
+    return pairs
+
+
+def rows_to_mask(rows):
+    """Return the bitmap (a Python int, bit n = row n) of `rows`."""
+    rows = list(rows)
+    if not rows:
+        return 0
+    bits = bytearray((max(rows) >> 3) + 1)
+    for row in rows:
+        bits[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def mask_rows(mask, start=0, stop=None):
+    """Return the rows of bitmap `mask` from the `start`th to before `stop`."""
+    rows = []
+    if mask <= 0 or (stop is not None and stop <= start):
+        return rows
+    data = mask.to_bytes((mask.bit_length() + 7) >> 3, 'little')
+    seen = 0
+    for match in _NONZERO_BYTE.finditer(data):
+        index = match.start()
+        byte = data[index]
+        if seen + _BYTE_BITS[byte] <= start:
+            seen += _BYTE_BITS[byte]
+            continue
+        for bit in range(8):
+            if byte >> bit & 1:
+                if seen >= start:
+                    rows.append(index * 8 + bit)
+                    if stop is not None and seen + 1 >= stop:
+                        return rows
+                seen += 1
+    return rows
+
+
+class FacetIndex:
+    """Row bitmaps per facet value, so filters are integer ANDs.
+
+    Bitmaps are Python ints (bit n = catalog row n): intersecting them and
+    counting their bits runs in C, which keeps filtering and facet counts of
+    a 100k song library in the low milliseconds.
+    """
+
+    def __init__(self, count, bitmaps):
+        self.count = count
+        self.all_rows = (1 << count) - 1
+        # facet -> {value: bitmap}
+        self.bitmaps = bitmaps
+
+    @classmethod
+    def build(cls, records):
+        bits = {}
+        count = 0
+        for row, record in enumerate(records):
+            count = row + 1
+            for facet, value in record_facets(record):
+                bits.setdefault((facet, value), []).append(row)
+        bitmaps = {facet: {} for facet in FACETS}
+        for (facet, value), rows in bits.items():
+            bitmaps[facet][value] = rows_to_mask(rows)
+        return cls(count, bitmaps)
+
+    def _facet_mask(self, facet, values):
+        found = self.bitmaps.get(facet, {})
+        mask = 0
+        for value in values:
+            mask |= found.get(value, 0)
+        return mask
+
+    def filter(self, filters, mask=None):
+        """AND `mask` (default: all rows) with every facet of `filters`.
+
+        `filters` maps a facet to the accepted values; a song matches a
+        facet if it has any of them.
+        """
+        mask = self.all_rows if mask is None else mask
+        for facet, values in filters.items():
+            if values:
+                mask &= self._facet_mask(facet, values)
+        return mask
+
+    def counts(self, mask, filters=None):
+        """Return {facet: {value: songs}} for the songs of `mask`.
+
+        Each facet is counted without its own filter (so the other values of
+        a filtered facet still show how many songs they would add), but with
+        the filters of all other facets.
+        """
+        filters = filters or {}
+        result = {}
+        for facet in FACETS:
+            base = self.filter({f: v for f, v in filters.items() if f != facet}, mask)
+            values = {}
+            for value, bitmap in self.bitmaps.get(facet, {}).items():
+                n = popcount(base & bitmap)
+                if n:
+                    values[value] = n
+            result[facet] = values
+        return result
+
+
+class SongCatalog:
+    """Resident snapshot of the song index and its lookup maps.
+
+    A catalog is built once (from a scan or from songs_index.json) and then
+    only read. Rescans build a new catalog and swap the reference, so readers
+    holding the old one are never affected by a half-built index.
+    `version` changes with every rebuilt catalog; `source_mtime_ns` records
+    the state of the index file it corresponds to.
+
+    Songs are stored as SongRecord objects in `entries`; ids map to rows
+    through a flat integer array and audio paths to rows through a dict.
+    """
+
+    def __init__(self, entries, version=0, source_mtime_ns=None, audio_format='m4a', base_dir='.',
+                 source_path=None):
+        self.version = version
+        self.source_mtime_ns = source_mtime_ns
+        self.source_path = source_path
+        self.audio_format = audio_format
+        self.entries = []
+        for entry in entries:
+            if isinstance(entry, SongRecord):
+                self.entries.append(entry)
+            elif isinstance(entry, dict):
+                self.entries.append(SongRecord(entry, audio_format))
+        self._build_id_map()
+        self.base_dir = base_dir
+        # resolved audio path -> row, computed once per catalog (not per lookup)
+        self.by_audio = {}
+        for row, normalized in enumerate(resolve_audio_paths(self.entries, base_dir)):
+            if normalized:
+                self.by_audio.setdefault(normalized, row)
+        texts = [entry_search_text(e) for e in self.entries]
+        self.text_index = TrigramIndex(texts)
+        self.suggest_index = SuggestIndex(texts, lambda row: entry_label(self.entries[row]))
+        self._facets = None
+        self._label_rows = {}
+
+    @property
+    def facets(self):
+        """FacetIndex of the catalog, built on first use."""
+        if self._facets is None:
+            self._facets = FacetIndex.build(self.entries)
+        return self._facets
+
+    def _build_id_map(self):
+        ids = [r.id for r in self.entries if isinstance(r.id, int) and r.id >= 0]
+        max_id = max(ids) if ids else 0
+        # ids are handed out densely by the scanner; fall back to a dict if not
+        if max_id <= 4 * len(self.entries) + 1024:
+            self._id_rows = array('i', [-1]) * (max_id + 1)
+            self._id_dict = None
+        else:
+            self._id_rows = None
+            self._id_dict = {}
+        for row, record in enumerate(self.entries):
+            if self._id_rows is not None and isinstance(record.id, int) and 0 <= record.id <= max_id:
+                self._id_rows[record.id] = row
+            elif self._id_dict is not None:
+                self._id_dict[str(record.id)] = row
+
+    def __len__(self):
+        return len(self.entries)
+
+    def row_of(self, song_id):
+        """Return the row of `song_id`, or None."""
+        if song_id is None:
+            return None
+        if self._id_dict is not None:
+            return self._id_dict.get(str(song_id))
+        try:
+            song_id = int(song_id)
+        except (TypeError, ValueError):
+            return None
+        if 0 <= song_id < len(self._id_rows):
+            row = self._id_rows[song_id]
+            if row >= 0:
+                return row
+        return None
+
+    def get(self, song_id):
+        row = self.row_of(song_id)
+        return None if row is None else self.entries[row]
+
+    def lookup_audio(self, normalized_path):
+        if not normalized_path:
+            return None
+        row = self.by_audio.get(normalized_path)
+        return None if row is None else self.entries[row]
+
+    def search(self, query):
+        """Return entries whose artist, title or display name contain `query`."""
+        rows = self.search_rows(query)
+        entries = self.entries
+        return [entries[row] for row in rows]
+
+    def search_rows(self, query):
+        """Return the sorted rows of the entries `search()` returns."""
+        return self.text_index.search(normalize_text(query))
+
+    def row_of_label(self, label):
+        """Return the row whose playlist label is `label`, or None.
+
+        Results (misses too) are remembered per catalog, so labels looked up
+        again and again, like the ones auto-fill samples from the play
+        history, cost a dict lookup after the first search.
+        """
+        label = normalize_playlist_label(label)
+        if not label:
+            return None
+        try:
+            return self._label_rows[label]
+        except KeyError:
+            pass
+        found = None
+        # narrow down through the text index instead of scanning every entry
+        title = label.split(' : ', 1)[-1]
+        entries = self.entries
+        for row in self.search_rows(title) or self.search_rows(label):
+            if entries[row].playlist_label == label:
+                found = row
+                break
+        self._label_rows[label] = found
+        return found
+
+    def find_by_label(self, label):
+        """Return the entry whose playlist label is `label`, or None."""
+        row = self.row_of_label(label)
+        return None if row is None else self.entries[row]
+
+    def suggest(self, query, limit=8):
+        """Return up to `limit` (id, label) pairs completing `query`."""
+        pairs = self.suggest_index.suggest(normalize_text(query), limit)
+        entries = self.entries
+        return [(entries[row].id, label) for row, label in pairs]
+
+    @classmethod
+    def load(cls, index_file, audio_format='m4a', base_dir='.'):
+        """Load a catalog from `index_file`; returns None if it cannot be read."""
+        try:
+            st = os.stat(index_file)
+            with open(index_file, 'r', encoding='utf-8') as fh:
+                items = json.load(fh)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.exception('Failed to load song index %s', index_file)
+            return None
+        if not isinstance(items, list):
+            logger.error('Song index %s is not a list; ignoring', index_file)
+            return None
+        return cls(items, version=st.st_mtime_ns, source_mtime_ns=st.st_mtime_ns,
+                   audio_format=audio_format, base_dir=base_dir, source_path=index_file)
+
+
+BINARY_INDEX_FILENAME = 'songs_index.bin'
+BINARY_MAGIC = b'SMIX'
+BINARY_FORMAT_VERSION = 4
+
+# Layout of songs_index.bin (little endian, every section 8-byte aligned):
+#   header      magic, format version, catalog version, song count and an
+#               (offset, size) pair per section below
+#   heap        UTF-8 bytes of every distinct string, referenced as
+#               (offset, length) uint32 pairs; offset 0xffffffff means None
+#   records     one fixed-width _RECORD_STRUCT per song, in catalog row order
+#   texts       search text of every row (string refs)
+#   gram_*      sorted trigram keys (string refs) with the start and length of
+#               their rows in `postings` (uint32)
+#   word_*      SuggestIndex word list (string refs) and its parallel rows
+#   id_rows     song id -> row (int32, -1 for unused ids)
+#   audio_*     sorted 64-bit hashes of the resolved audio paths, their rows
+#               and the paths themselves (string refs), resolved at scan time
+#   facet_keys  'facet:value' of every FacetIndex bitmap (string refs)
+#   facet_bits  those bitmaps, ceil(songs / 8) little-endian bytes each
+# Everything is read in place through a memory map, so opening the index and
+# answering the first query cost the same for ten songs as for a million.
+_NO_STRING = 0xFFFFFFFF
+_NO_YEAR = -2 ** 31
+_FLAG_DUET = 1
+_RECORD_STRINGS = ('parent', 'folder', 'stem', 'audio_name', 'cover_name', 'video_name', 'artist', 'title',
+                   'display_name', 'language', 'genre')
+_INTERNED_STRINGS = ('parent', 'language', 'genre')
+_RECORD_STRUCT = struct.Struct('<i%dIidB' % (2 * len(_RECORD_STRINGS)))
+_SECTIONS = (('heap', 'B'), ('records', 'B'), ('texts', 'I'), ('gram_keys', 'I'), ('gram_starts', 'I'),
+             ('gram_counts', 'I'), ('postings', 'I'), ('word_keys', 'I'), ('word_rows', 'I'),
+             ('id_rows', 'i'), ('audio_hashes', 'Q'), ('audio_rows', 'I'), ('audio_paths', 'I'),
+             ('facet_keys', 'I'), ('facet_bits', 'B'))
+_HEADER_STRUCT = struct.Struct('<4sIqQ' + 'QQ' * len(_SECTIONS))
+
+
+def write_binary_catalog(catalog, path):
+    """Write `catalog` to `path` in the memory-mappable binary format.
+
+    Returns False when the catalog cannot be represented (non-integer or
+    sparse song ids, big-endian host); songs_index.json stays authoritative
+    in that case.
+    """
+    if sys.byteorder != 'little' or catalog._id_rows is None:
+        return False
+    heap = bytearray()
+    refs = {}
+
+    def ref(value):
+        if value is None:
+            return _NO_STRING, 0
+        found = refs.get(value)
+        if found is None:
+            data = value.encode('utf-8', 'surrogateescape')
+            found = refs[value] = (len(heap), len(data))
+            heap.extend(data)
+        return found
+
+    def ref_array(values):
+        result = array('I')
+        for value in values:
+            result.extend(ref(value))
+        return result
+
+    records = bytearray(_RECORD_STRUCT.size * len(catalog.entries))
+    for row, record in enumerate(catalog.entries):
+        if not isinstance(record.id, int):
+            return False
+        strings = []
+        for name in _RECORD_STRINGS:
+            strings.extend(ref(getattr(record, name)))
+        year = record.year if isinstance(record.year, int) else _NO_YEAR
+        previewstart = record.previewstart if isinstance(record.previewstart, (int, float)) else math.nan
+        flags = _FLAG_DUET if record.duet else 0
+        try:
+            _RECORD_STRUCT.pack_into(records, row * _RECORD_STRUCT.size, record.id, *strings,
+                                     year, previewstart, flags)
+        except struct.error:
+            return False
+
+    texts = ref_array(catalog.text_index.texts)
+    postings = catalog.text_index.postings
+    grams = sorted(postings)
+    gram_starts = array('I')
+    gram_counts = array('I')
+    all_postings = array('I')
+    for gram in grams:
+        gram_starts.append(len(all_postings))
+        gram_counts.append(len(postings[gram]))
+        all_postings.extend(postings[gram])
+    audio = sorted((_path_hash(path), row, path) for path, row in catalog.by_audio.items())
+    facet_keys = []
+    facet_bits = bytearray()
+    bitmap_size = (len(catalog.entries) + 7) // 8
+    for facet, values in catalog.facets.bitmaps.items():
+        for value, bitmap in sorted(values.items()):
+            facet_keys.append(f'{facet}:{value}')
+            facet_bits.extend(bitmap.to_bytes(bitmap_size, 'little'))
+    sections = (heap, records, texts, ref_array(grams), gram_starts, gram_counts, all_postings,
+                ref_array(catalog.suggest_index.words), catalog.suggest_index.rows, catalog._id_rows,
+                array('Q', (h for h, _, _ in audio)), array('I', (row for _, row, _ in audio)),
+                ref_array(path for _, _, path in audio), ref_array(facet_keys), facet_bits)
+
+    with _atomic_output(path) as fh:
+        fh.write(bytes(_HEADER_STRUCT.size))
+        layout = []
+        for data in sections:
+            fh.write(bytes(-fh.tell() % 8))
+            view = memoryview(data)
+            layout.extend((fh.tell(), view.nbytes))
+            fh.write(view)
+        fh.seek(0)
+        fh.write(_HEADER_STRUCT.pack(BINARY_MAGIC, BINARY_FORMAT_VERSION, catalog.version or 0,
+                                     len(catalog.entries), *layout))
+    return True
+
+
+def _heap_string(heap, offset, length):
+    if offset == _NO_STRING:
+        return None
+    return str(heap[offset:offset + length], 'utf-8', 'surrogateescape')
+
+
+class _HeapStrings:
+    """Read-only sequence of heap strings; bisect works on it directly."""
+
+    __slots__ = ('heap', 'refs')
+
+    def __init__(self, heap, refs):
+        self.heap = heap
+        self.refs = refs
+
+    def __len__(self):
+        return len(self.refs) >> 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if not 0 <= index < len(self.refs) >> 1:
+            raise IndexError(index)
+        return _heap_string(self.heap, self.refs[2 * index], self.refs[2 * index + 1])
+
+
+class _MappedPostings:
+    """``dict.get``-compatible view of the persisted trigram posting lists."""
+
+    __slots__ = ('keys', 'starts', 'counts', 'postings')
+
+    def __init__(self, keys, starts, counts, postings):
+        self.keys = keys
+        self.starts = starts
+        self.counts = counts
+        self.postings = postings
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, gram, default=None):
+        pos = bisect.bisect_left(self.keys, gram)
+        if pos < len(self.keys) and self.keys[pos] == gram:
+            start = self.starts[pos]
+            return self.postings[start:start + self.counts[pos]]
+        return default
+
+
+class _MappedRecords:
+    """Sequence of SongRecords decoded from the record table on access.
+
+    Records are not cached, so a mapped catalog only keeps the songs that are
+    currently in use in memory.
+    """
+
+    def __init__(self, heap, records, count):
+        self.heap = heap
+        self.records = records
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for row in range(self.count):
+            yield self._decode(row)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._decode(row) for row in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self._decode(index)
+
+    def _decode(self, row):
+        values = _RECORD_STRUCT.unpack_from(self.records, row * _RECORD_STRUCT.size)
+        record = SongRecord.__new__(SongRecord)
+        record.id = values[0]
+        heap = self.heap
+        for i, name in enumerate(_RECORD_STRINGS):
+            setattr(record, name, _heap_string(heap, values[1 + 2 * i], values[2 + 2 * i]))
+        for name in _INTERNED_STRINGS:
+            value = getattr(record, name)
+            if value is not None:
+                setattr(record, name, sys.intern(value))
+        year, previewstart, flags = values[-3:]
+        record.year = None if year == _NO_YEAR else year
+        record.previewstart = None if math.isnan(previewstart) else previewstart
+        record.duet = bool(flags & _FLAG_DUET)
+        return record
+
+
+class MappedSongCatalog(SongCatalog):
+    """SongCatalog served from a memory-mapped songs_index.bin.
+
+    Opening only parses the fixed-size header; records, search texts and the
+    trigram/suggest indexes are read from the mapping when a query touches
+    them, so neither startup time nor resident memory grow with the library.
+    """
+
+    def __init__(self, path, audio_format='m4a', base_dir='.'):
+        with open(path, 'rb') as fh:
+            st = os.fstat(fh.fileno())
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        header = _HEADER_STRUCT.unpack_from(self._map, 0)
+        magic, fmt, version, count = header[:4]
+        if magic != BINARY_MAGIC or fmt != BINARY_FORMAT_VERSION:
+            raise ValueError(f'{path} is not a version {BINARY_FORMAT_VERSION} song index')
+        view = memoryview(self._map)
+        sections = {}
+        for i, (name, typecode) in enumerate(_SECTIONS):
+            offset, size = header[4 + 2 * i], header[5 + 2 * i]
+            if offset + size > len(view):
+                raise ValueError(f'{path} is truncated')
+            sections[name] = view[offset:offset + size].cast(typecode)
+        heap = sections['heap']
+        self.version = version
+        self.source_mtime_ns = st.st_mtime_ns
+        self.source_path = path
+        self.audio_format = audio_format
+        self.base_dir = base_dir
+        self.entries = _MappedRecords(heap, sections['records'], count)
+        self._id_rows = sections['id_rows']
+        self._id_dict = None
+        self._audio_hashes = sections['audio_hashes']
+        self._audio_rows = sections['audio_rows']
+        self._audio_paths = _HeapStrings(heap, sections['audio_paths'])
+        self._facet_keys = _HeapStrings(heap, sections['facet_keys'])
+        self._facet_bits = sections['facet_bits']
+        self._facets = None
+        self._label_rows = {}
+        texts = _HeapStrings(heap, sections['texts'])
+        self.text_index = TrigramIndex.from_postings(texts, _MappedPostings(
+            _HeapStrings(heap, sections['gram_keys']), sections['gram_starts'], sections['gram_counts'],
+            sections['postings']))
+        self.suggest_index = SuggestIndex.from_sorted(
+            texts, _HeapStrings(heap, sections['word_keys']), sections['word_rows'],
+            lambda row: entry_label(self.entries[row]))
+
+    @property
+    def facets(self):
+        # the bitmaps are read from the file, no record is decoded
+        if self._facets is None:
+            size = (len(self.entries) + 7) // 8
+            bitmaps = {facet: {} for facet in FACETS}
+            for i in range(len(self._facet_keys)):
+                facet, _, value = self._facet_keys[i].partition(':')
+                bitmaps.setdefault(facet, {})[value] = int.from_bytes(
+                    self._facet_bits[i * size:(i + 1) * size], 'little')
+            self._facets = FacetIndex(len(self.entries), bitmaps)
+        return self._facets
+
+    def lookup_audio(self, normalized_path):
+        if not normalized_path:
+            return None
+        key = _path_hash(normalized_path)
+        hashes = self._audio_hashes
+        pos = bisect.bisect_left(hashes, key)
+        while pos < len(hashes) and hashes[pos] == key:
+            if self._audio_paths[pos] == normalized_path:
+                return self.entries[self._audio_rows[pos]]
+            pos += 1
+        return None
+
+    @classmethod
+    def open(cls, path, audio_format='m4a', base_dir='.'):
+        """Map `path`; returns None if it is missing or not a usable index."""
+        try:
+            return cls(path, audio_format=audio_format, base_dir=base_dir)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            # older format or damaged file; the caller rebuilds it from JSON
+            logger.warning('Ignoring binary song index: %s', e)
+            return None
+        except Exception:
+            logger.exception('Failed to open binary song index %s', path)
+            return None
+
+
+def catalog_source_path(data_dir):
+    """Return the index file the resident catalog should be loaded from."""
+    binary = os.path.join(data_dir, BINARY_INDEX_FILENAME)
+    return binary if os.path.exists(binary) else os.path.join(data_dir, INDEX_FILENAME)
+
+
+def publish_catalog(catalog, data_dir):
+    """Persist `catalog` as songs_index.bin and return the mapped catalog.
+
+    Falls back to `catalog` itself (and removes a stale binary index, which
+    would otherwise shadow songs_index.json) if it cannot be written.
+    """
+    path = os.path.join(data_dir, BINARY_INDEX_FILENAME)
+    try:
+        os.makedirs(data_dir, exist_ok=True)
+        written = write_binary_catalog(catalog, path)
+    except Exception:
+        logger.exception('Failed to write binary song index %s', path)
+        written = False
+    if written:
+        mapped = MappedSongCatalog.open(path, audio_format=catalog.audio_format, base_dir=catalog.base_dir)
+        if mapped is not None:
+            return mapped
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        logger.exception('Failed to remove stale binary song index %s', path)
+    return catalog
+
+
+def load_catalog(data_dir, audio_format='m4a', base_dir='.'):
+    """Open the song catalog stored in `data_dir`.
+
+    songs_index.bin is mapped when present. Otherwise songs_index.json is
+    read and converted once, so the next start can map the binary index.
+    Returns None if neither can be read.
+    """
+    binary = os.path.join(data_dir, BINARY_INDEX_FILENAME)
+    catalog = MappedSongCatalog.open(binary, audio_format=audio_format, base_dir=base_dir)
+    if catalog is not None:
+        return catalog
+    catalog = SongCatalog.load(os.path.join(data_dir, INDEX_FILENAME), audio_format=audio_format,
+                               base_dir=base_dir)
+    if catalog is None:
+        return None
+    return publish_catalog(catalog, data_dir)
+
+
+LYRICS_INDEX_FILENAME = 'lyrics_index.bin'
+LYRICS_MAGIC = b'SMLY'
+LYRICS_FORMAT_VERSION = 2
+# Phrase searches stop after this many songs
+LYRICS_MAX_RESULTS = 200
+# Phrases whose rarest word occurs more often than this are found by
+# searching the token bytes (C speed) instead of checking every posting
+LYRICS_SCAN_THRESHOLD = 20000
+
+# Layout of lyrics_index.bin (little endian, sections 8-byte aligned). It is
+# kept apart from songs_index.bin so the catalog opens without it:
+#   header       magic, format version, index version, song and word count
+#                and an (offset, size) pair per section below
+#   heap         UTF-8 bytes of the words and .txt paths ((offset, length)
+#                refs as in songs_index.bin)
+#   words        vocabulary (string refs) by word number; numbers are kept
+#                across updates, new words get the next ones
+#   sorted_words the vocabulary in sorted order and sorted_numbers the
+#                number of each, for looking words up by bisection
+#   word_starts  start of each word's postings; word_counts their length
+#   postings     global token positions of every word, ascending
+#   song_ids     song id per lyrics row; song_txts its .txt (string refs)
+#   song_starts  first token of each row, plus the total token count
+#   tokens       word numbers of all songs' lyrics, row after row; duet parts
+#                of a song are separated by LYRICS_PART_BREAK
+_LYRICS_SECTIONS = (('heap', 'B'), ('words', 'I'), ('sorted_words', 'I'), ('sorted_numbers', 'I'),
+                    ('word_starts', 'I'), ('word_counts', 'I'),
+                    ('postings', 'I'), ('song_ids', 'i'), ('song_txts', 'I'), ('song_starts', 'I'),
+                    ('tokens', 'I'))
+_LYRICS_HEADER_STRUCT = struct.Struct('<4sIqII' + 'QQ' * len(_LYRICS_SECTIONS))
+# token between two duet parts; no word has this number, so phrases and
+# snippets stop there as they stop at the end of a song
+LYRICS_PART_BREAK = 0xFFFFFFFF
+_NOTE_LINE = re.compile(r'[:*FRG]\s*-?\d+\s+-?\d+\s+-?\d+\s(.*)')
+_WORD = re.compile(r'\w+')
+
+
+def extract_lyrics(text):
+    """Return the lyrics of the UltraStar song `text`, one string per part.
+
+    The syllables of the note lines (':', '*', 'F', 'R', 'G') are joined;
+    they carry their own spaces, so words sung over several notes join up
+    again. Line breaks ('-') separate words; each duet part ('P1', 'P2')
+    starts a new string. A song without parts gives a single string.
+    """
+    parts = []
+    syllables = []
+    for line in text.splitlines():
+        kind = line[:1]
+        if not kind or kind == '#':
+            continue
+        if kind == 'E':
+            break
+        if kind == 'P':
+            if syllables:
+                parts.append(''.join(syllables))
+                syllables = []
+            continue
+        if kind == '-':
+            syllables.append(' ')
+            continue
+        match = _NOTE_LINE.match(line)
+        if match:
+            # '~' marks a held syllable
+            syllables.append(match.group(1).replace('~', ''))
+    if syllables or not parts:
+        parts.append(''.join(syllables))
+    return parts
+
+
+def lyric_words(text):
+    """Split `text` into the normalized words the lyrics index stores."""
+    return _WORD.findall(normalize_text(text))
+
+
+def parse_song_lyrics(fs_path):
+    """Return the lyric words of an UltraStar .txt file ([] if unreadable).
+
+    None stands between the words of two duet parts.
+    """
+    try:
+        with open(fs_path, 'rb') as fh:
+            text = _decode_song_text(fh.read())
+    except OSError:
+        return []
+    words = []
+    for part in extract_lyrics(text):
+        part_words = lyric_words(part)
+        if part_words:
+            if words:
+                words.append(None)
+            words.extend(part_words)
+    return words
+
+
+def build_lyrics_index(entries, base_dir, path, changed=None, workers=SCAN_WORKERS, parse=None):
+    """Write the lyrics index of `entries` to `path`.
+
+    Songs whose id and .txt are unchanged and not in `changed` (the .txt
+    paths a scan re-parsed) reuse their words from the existing index; only
+    the others are read, with `parse(fs_path)` (parse_song_lyrics unless
+    given). Pass changed=None to read every song. Returns False if the index
+    already matched `entries` and was left alone.
+    """
+    if sys.byteorder != 'little':
+        return False
+    started = time.time()
+    old = LyricsIndex.open(path) if changed is not None else None
+    old_rows = {}
+    if old is not None:
+        for row in range(len(old)):
+            old_rows[(old.song_ids[row], old.song_txts[row])] = row
+    songs = [(e.get('id'), e.get('txt')) for e in entries
+             if isinstance(e.get('id'), int) and e.get('txt')]
+    if old is not None and not changed and set(old_rows) == set(songs):
+        return False
+
+    # word numbers stay the same, so reused songs are copied as they are
+    vocab = {word: number for number, word in enumerate(old.words)} if old is not None else {}
+    rows = [None] * len(songs)
+    to_read = []
+    for i, key in enumerate(songs):
+        row = old_rows.get(key) if old is not None and key[1] not in (changed or ()) else None
+        if row is None:
+            to_read.append(i)
+        else:
+            rows[i] = old.tokens[old.song_starts[row]:old.song_starts[row + 1]]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        paths = [os.path.join(base_dir, songs[i][1]) for i in to_read]
+        for i, words in zip(to_read, pool.map(parse or parse_song_lyrics, paths)):
+            rows[i] = array('I', [LYRICS_PART_BREAK if word is None else vocab.setdefault(word, len(vocab))
+                                  for word in words])
+    words = list(vocab)
+    order = array('I', sorted(range(len(words)), key=words.__getitem__))
+    tokens = array('I')
+    song_starts = array('I')
+    for row in rows:
+        song_starts.append(len(tokens))
+        tokens.frombytes(memoryview(row).cast('B'))
+    song_starts.append(len(tokens))
+
+    # counting sort: postings of each word come out in ascending position
+    counts = array('I', bytes(4 * len(words)))
+    for t in tokens:
+        if t != LYRICS_PART_BREAK:
+            counts[t] += 1
+    starts = array('I', bytes(4 * len(words)))
+    total = 0
+    for i, count in enumerate(counts):
+        starts[i] = total
+        total += count
+    fill = array('I', starts)
+    postings = array('I', bytes(4 * total))
+    for pos, t in enumerate(tokens):
+        if t != LYRICS_PART_BREAK:
+            postings[fill[t]] = pos
+            fill[t] += 1
+
+    heap = bytearray()
+
+    def ref_array(values):
+        result = array('I')
+        for value in values:
+            data = value.encode('utf-8', 'surrogateescape')
+            result.extend((len(heap), len(data)))
+            heap.extend(data)
+        return result
+
+    word_refs = ref_array(words)
+    sorted_refs = array('I')
+    for number in order:
+        sorted_refs.extend(word_refs[2 * number:2 * number + 2])
+    txt_refs = ref_array(txt for _, txt in songs)
+    sections = (heap, word_refs, sorted_refs, order, starts, counts, postings, array('i', (song_id for song_id, _ in songs)),
+                txt_refs, song_starts, tokens)
+    with _atomic_output(path) as fh:
+        fh.write(bytes(_LYRICS_HEADER_STRUCT.size))
+        layout = []
+        for data in sections:
+            fh.write(bytes(-fh.tell() % 8))
+            view = memoryview(data)
+            layout.extend((fh.tell(), view.nbytes))
+            fh.write(view)
+        fh.seek(0)
+        fh.write(_LYRICS_HEADER_STRUCT.pack(LYRICS_MAGIC, LYRICS_FORMAT_VERSION, time.time_ns(), len(songs),
+                                            len(words), *layout))
+    logger.info('Wrote lyrics index %s in %.2fs: %d songs (%d read), %d words, %d distinct', path,
+                time.time() - started, len(songs), len(to_read), len(tokens), len(words))
+    return True
+
+
+class LyricsIndex:
+    """Memory-mapped lyrics_index.bin answering word and phrase queries."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as fh:
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        header = _LYRICS_HEADER_STRUCT.unpack_from(self._map, 0)
+        magic, fmt, version, count, word_count = header[:5]
+        if magic != LYRICS_MAGIC or fmt != LYRICS_FORMAT_VERSION:
+            raise ValueError(f'{path} is not a version {LYRICS_FORMAT_VERSION} lyrics index')
+        view = memoryview(self._map)
+        sections = {}
+        for i, (name, typecode) in enumerate(_LYRICS_SECTIONS):
+            offset, size = header[5 + 2 * i], header[6 + 2 * i]
+            if offset + size > len(view):
+                raise ValueError(f'{path} is truncated')
+            sections[name] = view[offset:offset + size].cast(typecode)
+        heap = sections['heap']
+        self.path = path
+        self.version = version
+        self.count = count
+        self.words = _HeapStrings(heap, sections['words'])
+        self.sorted_words = _HeapStrings(heap, sections['sorted_words'])
+        self.sorted_numbers = sections['sorted_numbers']
+        self.word_starts = sections['word_starts']
+        self.word_counts = sections['word_counts']
+        self.postings = sections['postings']
+        self.song_ids = sections['song_ids']
+        self.song_txts = _HeapStrings(heap, sections['song_txts'])
+        self.song_starts = sections['song_starts']
+        self.tokens = sections['tokens']
+        self._tokens_span = header[5 + 2 * (len(_LYRICS_SECTIONS) - 1)], header[6 + 2 * (len(_LYRICS_SECTIONS) - 1)]
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def open(cls, path):
+        """Map `path`; returns None if it is missing or not a usable index."""
+        try:
+            return cls(path)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.warning('Ignoring lyrics index: %s', e)
+            return None
+        except Exception:
+            logger.exception('Failed to open lyrics index %s', path)
+            return None
+
+    def _word_number(self, word):
+        pos = bisect.bisect_left(self.sorted_words, word)
+        if pos < len(self.sorted_words) and self.sorted_words[pos] == word:
+            return self.sorted_numbers[pos]
+        return None
+
+    def search(self, query, limit=LYRICS_MAX_RESULTS):
+        """Return (song id, position) of up to `limit` songs singing `query`.
+
+        The words of `query` must follow each other in the lyrics; position
+        is the first token of the earliest match (see `snippet()`). Postings
+        of the rarest query word are checked against the token sequence, so
+        the cost follows that word's frequency, not the library size; if
+        even the rarest word is very common, the token sequence is searched
+        for the phrase's bytes instead.
+        """
+        numbers = []
+        for word in lyric_words(query):
+            number = self._word_number(word)
+            if number is None:
+                return []
+            numbers.append(number)
+        if not numbers:
+            return []
+        k = min(range(len(numbers)), key=lambda i: self.word_counts[numbers[i]])
+        if len(numbers) > 1 and self.word_counts[numbers[k]] > LYRICS_SCAN_THRESHOLD:
+            return self._scan_phrase(numbers, limit)
+        start = self.word_starts[numbers[k]]
+        postings = self.postings[start:start + self.word_counts[numbers[k]]]
+        tokens = self.tokens
+        song_starts = self.song_starts
+        n = len(numbers)
+        results = []
+        i = 0
+        while i < len(postings) and len(results) < limit:
+            pos = postings[i] - k
+            row = bisect.bisect_right(song_starts, max(pos, 0)) - 1
+            if pos < song_starts[row] or pos + n > song_starts[row + 1] or (
+                    n > 1 and tokens[pos:pos + n].tolist() != numbers):
+                i += 1
+                continue
+            results.append((self.song_ids[row], pos))
+            # skip the song's other occurrences
+            i = bisect.bisect_left(postings, song_starts[row + 1] + k, i + 1)
+        return results
+
+    def _scan_phrase(self, numbers, limit):
+        begin, size = self._tokens_span
+        end = begin + size
+        needle = struct.pack('<%dI' % len(numbers), *numbers)
+        song_starts = self.song_starts
+        results = []
+        found = self._map.find(needle, begin, end)
+        while found != -1 and len(results) < limit:
+            if (found - begin) % 4:
+                found = self._map.find(needle, found + 1, end)
+                continue
+            pos = (found - begin) // 4
+            row = bisect.bisect_right(song_starts, pos) - 1
+            if pos + len(numbers) > song_starts[row + 1]:
+                # runs into the next song
+                found = self._map.find(needle, found + 4, end)
+                continue
+            results.append((self.song_ids[row], pos))
+            found = self._map.find(needle, begin + 4 * song_starts[row + 1], end)
+        return results
+
+    def snippet(self, position, length, before=4, after=6):
+        """Return the words around a match as text, e.g. '… i love you …'.
+
+        The snippet stays within the song and its duet part.
+        """
+        row = bisect.bisect_right(self.song_starts, position) - 1
+        start, end = self.song_starts[row], self.song_starts[row + 1]
+        first = max(start, position - before)
+        tokens = self.tokens[first:min(end, position + length + after)].tolist()
+        lo, hi = position - first, position + length - first
+        while lo > 0 and tokens[lo - 1] != LYRICS_PART_BREAK:
+            lo -= 1
+        while hi < len(tokens) and tokens[hi] != LYRICS_PART_BREAK:
+            hi += 1
+        lo, hi = first + lo, first + hi
+        words = [self.words[t] for t in self.tokens[lo:hi]]
+        prefix = '… ' if lo > start and self.tokens[lo - 1] != LYRICS_PART_BREAK else ''
+        suffix = ' …' if hi < end and self.tokens[hi] != LYRICS_PART_BREAK else ''
+        return prefix + ' '.join(words) + suffix
@@ -27,6 +27,19 @@ function printLog(msg) {
     }
     console.log(msg);
 }
+
+// Apply several playlist edits in one request (see /playlist/batch). With
+// `version` the server refuses the batch if the playlist changed meanwhile.
+function postPlaylistBatch(ops, version) {
+    const body = {ops: ops};
+    if (version !== undefined && version !== null) body.version = version;
+    return fetch('/playlist/batch', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify(body),
+        credentials: 'include'
+    }).then(r => r.json());
+}
 // Tab switching logic
 document.addEventListener('DOMContentLoaded', function() {
     // Request fullscreen helper (tries standard API and vendor-prefixed variants)
@@ -139,6 +152,18 @@ document.addEventListener('DOMContentLoaded', function() {
     const songClearBtn = document.getElementById('songClearBtn');
     const songResults = document.getElementById('songResults');
     const songPreview = document.getElementById('songPreview');
+    const songSuggestions = document.getElementById('songSuggestions');
+    const songLyricsToggle = document.getElementById('songLyricsToggle');
+    const songFacets = document.getElementById('songFacets');
+    const songSelectionBar = document.getElementById('songSelectionBar');
+    const songSelectionCount = document.getElementById('songSelectionCount');
+    const songSelectionAdd = document.getElementById('songSelectionAdd');
+    const songSelectionRemove = document.getElementById('songSelectionRemove');
+    const songSelectionClear = document.getElementById('songSelectionClear');
+    // Multi-select: song id -> result item, kept across searches
+    const selectedSongs = new Map();
+    // Rendered rows by song id, to update their Add/Remove buttons after a batch
+    let songRowControls = new Map();
     // Shared audio player state so only one preview plays at a time
     let currentAudio = null;
     let currentPlayingId = null;
@@ -176,10 +201,58 @@ document.addEventListener('DOMContentLoaded', function() {
         currentPlayingId = null;
     }
 
-    function renderResults(items) {
-        songResults.innerHTML = '';
+    function renderSelectionBar() {
+        if (!songSelectionBar) return;
+        songSelectionBar.style.display = selectedSongs.size ? 'flex' : 'none';
+        if (songSelectionCount) songSelectionCount.textContent = selectedSongs.size + ' selected';
+    }
+
+    function applySelection(action) {
+        const ids = Array.from(selectedSongs.keys());
+        if (!ids.length) return;
+        const buttons = [songSelectionAdd, songSelectionRemove];
+        buttons.forEach(b => { if (b) b.disabled = true; });
+        postPlaylistBatch(ids.map(id => ({op: action, id: id}))).then(data => {
+            buttons.forEach(b => { if (b) b.disabled = false; });
+            if (!data || !data.success) {
+                printLog('Failed to modify upl: ' + (data && data.error ? data.error : 'unknown'));
+                return;
+            }
+            ids.forEach(id => {
+                const item = selectedSongs.get(id);
+                if (item) item.upl = action === 'add';
+                const controls = songRowControls.get(id);
+                if (controls) {
+                    controls.it.upl = action === 'add';
+                    controls.addBtn.textContent = action === 'add' ? 'Remove' : 'Add';
+                    controls.checkbox.checked = false;
+                }
+            });
+            const changed = (data.applied || []).filter(Boolean).length;
+            printLog((action === 'add' ? 'Added ' : 'Removed ') + changed + ' song' + (changed === 1 ? '' : 's') + ' ' + (action === 'add' ? 'to' : 'from') + ' upl');
+            selectedSongs.clear();
+            renderSelectionBar();
+        }).catch(e => {
+            buttons.forEach(b => { if (b) b.disabled = false; });
+            printLog('Network error modifying upl: ' + e);
+        });
+    }
+
+    if (songSelectionAdd) songSelectionAdd.onclick = () => applySelection('add');
+    if (songSelectionRemove) songSelectionRemove.onclick = () => applySelection('remove');
+    if (songSelectionClear) songSelectionClear.onclick = () => {
+        selectedSongs.clear();
+        songRowControls.forEach(controls => { controls.checkbox.checked = false; });
+        renderSelectionBar();
+    };
+
+    function renderResults(items, append) {
+        if (!append) {
+            songResults.innerHTML = '';
+            songRowControls = new Map();
+        }
         if (!items || items.length === 0) {
-            songResults.textContent = 'No songs found';
+            if (!append) songResults.textContent = 'No songs found';
             return;
         }
         items.forEach(it => {
@@ -190,9 +263,45 @@ document.addEventListener('DOMContentLoaded', function() {
             row.style.padding = '6px 8px';
             row.style.borderBottom = '1px solid #f0f0f0';
 
+            const checkbox = document.createElement('input');
+            checkbox.type = 'checkbox';
+            checkbox.title = 'Select';
+            checkbox.style.marginRight = '8px';
+            checkbox.style.flex = '0 0 auto';
+            checkbox.checked = selectedSongs.has(it.id);
+            checkbox.onchange = () => {
+                if (checkbox.checked) selectedSongs.set(it.id, it);
+                else selectedSongs.delete(it.id);
+                renderSelectionBar();
+            };
+
             const title = document.createElement('div');
             title.textContent = it.display;
             title.style.flex = '1';
+            // lyric searches show the words around the match
+            if (it.lyrics) {
+                const lyric = document.createElement('div');
+                lyric.textContent = it.lyrics;
+                lyric.style.fontSize = '0.85em';
+                lyric.style.fontStyle = 'italic';
+                lyric.style.color = '#777';
+                title.appendChild(lyric);
+            }
+
+            // cover thumbnails are cached forever by their versioned URL
+            let cover = null;
+            if (it.cover_url) {
+                cover = document.createElement('img');
+                cover.src = it.cover_url;
+                cover.loading = 'lazy';
+                cover.alt = '';
+                cover.width = 40;
+                cover.height = 40;
+                cover.style.objectFit = 'cover';
+                cover.style.marginRight = '8px';
+                cover.style.flex = '0 0 auto';
+                cover.onerror = () => { cover.style.visibility = 'hidden'; };
+            }
 
             const actions = document.createElement('div');
             actions.style.flex = '0 0 auto';
@@ -338,37 +447,222 @@ document.addEventListener('DOMContentLoaded', function() {
 
             actions.appendChild(previewContainer);
             actions.appendChild(addBtn);
+            if (it.id) {
+                songRowControls.set(it.id, {it: it, addBtn: addBtn, checkbox: checkbox});
+                row.appendChild(checkbox);
+            }
+            if (cover) row.appendChild(cover);
             row.appendChild(title);
             row.appendChild(actions);
             songResults.appendChild(row);
         });
     }
 
-    function searchSongs(q) {
-        songResults.textContent = 'Searching...';
-        fetch('/songs/search?q=' + encodeURIComponent(q) + '&per_page=100')
+    let lastSongQuery = null;
+    let lastSongId = null;
+
+    const SONG_PAGE_SIZE = 50;
+
+    // Facet filters; their options and counts come with each first result page
+    const SONG_FACETS = [['language', 'Language'], ['genre', 'Genre'], ['decade', 'Decade'], ['duet', 'Duet'], ['video', 'Video']];
+    const songFacetSelects = {};
+
+    function renderFacetFilters(counts) {
+        if (!songFacets || !counts) return;
+        SONG_FACETS.forEach(([facet, label]) => {
+            let select = songFacetSelects[facet];
+            if (!select) {
+                select = document.createElement('select');
+                select.style.flex = '1 1 100px';
+                select.style.minWidth = '0';
+                select.onchange = () => searchSongs(songSearchInput.value.trim());
+                songFacetSelects[facet] = select;
+                songFacets.appendChild(select);
+            }
+            const values = counts[facet] || {};
+            const current = select.value;
+            select.innerHTML = '';
+            const any = document.createElement('option');
+            any.value = '';
+            any.textContent = label + ': any';
+            select.appendChild(any);
+            const names = Object.keys(values).sort();
+            // keep a selection that the other filters narrowed down to nothing
+            if (current && !(current in values)) names.push(current);
+            names.forEach(value => {
+                const opt = document.createElement('option');
+                opt.value = value;
+                opt.textContent = value + ' (' + (values[value] || 0) + ')';
+                select.appendChild(opt);
+            });
+            select.value = current;
+        });
+    }
+
+    function songSearchUrl(q, cursor, songId) {
+        let url = '/songs/search?q=' + encodeURIComponent(q) + '&fields=compact&limit=' + SONG_PAGE_SIZE;
+        if (songId) url += '&id=' + encodeURIComponent(songId);
+        if (songLyricsToggle && songLyricsToggle.checked) url += '&scope=lyrics';
+        Object.keys(songFacetSelects).forEach(facet => {
+            const value = songFacetSelects[facet].value;
+            if (value) url += '&' + facet + '=' + encodeURIComponent(value);
+        });
+        if (cursor) url += '&cursor=' + encodeURIComponent(cursor);
+        else url += '&facets=1';
+        return url;
+    }
+
+    // "Load more" fetches the next page with the cursor of the previous one
+    function renderMoreButton(q, cursor, songId) {
+        if (!cursor) return;
+        const more = document.createElement('button');
+        more.textContent = 'Load more';
+        more.style.margin = '8px auto';
+        more.style.display = 'block';
+        more.onclick = () => {
+            more.disabled = true;
+            fetch(songSearchUrl(q, cursor, songId))
+                .then(r=>r.json()).then(data=>{
+                    more.remove();
+                    if (data.success) {
+                        renderResults(data.items, true);
+                        renderMoreButton(q, data.next_cursor, songId);
+                    } else if (data.version !== undefined) {
+                        // the library changed since the first page
+                        searchSongs(q, true, songId);
+                    } else {
+                        printLog('Loading more songs failed: ' + (data.error || 'unknown'));
+                    }
+                }).catch(e=>{ more.disabled = false; printLog('Search error: '+e); });
+        };
+        songResults.appendChild(more);
+    }
+
+    // songId (from a picked suggestion) shows just that song
+    function searchSongs(q, quiet, songId) {
+        lastSongQuery = q;
+        lastSongId = songId || null;
+        if (!quiet) songResults.textContent = 'Searching...';
+        fetch(songSearchUrl(q, null, songId))
             .then(r=>r.json()).then(data=>{
-                if (data.success) renderResults(data.items);
+                if (data.success) {
+                    renderResults(data.items);
+                    renderMoreButton(q, data.next_cursor, songId);
+                    renderFacetFilters(data.facets);
+                }
                 else songResults.textContent = 'Search failed';
             }).catch(e=>{ songResults.textContent = 'Network error'; printLog('Search error: '+e); });
     }
 
-    if (songSearchBtn) songSearchBtn.onclick = () => searchSongs(songSearchInput.value.trim());
-    if (songClearBtn) songClearBtn.onclick = () => { songSearchInput.value=''; songResults.innerHTML=''; songPreview.style.display='none'; };
+    // As-you-type suggestions: small [id, label] pairs from /songs/suggest
+    let suggestTimer = null;
+    let suggestController = null;
+    let suggestSeq = 0;
+
+    function hideSuggestions() {
+        if (suggestTimer) { clearTimeout(suggestTimer); suggestTimer = null; }
+        suggestSeq++;
+        if (!songSuggestions) return;
+        songSuggestions.innerHTML = '';
+        songSuggestions.style.display = 'none';
+    }
+
+    function renderSuggestions(items) {
+        if (!songSuggestions) return;
+        songSuggestions.innerHTML = '';
+        if (!items || items.length === 0) {
+            songSuggestions.style.display = 'none';
+            return;
+        }
+        items.forEach(pair => {
+            const songId = pair[0];
+            const label = pair[1];
+            const row = document.createElement('div');
+            row.textContent = label;
+            row.style.padding = '8px 10px';
+            row.style.cursor = 'pointer';
+            row.style.borderBottom = '1px solid #f0f0f0';
+            // mousedown fires before the input loses focus
+            row.addEventListener('mousedown', (e) => {
+                e.preventDefault();
+                songSearchInput.value = label;
+                hideSuggestions();
+                searchSongs(label, false, songId);
+            });
+            songSuggestions.appendChild(row);
+        });
+        songSuggestions.style.display = 'block';
+    }
+
+    function requestSuggestions(q) {
+        if (suggestController) {
+            try { suggestController.abort(); } catch(e){}
+            suggestController = null;
+        }
+        if (!q) { hideSuggestions(); return; }
+        const seq = ++suggestSeq;
+        suggestController = (typeof AbortController !== 'undefined') ? new AbortController() : null;
+        fetch('/songs/suggest?q=' + encodeURIComponent(q) + '&limit=8', suggestController ? {signal: suggestController.signal} : {})
+            .then(r=>r.json()).then(data=>{
+                // ignore responses for older keystrokes
+                if (seq !== suggestSeq) return;
+                if (data && data.success) renderSuggestions(data.items);
+            }).catch(e=>{ if (!(e && e.name === 'AbortError')) printLog('Suggest error: '+e); });
+    }
+
+    if (songSearchBtn) songSearchBtn.onclick = () => { hideSuggestions(); searchSongs(songSearchInput.value.trim()); };
+    if (songLyricsToggle) songLyricsToggle.onchange = () => {
+        songSearchInput.placeholder = songLyricsToggle.checked ? 'Search lyrics (a line you remember)' : 'Search songs (artist or title)';
+        hideSuggestions();
+        if (songSearchInput.value.trim()) searchSongs(songSearchInput.value.trim());
+    };
+    if (songClearBtn) songClearBtn.onclick = () => { songSearchInput.value=''; songResults.innerHTML=''; songPreview.style.display='none'; hideSuggestions(); lastSongQuery = null; lastSongId = null; Object.values(songFacetSelects).forEach(s => { s.value = ''; }); };
     // allow pressing Enter in the search input to trigger search
     if (songSearchInput) {
         songSearchInput.addEventListener('keydown', (e) => {
             if (e.key === 'Enter') {
                 e.preventDefault();
                 if (songSearchBtn) songSearchBtn.click();
+            } else if (e.key === 'Escape') {
+                hideSuggestions();
             }
         });
+        songSearchInput.addEventListener('input', () => {
+            if (suggestTimer) clearTimeout(suggestTimer);
+            // suggestions complete titles, not lyrics
+            if (songLyricsToggle && songLyricsToggle.checked) { hideSuggestions(); return; }
+            const q = songSearchInput.value.trim();
+            suggestTimer = setTimeout(() => requestSuggestions(q), 120);
+        });
+        songSearchInput.addEventListener('blur', () => setTimeout(hideSuggestions, 150));
     }
 
     // When Songs tab is activated, ensure panel shows
     if (tabSongs) tabSongs.addEventListener('click', () => {
         if (songsPanel) songsPanel.style.display = 'flex';
     });
+
+    // Song library updates (--watch-songs): re-run the shown search when the
+    // catalog version changes, unless a preview is playing in the results.
+    try {
+        if (typeof EventSource !== 'undefined') {
+            let songsVersion = null;
+            const songsEs = new EventSource('/songs/stream');
+            songsEs.addEventListener('message', (ev) => {
+                try {
+                    const payload = JSON.parse(ev.data || '{}');
+                    if (payload.version === undefined) return;
+                    const changed = songsVersion !== null && payload.version !== songsVersion;
+                    songsVersion = payload.version;
+                    if (changed) {
+                        printLog('Song library updated (' + payload.count + ' songs)');
+                        if (lastSongQuery !== null && !window._currentAudio) searchSongs(lastSongQuery, true, lastSongId);
+                    }
+                } catch (e) { /* ignore parse errors */ }
+            });
+            songsEs.addEventListener('error', () => { songsEs.close(); });
+        }
+    } catch (e) { printLog('Songs SSE not available: ' + e); }
 });
 // other globals
 startButton = undefined
@@ -2441,7 +2735,94 @@ document.addEventListener('DOMContentLoaded', function() {
         const playlistAutoAddNote = document.getElementById('playlistAutoAddNote');
         const playlistCountdownConfiguredEl = document.getElementById('playlistCountdownConfigured');
         const playlistCountdownStateEl = document.getElementById('playlistCountdownState');
+        const playlistItemsEl = document.getElementById('playlistItems');
+        const playlistQueueCountEl = document.getElementById('playlistQueueCount');
         let playlistStatusData = null;
+        // Queue list; reloaded whenever the status reports a new playlist version
+        let playlistItemsVersion = null;
+        let playlistItemsIndex = null;
+        let playlistItemsLoading = false;
+        let playlistDragIndex = null;
+
+        async function fetchPlaylistItems() {
+            if (!playlistItemsEl || playlistItemsLoading) return;
+            playlistItemsLoading = true;
+            try {
+                const res = await fetch('/playlist/items', {credentials: 'include'});
+                const body = await res.json();
+                if (body && body.success) {
+                    renderPlaylistItems(body.items || [], body.current_index || 0);
+                    playlistItemsVersion = body.version;
+                    playlistItemsIndex = body.current_index || 0;
+                }
+            } catch (err) {
+                printLog('Playlist items error: ' + err.message);
+            } finally {
+                playlistItemsLoading = false;
+            }
+        }
+
+        async function movePlaylistItem(from, to) {
+            if (from === to) return;
+            try {
+                const body = await postPlaylistBatch([{op: 'move', from: from, to: to}], playlistItemsVersion);
+                if (!body || !body.success) {
+                    printLog('Playlist reorder failed: ' + (body && body.error ? body.error : 'unknown'));
+                }
+            } catch (err) {
+                printLog('Playlist reorder error: ' + err.message);
+            }
+            fetchPlaylistItems();
+        }
+
+        function renderPlaylistItems(items, currentIndex) {
+            if (playlistQueueCountEl) playlistQueueCountEl.textContent = String(items.length);
+            playlistItemsEl.innerHTML = '';
+            items.forEach((line, index) => {
+                const li = document.createElement('li');
+                li.style.display = 'flex';
+                li.style.alignItems = 'center';
+                li.style.gap = '6px';
+                li.style.padding = '4px 0';
+                li.style.borderBottom = '1px solid #f3f4f6';
+                const label = document.createElement('span');
+                label.textContent = line;
+                label.style.flex = '1';
+                li.appendChild(label);
+                // songs already sung stay where they are
+                if (index < currentIndex) {
+                    li.style.color = '#9ca3af';
+                    playlistItemsEl.appendChild(li);
+                    return;
+                }
+                li.draggable = true;
+                li.style.cursor = 'grab';
+                li.addEventListener('dragstart', (ev) => {
+                    playlistDragIndex = index;
+                    if (ev.dataTransfer) ev.dataTransfer.effectAllowed = 'move';
+                });
+                li.addEventListener('dragover', (ev) => {
+                    if (playlistDragIndex !== null) ev.preventDefault();
+                });
+                li.addEventListener('drop', (ev) => {
+                    ev.preventDefault();
+                    const from = playlistDragIndex;
+                    playlistDragIndex = null;
+                    if (from !== null) movePlaylistItem(from, index);
+                });
+                li.addEventListener('dragend', () => { playlistDragIndex = null; });
+                // buttons for touch screens, where dragging is not available
+                [['▲', index - 1], ['▼', index + 1]].forEach(([text, to]) => {
+                    const btn = document.createElement('button');
+                    btn.textContent = text;
+                    btn.style.padding = '2px 8px';
+                    btn.disabled = to < currentIndex || to >= items.length;
+                    btn.onclick = () => movePlaylistItem(index, to);
+                    li.appendChild(btn);
+                });
+                playlistItemsEl.appendChild(li);
+            });
+        }
 
         function renderPlaylistState(data) {
             if (!data) return;
@@ -2465,14 +2846,10 @@ document.addEventListener('DOMContentLoaded', function() {
                 const configured = Number(data.countdown_seconds);
                 playlistCountdownConfiguredEl.textContent = Number.isFinite(configured) && configured > 0 ? `${configured} s` : '—';
             }
-            if (playlistCountdownStateEl) {
-                const remaining = Number(data.countdown_remaining);
-                if (data.countdown_active && Number.isFinite(remaining)) {
-                    playlistCountdownStateEl.textContent = `${Math.max(0, remaining)} s remaining`;
-                } else {
-                    playlistCountdownStateEl.textContent = data.status_text || 'Idle';
-                }
+            if (Number.isFinite(Number(data.server_time))) {
+                playlistClockOffset = Number(data.server_time) - Date.now() / 1000;
             }
+            renderPlaylistCountdown();
             if (playlistToggleBtn) {
                 playlistToggleBtn.textContent = data.enabled ? 'Disable Playlist Mode' : 'Enable Playlist Mode';
             }
@@ -2482,11 +2859,34 @@ document.addEventListener('DOMContentLoaded', function() {
             if (playlistAutoAddNote) {
                 playlistAutoAddNote.textContent = data.auto_added ? `Auto-added ${data.auto_added} random song${data.auto_added === 1 ? '' : 's'}` : '';
             }
+            if (data.playlist_version !== undefined
+                && (data.playlist_version !== playlistItemsVersion || (data.current_index || 0) !== playlistItemsIndex)) {
+                fetchPlaylistItems();
+            }
             if (window.__setPlaylistControlsLocked) {
                 window.__setPlaylistControlsLocked(!!data.lock_controls);
             }
         }
 
+        // Countdowns run locally from the server's deadline; the offset
+        // corrects for the difference between the server and device clocks.
+        let playlistClockOffset = 0;
+        function renderPlaylistCountdown() {
+            const data = playlistStatusData;
+            if (!playlistCountdownStateEl || !data) return;
+            const deadline = Number(data.countdown_deadline);
+            let remaining = Number(data.countdown_remaining);
+            if (data.countdown_deadline !== undefined) {
+                remaining = data.countdown_deadline === null ? 0
+                    : Math.max(0, Math.floor(deadline - (Date.now() / 1000 + playlistClockOffset)));
+            }
+            if (Number.isFinite(remaining) && remaining > 0) {
+                playlistCountdownStateEl.textContent = `${remaining} s remaining`;
+            } else {
+                playlistCountdownStateEl.textContent = data.status_text || 'Idle';
+            }
+        }
+
         let playlistFetchInFlight = false;
         let lastPlaylistFetch = 0;
         async function fetchPlaylistStatus(force=false) {
@@ -2551,8 +2951,23 @@ document.addEventListener('DOMContentLoaded', function() {
             });
         }
 
-        fetchPlaylistStatus(true);
-        setInterval(() => fetchPlaylistStatus(false), 1000);
+        // Status changes are pushed over /playlist/stream; polling is only
+        // the fallback for browsers without EventSource.
+        if (typeof EventSource !== 'undefined') {
+            // each (re)connect starts with the current status
+            const playlistEvents = new EventSource('/playlist/stream');
+            playlistEvents.onmessage = (ev) => {
+                try {
+                    renderPlaylistState(JSON.parse(ev.data));
+                } catch (e) {
+                    printLog('Playlist stream error: ' + e);
+                }
+            };
+            setInterval(renderPlaylistCountdown, 500);
+        } else {
+            fetchPlaylistStatus(true);
+            setInterval(() => fetchPlaylistStatus(false), 1000);
+        }
     }
 
     // Poll control status every 2s
@@ -0,0 +1,113 @@
+"""LogTailer: following a growing, rotated or rewritten log file."""
+
+import os
+import time
+
+import pytest
+
+from file_watch import LogTailer
+
+
+def wait_for(lines, count, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while len(lines) < count and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return lines
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / 'Error.log')
+
+
+def manual_tailer(path, lines):
+    # driven by calling _sync() directly, so every step is deterministic
+    return LogTailer(lambda: path, lines.append, use_inotify=False)
+
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_log_created_after_start_is_read_from_the_top(log_path, use_inotify):
+    lines = []
+    tailer = LogTailer(lambda: log_path, lines.append, poll_interval=0.05, use_inotify=use_inotify).start()
+    try:
+        time.sleep(0.2)
+        with open(log_path, 'w') as fh:
+            fh.write('first\nsecond\n')
+        assert wait_for(lines, 2) == ['first', 'second']
+    finally:
+        tailer.stop()
+
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_existing_log_is_followed_from_its_end(log_path, use_inotify):
+    with open(log_path, 'w') as fh:
+        fh.write('old\n')
+    lines = []
+    tailer = LogTailer(lambda: log_path, lines.append, poll_interval=0.05, use_inotify=use_inotify).start()
+    try:
+        time.sleep(0.2)
+        with open(log_path, 'a') as fh:
+            fh.write('new\n')
+        assert wait_for(lines, 1) == ['new']
+    finally:
+        tailer.stop()
+
+
+def test_partial_line_is_held_back_until_its_newline(log_path):
+    lines = []
+    tailer = manual_tailer(log_path, lines)
+    tailer._sync()
+    with open(log_path, 'w') as fh:
+        fh.write('complete\nhalf')
+    tailer._sync()
+    assert lines == ['complete']
+    with open(log_path, 'a') as fh:
+        fh.write(' line\n')
+    tailer._sync()
+    assert lines == ['complete', 'half line']
+
+
+def test_rotation_finishes_the_old_file_then_reads_the_new_one(log_path):
+    lines = []
+    tailer = manual_tailer(log_path, lines)
+    tailer._sync()
+    with open(log_path, 'w') as fh:
+        fh.write('one\n')
+    tailer._sync()
+    with open(log_path, 'a') as fh:
+        fh.write('two\n')
+    os.rename(log_path, log_path + '.1')
+    with open(log_path, 'w') as fh:
+        fh.write('three\n')
+    tailer._sync()
+    assert lines == ['one', 'two', 'three']
+
+
+def test_truncated_log_is_read_from_the_top(log_path):
+    lines = []
+    tailer = manual_tailer(log_path, lines)
+    tailer._sync()
+    with open(log_path, 'w') as fh:
+        fh.write('a long first line\n')
+    tailer._sync()
+    with open(log_path, 'w') as fh:
+        fh.write('short\n')
+    tailer._sync()
+    assert lines == ['a long first line', 'short']
+
+
+def test_in_place_rewrite_that_outgrows_the_old_offset_is_read_from_the_top(log_path):
+    lines = []
+    tailer = manual_tailer(log_path, lines)
+    tailer._sync()
+    with open(log_path, 'w') as fh:
+        fh.write('start\n')
+    tailer._sync()
+    inode = os.stat(log_path).st_ino
+    # same inode, and longer than before by the time the tailer looks again
+    with open(log_path, 'r+') as fh:
+        fh.truncate(0)
+        fh.write('123456789-0123456789\nnext\n')
+    assert os.stat(log_path).st_ino == inode
+    tailer._sync()
+    assert lines == ['start', '123456789-0123456789', 'next']
@@ -0,0 +1,75 @@
+"""Byte ranges and revalidation of the media routes (/static/*.mp4, /songs/preview)."""
+
+import argparse
+import os
+
+import pytest
+
+server = pytest.importorskip('server')
+song_index = server.song_index
+
+PAYLOAD = bytes(range(256)) * 8
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    static_dir = tmp_path / 'static'
+    static_dir.mkdir()
+    (static_dir / 'clip.mp4').write_bytes(PAYLOAD)
+    (tmp_path / 'secret.mp4').write_bytes(b'outside the static directory')
+    song_dir = tmp_path / 'usdx' / 'songs' / 'Artist - Title'
+    song_dir.mkdir(parents=True)
+    (song_dir / 'song.m4a').write_bytes(PAYLOAD)
+    (tmp_path / 'usdx' / 'songs-other').mkdir()
+    (tmp_path / 'usdx' / 'songs-other' / 'song.m4a').write_bytes(PAYLOAD)
+
+    monkeypatch.setattr(server, 'STATIC_DIR', str(static_dir))
+    monkeypatch.setattr(server, 'DATA_DIR', str(tmp_path / 'data'))
+    monkeypatch.setattr(server, 'args', argparse.Namespace(
+        usdx_dir=str(tmp_path / 'usdx'), audio_format='m4a', preview_cache_mb=10, cover_cache_mb=10), raising=False)
+    # no clip is built; the tests ask for the whole track
+    monkeypatch.setattr(server, 'preview_clip_path', lambda entry, source: None)
+    catalog = song_index.SongCatalog([
+        {'id': 1, 'txt': str(song_dir / 'song.txt'), 'audio': str(song_dir / 'song.m4a'),
+         'artist': 'Artist', 'title': 'Title', 'display': 'Artist - Title'},
+        {'id': 2, 'txt': str(tmp_path / 'usdx' / 'songs-other' / 'song.txt'),
+         'audio': str(tmp_path / 'usdx' / 'songs-other' / 'song.m4a'), 'display': 'Other'},
+    ])
+    monkeypatch.setattr(server, 'SONG_CATALOG', catalog)
+    return server.app.test_client()
+
+
+@pytest.mark.parametrize('url', ['/static/clip.mp4', '/songs/preview?id=1&full=1'])
+def test_range_returns_exact_slice(client, url):
+    response = client.get(url, headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == PAYLOAD[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(PAYLOAD)}'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+
+@pytest.mark.parametrize('url', ['/static/clip.mp4', '/songs/preview?id=1&full=1'])
+def test_etag_revalidation(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == PAYLOAD
+    etag = response.headers['ETag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+
+@pytest.mark.parametrize('url', ['/static/clip.mp4', '/songs/preview?id=1&full=1'])
+def test_unsatisfiable_range(client, url):
+    response = client.get(url, headers={'Range': f'bytes={len(PAYLOAD) + 10}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(PAYLOAD)}'
+
+
+def test_static_path_traversal(client):
+    assert client.get('/static/%2e%2e/secret.mp4').status_code == 404
+    assert client.get('/static/missing.mp4').status_code == 404
+
+
+def test_preview_outside_songs_directory(client):
+    # a sibling of songs/ shares its name as a prefix but is not inside it
+    assert client.get('/songs/preview?id=2&full=1').status_code == 403
+    assert client.get('/songs/preview?id=99&full=1').status_code == 404
@@ -0,0 +1,39 @@
+"""SongCatalog lookups, resident and memory-mapped."""
+
+import pytest
+
+import song_index
+
+ENTRIES = [
+    {'id': 1, 'txt': 'songs/Abba - Waterloo/song.txt', 'artist': 'Abba', 'title': 'Waterloo'},
+    {'id': 2, 'txt': 'songs/Yes - Yo/song.txt', 'artist': 'Yes', 'title': 'Yo'},
+    {'id': 3, 'txt': 'songs/Band - Love Song/song.txt', 'artist': 'Band', 'title': 'Love Song'},
+]
+
+
+@pytest.fixture(params=['resident', 'mapped'])
+def catalog(request, tmp_path):
+    catalog = song_index.SongCatalog(ENTRIES)
+    if request.param == 'mapped':
+        catalog = song_index.publish_catalog(catalog, str(tmp_path))
+        assert isinstance(catalog, song_index.MappedSongCatalog)
+    return catalog
+
+
+def test_row_of_label(catalog):
+    assert catalog.row_of_label('Band : Love Song') == 2
+    # titles shorter than a trigram are found too
+    assert catalog.row_of_label('Yes : Yo') == 1
+    assert catalog.find_by_label('Abba : Waterloo').id == 1
+    assert catalog.row_of_label('Abba : Missing') is None
+    assert catalog.row_of_label('') is None
+
+
+def test_row_of_label_searches_once_per_label(catalog, monkeypatch):
+    calls = []
+    search_rows = catalog.search_rows
+    monkeypatch.setattr(catalog, 'search_rows', lambda query: calls.append(query) or search_rows(query))
+    for _ in range(3):
+        assert catalog.row_of_label('Abba : Waterloo') == 0
+        assert catalog.row_of_label('Abba : Missing') is None
+    assert calls == ['Waterloo', 'Missing', 'Abba : Missing']
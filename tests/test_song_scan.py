@@ -0,0 +1,49 @@
+"""Incremental song scans: what a rescan notices without relisting directories."""
+
+import os
+
+import song_index
+
+
+def write_song(path, artist, title):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(f'#ARTIST:{artist}\n#TITLE:{title}\n#MP3:song.m4a\n: 0 4 0 la\nE\n', encoding='utf-8')
+
+
+def titles(entries):
+    return {e['display']: e['id'] for e in entries}
+
+
+def scan(tmp_path, **kwargs):
+    stats = song_index.ScanStats()
+    entries = song_index.scan_library(str(tmp_path / 'songs'), str(tmp_path), str(tmp_path / 'data'),
+                                      stats=stats, **kwargs)
+    return entries, stats
+
+
+def test_song_edited_in_place_is_reparsed_on_the_next_scan(tmp_path):
+    song = tmp_path / 'songs' / 'Band' / 'song.txt'
+    write_song(song, 'Band', 'Old')
+    write_song(tmp_path / 'songs' / 'Other' / 'song.txt', 'Other', 'Song')
+    entries, _ = scan(tmp_path)
+    old_id = titles(entries)['Band - Old']
+
+    dir_mtime = os.stat(song.parent).st_mtime_ns
+    with open(song, 'r+', encoding='utf-8') as fh:
+        fh.write('#ARTIST:Band\n#TITLE:Renamed\n#MP3:song.m4a\n: 0 4 0 la\nE\n')
+    assert os.stat(song.parent).st_mtime_ns == dir_mtime
+
+    entries, stats = scan(tmp_path)
+    assert titles(entries) == {'Band - Renamed': old_id, 'Other - Song': titles(entries)['Other - Song']}
+    assert stats.changed == 1 and stats.added == 0
+
+
+def test_unchanged_library_is_not_rewritten(tmp_path):
+    write_song(tmp_path / 'songs' / 'Band' / 'song.txt', 'Band', 'Title')
+    scan(tmp_path)
+    index_file = tmp_path / 'data' / song_index.INDEX_FILENAME
+    written = os.stat(index_file).st_mtime_ns
+    entries, stats = scan(tmp_path)
+    assert not stats.modified and not stats.parsed
+    assert os.stat(index_file).st_mtime_ns == written
+    assert titles(entries) == {'Band - Title': 1}